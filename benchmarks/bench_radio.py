@@ -0,0 +1,426 @@
+'''
+Headless benchmarks of the spmenu radio rendering and response paths.
+
+Runs against the stand-in EventScripts modules in benchmarks/standins, so
+no game server is needed. Every case is run for each number of simulated
+players and each menu size, one round does the benchmarked operation once
+per player. The best round of --repeat rounds is reported.
+
+Usage:
+    python benchmarks/bench_radio.py [options] > results.json
+    python benchmarks/bench_radio.py --compare old.json new.json
+
+The results are JSON:
+    {"meta": {...}, "results": [{"case": ..., "players": ..., "options": ...,
+        "round_s": ..., "per_op_us": ..., "menu_calls": ...,
+        "menu_bytes": ...}, ...]}
+'''
+import optparse
+import os
+import platform
+import subprocess
+import sys
+import time
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.join(BENCH_DIR, 'standins'), os.path.dirname(BENCH_DIR)]
+
+import es
+import gamethread
+import playerlib
+
+import spmenu
+from spmenu import radio
+
+
+# the simulated players use these languages in turn
+LANGUAGES = ('en', 'fi', 'de', 'fr')
+
+
+def _setup_players(players):
+    '''Reset the popup state and return the _User instances of the players.'''
+    es.addons.fire('es_map_start', {})
+    usermanager = spmenu._usermanager
+    usermanager.users.clear()
+    playerlib.languages.clear()
+    for userid in xrange(1, players+1):
+        playerlib.languages[userid] = LANGUAGES[userid % len(LANGUAGES)]
+        es.addons.fire('player_activate', {'userid': str(userid)})
+    return [usermanager.users[userid] for userid in xrange(1, players+1)]
+
+
+def _paged_menu(options, cls=radio.PagedMenu, *args):
+    menu = cls(*args)
+    menu.title = 'Benchmark menu'
+    menu.description = 'Pick one'
+    for index in xrange(options):
+        menu.add(index, 'Option number %d'%index, index % 3 != 0)
+    return menu
+
+
+def _prepared(popup, users, page=True):
+    '''Return userpopups of the popup prepared for the users.'''
+    pages = page and popup.pages() or 0
+    userpopups = []
+    for index, user in enumerate(users):
+        userpopup = popup._get_userpopup(user)
+        if pages:
+            userpopup._prepare(index % pages + 1)
+        else:
+            userpopup._prepare()
+        userpopups.append(userpopup)
+    return userpopups
+
+
+# Benchmark cases, each takes the users and the menu size and returns the
+# function running one round.
+
+
+def case_paged_display_cold(users, options):
+    '''UserPagedMenu.display, the render cache is emptied every round.'''
+    menu = _paged_menu(options)
+    userpopups = _prepared(menu, users)
+    render_cache = menu._render_cache
+    def run():
+        render_cache.clear()
+        for userpopup in userpopups:
+            userpopup.display()
+    return run
+
+
+def case_paged_display_warm(users, options):
+    '''UserPagedMenu.display, the pages are rendered before the rounds.'''
+    menu = _paged_menu(options)
+    userpopups = _prepared(menu, users)
+    def run():
+        for userpopup in userpopups:
+            userpopup.display()
+    return run
+
+
+def case_personal_display(users, options):
+    '''UserPersonalMenu.display, build_callback adds one option.'''
+    def build_callback(userid, menu):
+        menu.add('own', 'Player %d'%userid)
+    menu = _paged_menu(options, radio.PersonalMenu, build_callback)
+    userpopups = _prepared(menu, users)
+    def run():
+        for userpopup in userpopups:
+            userpopup.display()
+    return run
+
+
+def _template_popup(options):
+    popup = radio.TemplatePopup()
+    popup.append('Hello $name')
+    popup.extend(['%d. Item %d for $$$price'%(index % 9 + 1, index)
+        for index in xrange(options)])
+    popup.append('Your score: ${score}')
+    return popup
+
+
+def case_template_display_shared(users, options):
+    '''UserTemplatePopup.display, every user has the same replacements.'''
+    popup = _template_popup(options)
+    userpopups = []
+    for user in users:
+        userpopup = popup._get_userpopup(user)
+        userpopup._prepare(name='everyone', price=10, score=0)
+        userpopups.append(userpopup)
+    def run():
+        for userpopup in userpopups:
+            userpopup.display()
+    return run
+
+
+def case_template_display_personal(users, options):
+    '''UserTemplatePopup.display, every user has own replacements.'''
+    popup = _template_popup(options)
+    userpopups = []
+    for user in users:
+        userpopup = popup._get_userpopup(user)
+        userpopup._prepare(name='Player %d'%user.userid, price=10,
+            score=user.userid)
+        userpopups.append(userpopup)
+    def run():
+        for userpopup in userpopups:
+            userpopup.display()
+    return run
+
+
+def _queued_menu(users, options, menuselect=None):
+    menu = _paged_menu(options)
+    menu.menuselect = menuselect
+    menu.send_many([user.userid for user in users])
+    return menu
+
+
+def case_got_response_page(users, options):
+    '''_User.got_response with next and previous page choices.'''
+    _queued_menu(users, options)
+    choices = [9]
+    def run():
+        choice = choices[0]
+        for user in users:
+            user.got_response(choice)
+        choices[0] = 17 - choice
+    return run
+
+
+def case_got_response_select(users, options):
+    '''_User.got_response choosing an option, menuselect returns the menu.'''
+    _queued_menu(users, options, lambda params: params['popup'])
+    def run():
+        for user in users:
+            user.got_response(2)
+    return run
+
+
+def case_got_response_select_event(users, options):
+    '''_User.got_response choosing an option, menuselect gets an event.'''
+    menu = _queued_menu(users, options, lambda event: event.popup)
+    menu.menuselect_event = True
+    def run():
+        for user in users:
+            user.got_response(2)
+    return run
+
+
+def case_ccf_page(users, options):
+    '''_UserManager.ccf with menuselect next and previous page commands.'''
+    _queued_menu(users, options)
+    ccf = spmenu._usermanager.ccf
+    userids = [user.userid for user in users]
+    commands = [['menuselect', '9']]
+    def run():
+        command = commands[0]
+        for userid in userids:
+            ccf(userid, command)
+        commands[0] = ['menuselect', command[1] == '9' and '8' or '9']
+    return run
+
+
+def case_ccf_page_limited(users, options):
+    '''_UserManager.ccf with bursts of next page commands over the limit.'''
+    _queued_menu(users, options)
+    ccf = spmenu._usermanager.ccf
+    userids = [user.userid for user in users]
+    command = ['menuselect', '9']
+    def run():
+        spmenu.set_menuselect_limit(10, 3)
+        try:
+            for press in xrange(10):
+                for userid in userids:
+                    ccf(userid, command)
+            # the end of the tick
+            gamethread.advance(0)
+        finally:
+            spmenu.set_menuselect_limit(0)
+    return run
+
+
+def case_ccf_other(users, options):
+    '''_UserManager.ccf with client commands that are not menuselect.'''
+    _queued_menu(users, options)
+    ccf = spmenu._usermanager.ccf
+    userids = [user.userid for user in users]
+    command = ['say', 'hello']
+    def run():
+        for userid in userids:
+            ccf(userid, command)
+    return run
+
+
+def _send_burst(users, options, deferred):
+    popups = [_paged_menu(options) for index in xrange(3)]
+    userids = [user.userid for user in users]
+    def run():
+        spmenu.set_deferred_display(deferred)
+        try:
+            for popup in popups:
+                popup.send_many(userids)
+            # the end of the tick
+            gamethread.advance(0)
+            for popup in popups:
+                for userid in userids:
+                    popup.unsend(userid)
+            gamethread.advance(0)
+        finally:
+            spmenu.set_deferred_display(False)
+    return run
+
+
+def case_send_burst_immediate(users, options):
+    '''Three popups sent to every player in a tick and unsent.'''
+    return _send_burst(users, options, False)
+
+
+def case_send_burst_deferred(users, options):
+    '''Three popups sent to every player in a tick with deferred display.'''
+    return _send_burst(users, options, True)
+
+
+def _set_debug(level):
+    '''Set eventscripts_debug like the server console would.'''
+    es.server_vars['eventscripts_debug'] = str(level)
+    es.addons.fire('server_cvar', {'cvarname': 'eventscripts_debug',
+        'cvarvalue': str(level)})
+
+
+def _with_debug(case, level=2):
+    '''
+    Return the case run with eventscripts_debug at level. The stand-in
+    es.dbgmsg prints nothing, so the cost of building the messages is
+    measured without the console output.
+    '''
+    def debug_case(users, options):
+        run = case(users, options)
+        def debug_run():
+            _set_debug(level)
+            try:
+                run()
+            finally:
+                _set_debug(0)
+        return debug_run
+    return debug_case
+
+
+CASES = (
+    ('UserPagedMenu.display[cold]', case_paged_display_cold),
+    ('UserPagedMenu.display[warm]', case_paged_display_warm),
+    ('UserPagedMenu.display[warm,debug]',
+        _with_debug(case_paged_display_warm)),
+    ('UserPersonalMenu.display', case_personal_display),
+    ('UserTemplatePopup.display[shared]', case_template_display_shared),
+    ('UserTemplatePopup.display[personal]', case_template_display_personal),
+    ('_User.got_response[page]', case_got_response_page),
+    ('_User.got_response[select]', case_got_response_select),
+    ('_User.got_response[select,debug]',
+        _with_debug(case_got_response_select)),
+    ('_User.got_response[select,event]', case_got_response_select_event),
+    ('_UserManager.ccf[menuselect]', case_ccf_page),
+    ('_UserManager.ccf[menuselect,limited]', case_ccf_page_limited),
+    ('_UserManager.ccf[other]', case_ccf_other),
+    ('send_many[immediate]', case_send_burst_immediate),
+    ('send_many[deferred]', case_send_burst_deferred),
+    )
+
+
+def run_case(name, case, players, options, repeat):
+    '''Run the case and return its result dict.'''
+    users = _setup_players(players)
+    run = case(users, options)
+    run() # warm up
+    best = None
+    for round in xrange(repeat):
+        es.reset_capture()
+        start = time.time()
+        run()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    # the simulated ticks run the delayed refreshes and timeouts
+    gamethread.advance(10)
+    return {
+        'case': name,
+        'players': players,
+        'options': options,
+        'round_s': best,
+        'per_op_us': best / players * 1e6,
+        'menu_calls': es.menu_calls,
+        'menu_bytes': es.menu_bytes,
+        }
+
+
+def _git_revision():
+    try:
+        process = subprocess.Popen(['git', 'rev-parse', 'HEAD'],
+            cwd=BENCH_DIR, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        return process.communicate()[0].strip() or None
+    except OSError:
+        return None
+
+
+def run_all(players, options, repeat, filter=None):
+    results = []
+    for name, case in CASES:
+        if filter and filter not in name:
+            continue
+        for player_count in players:
+            for option_count in options:
+                result = run_case(name, case, player_count, option_count,
+                    repeat)
+                sys.stderr.write('%-40s %4d players %6d options %10.1f us\n'%(
+                    name, player_count, option_count, result['per_op_us']))
+                results.append(result)
+    return {
+        'meta': {
+            'spmenu_version': spmenu.__version__,
+            'git_revision': _git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'repeat': repeat,
+            },
+        'results': results,
+        }
+
+
+def compare(old_file, new_file):
+    '''Print the per operation time ratios of two result files.'''
+    def load(filename):
+        data = json.load(open(filename))
+        return dict(((result['case'], result['players'], result['options']),
+            result) for result in data['results'])
+    old = load(old_file)
+    new = load(new_file)
+    keys = [key for key in sorted(new) if key in old]
+    for key in keys:
+        old_us = old[key]['per_op_us']
+        new_us = new[key]['per_op_us']
+        print '%-40s %4d players %6d options %10.1f -> %10.1f us %6.2fx'%(
+            key + (old_us, new_us, old_us / (new_us or 1e-9)))
+
+
+def _int_list(text):
+    return [int(value) for value in text.split(',')]
+
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage=__doc__.split('Usage:')[1].split(
+        'The results')[0].rstrip())
+    parser.add_option('--players', default='1,64,256',
+        help='comma separated numbers of players [%default]')
+    parser.add_option('--options', default='10,100,1000,10000',
+        help='comma separated menu sizes [%default]')
+    parser.add_option('--repeat', type='int', default=5,
+        help='rounds per case, the best is reported [%default]')
+    parser.add_option('--filter', default=None,
+        help='only run the cases with names containing this')
+    parser.add_option('--output', default=None,
+        help='write the results to this file instead of stdout')
+    parser.add_option('--compare', action='store_true', default=False,
+        help='compare two result files given as arguments')
+    opts, args = parser.parse_args(argv)
+    if opts.compare:
+        if len(args) != 2:
+            parser.error('--compare needs the old and the new result file')
+        compare(*args)
+        return
+    results = run_all(_int_list(opts.players), _int_list(opts.options),
+        opts.repeat, opts.filter)
+    if opts.output:
+        output = open(opts.output, 'w')
+    else:
+        output = sys.stdout
+    json.dump(results, output, indent=1, sort_keys=True)
+    output.write('\n')
+
+
+if __name__ == '__main__':
+    main()
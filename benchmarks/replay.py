@@ -0,0 +1,173 @@
+'''
+Replay a spmenu trace against the stand-in EventScripts modules.
+
+The trace is recorded on a server with spmenu_record (see spmenu_trace).
+Every recorded popup is replaced by a popup of the same class and size
+with generated content, and the recorded events are fed to the real
+_UserManager and _User code. The simulated game clock follows the trace
+times, so the delayed refreshes and timeouts happen as on the server.
+
+Usage:
+    python benchmarks/replay.py [options] trace > report.json
+
+The report is JSON with the latency and the es.menu volume per event type:
+    {"meta": {...}, "events": {"send": {"count": ..., "mean_us": ...,
+        "p50_us": ..., "p99_us": ..., "max_us": ..., "menu_calls": ...,
+        "menu_bytes": ...}, ...}, "total": {...}}
+'''
+import optparse
+import os
+import sys
+import time
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.join(BENCH_DIR, 'standins'), os.path.dirname(BENCH_DIR)]
+
+import es
+import gamethread
+
+import spmenu
+from spmenu import radio
+from spmenu import spmenu_trace
+
+
+def _build_popup(class_name, count):
+    '''Return a radio popup of the class with count generated items.'''
+    cls = getattr(radio, class_name, None)
+    if not (isinstance(cls, type) and issubclass(cls, radio.Popup)):
+        # a class of the scripts, replay it as a plain popup
+        cls = radio.Popup
+    if issubclass(cls, radio.LazyPagedMenu):
+        provider = radio.OptionColumns()
+        for index in xrange(count):
+            provider.append(index, 'Option %d'%index)
+        popup = cls(provider)
+    elif issubclass(cls, (radio.PersonalPopup, radio.PersonalMenu)):
+        popup = cls(lambda userid, userpopup, *args, **kw: None)
+    else:
+        popup = cls()
+    if isinstance(popup, radio.PagedMenu):
+        popup.title = 'Replayed %s'%class_name
+        if not isinstance(popup, radio.LazyPagedMenu):
+            for index in xrange(count):
+                popup.add(index, 'Option %d'%index)
+    else:
+        popup.extend(['Line %d'%index for index in xrange(count)])
+    return popup
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * fraction))
+    return sorted_values[index]
+
+
+def _summary(latencies, menu_calls, menu_bytes):
+    latencies.sort()
+    count = len(latencies)
+    return {
+        'count': count,
+        'mean_us': count and sum(latencies) / count * 1e6 or 0.0,
+        'p50_us': _percentile(latencies, 0.5) * 1e6,
+        'p99_us': _percentile(latencies, 0.99) * 1e6,
+        'max_us': count and latencies[-1] * 1e6 or 0.0,
+        'menu_calls': menu_calls,
+        'menu_bytes': menu_bytes,
+        }
+
+
+def replay(filename, speed=0.0):
+    '''
+    Replay the trace and return the report dict.
+
+    A speed of 0 replays as fast as possible, otherwise the events are
+    spaced by their recorded times divided by speed.
+    '''
+    usermanager = spmenu._usermanager
+    popups = {} # {popup number: replayed popup}
+    latencies = {} # {event type: [seconds,]}
+    volume = {} # {event type: [es.menu calls, bytes]}
+    clock = 0.0
+    wall_start = time.time()
+    for seconds, event, data in spmenu_trace.read_trace(filename):
+        if event == spmenu_trace.EVENT_POPUP:
+            number, count, class_name = data
+            popups[number] = _build_popup(class_name, count)
+            continue
+        if speed > 0:
+            delay = wall_start + seconds / speed - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        # run the refreshes and timeouts due before the event
+        gamethread.advance(seconds - clock)
+        clock = seconds
+        menu_calls = es.menu_calls
+        menu_bytes = es.menu_bytes
+        start = time.time()
+        if event == spmenu_trace.EVENT_SEND:
+            userid, number, page = data
+            if page:
+                popups[number].send(userid, page)
+            else:
+                popups[number].send(userid)
+        elif event == spmenu_trace.EVENT_UNSEND:
+            userid, number = data
+            popups[number].unsend(userid)
+        elif event == spmenu_trace.EVENT_MENUSELECT:
+            userid, choice = data
+            usermanager.ccf(userid, ['menuselect', str(choice)])
+        elif event == spmenu_trace.EVENT_DISCONNECT:
+            es.addons.fire('player_disconnect', {'userid': data[0]})
+        elif event == spmenu_trace.EVENT_MAP_START:
+            es.addons.fire('es_map_start', {})
+        latencies.setdefault(event, []).append(time.time() - start)
+        counts = volume.setdefault(event, [0, 0])
+        counts[0] += es.menu_calls - menu_calls
+        counts[1] += es.menu_bytes - menu_bytes
+    events = {}
+    all_latencies = []
+    for event, values in latencies.iteritems():
+        all_latencies.extend(values)
+        events[spmenu_trace.EVENT_NAMES[event]] = _summary(values,
+            *volume[event])
+    return {
+        'meta': {
+            'trace': filename,
+            'speed': speed,
+            'trace_seconds': clock,
+            'wall_seconds': time.time() - wall_start,
+            'popups': len(popups),
+            },
+        'events': events,
+        'total': _summary(all_latencies, es.menu_calls, es.menu_bytes),
+        }
+
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage=__doc__.split('Usage:')[1].split(
+        'The report')[0].rstrip())
+    parser.add_option('--speed', type='float', default=0.0,
+        help='replay speed, 1 for the original speed, 0 for as fast as '
+        'possible [%default]')
+    parser.add_option('--output', default=None,
+        help='write the report to this file instead of stdout')
+    opts, args = parser.parse_args(argv)
+    if len(args) != 1:
+        parser.error('give one trace file')
+    report = replay(args[0], opts.speed)
+    if opts.output:
+        output = open(opts.output, 'w')
+    else:
+        output = sys.stdout
+    json.dump(report, output, indent=1, sort_keys=True)
+    output.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,13 @@
+'''
+Stand-in for the EventScripts cmdlib module.
+'''
+
+server_commands = {} # {command name: callback,}
+
+
+def registerServerCommand(command, callback, description, skipcheck=False):
+    server_commands[command] = callback
+
+
+def unregisterServerCommand(command):
+    server_commands.pop(command, None)
@@ -0,0 +1,22 @@
+'''
+Stand-in for ConfigObj, reads the flat sections of an INI file.
+'''
+import codecs
+
+
+class Section(dict):
+    def as_int(self, key):
+        return int(self[key])
+
+
+class ConfigObj(dict):
+    def __init__(self, filename):
+        dict.__init__(self)
+        section = None
+        for line in codecs.open(filename, encoding='utf-8-sig'):
+            line = line.strip()
+            if line.startswith('['):
+                section = self.setdefault(line[1:-1], Section())
+            elif '=' in line and section is not None:
+                key, value = line.split('=', 1)
+                section[key.strip()] = value.strip().strip('"')
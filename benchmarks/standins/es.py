@@ -0,0 +1,98 @@
+'''
+Stand-in for the EventScripts es module.
+
+Captures the menus sent to users instead of displaying them.
+'''
+import sys
+
+debug_level = 0
+
+# menus sent by es.menu and es.escmenu
+menu_calls = 0
+menu_bytes = 0
+last_menu = {} # {userid: (duration, text, keys),}
+
+keygroups = {} # {keygroup name: {key name: {value name: value,},},}
+
+server_vars = {
+    'eventscripts_gamedir': '/srv/srcds/cstrike',
+    'eventscripts_debug': '0',
+    }
+
+
+def reset_capture():
+    global menu_calls, menu_bytes
+    menu_calls = 0
+    menu_bytes = 0
+    last_menu.clear()
+
+
+def menu(duration, userid, text, keys=''):
+    global menu_calls, menu_bytes
+    menu_calls += 1
+    menu_bytes += len(text)
+    last_menu[userid] = (duration, text, keys)
+
+
+def escmenu(duration, userid, keygroup):
+    global menu_calls
+    menu_calls += 1
+    last_menu[userid] = (duration, keygroup, None)
+
+
+def dbgmsg(level, text):
+    if level <= debug_level:
+        sys.stdout.write('%s\n'%text)
+
+
+def keygroupcreate(name):
+    keygroups[name] = {}
+
+
+def keygroupdelete(name):
+    del keygroups[name]
+
+
+def keycreate(keygroup, key):
+    keygroups[keygroup][key] = {}
+
+
+def keysetvalue(keygroup, key, name, value):
+    keygroups[keygroup][key][name] = value
+
+
+class ServerVar(object):
+    def __init__(self, name):
+        self.name = name
+
+    def __str__(self):
+        return server_vars.get(self.name, '0')
+
+    def __int__(self):
+        return int(str(self))
+
+
+class _Addons(object):
+    def __init__(self):
+        self.events = {} # {event name: [callback,],}
+        self.client_command_filters = []
+
+    def registerForEvent(self, addon, event, callback):
+        self.events.setdefault(event, []).append(callback)
+
+    def unregisterForEvent(self, addon, event):
+        self.events.pop(event, None)
+
+    def registerClientCommandFilter(self, callback):
+        self.client_command_filters.append(callback)
+
+    def unregisterClientCommandFilter(self, callback):
+        self.client_command_filters.remove(callback)
+
+    def fire(self, event, event_var):
+        '''Call the callbacks of the event with the event_var dict.'''
+        for callback in list(self.events.get(event, ())):
+            callback(event_var)
+
+
+addons = _Addons()
@@ -0,0 +1,32 @@
+'''
+Stand-in for the EventScripts gamethread module with a simulated clock.
+
+Delayed calls are run by advance(), which moves the clock forward.
+'''
+import heapq
+
+now = 0.0
+_queue = [] # heap of (due time, sequence, function, args, kw)
+_sequence = 0
+
+
+def delayed(seconds, function, args=(), kw=None):
+    global _sequence
+    _sequence += 1
+    heapq.heappush(_queue, (now + seconds, _sequence, function, args, kw or {}))
+
+
+def advance(seconds):
+    '''Run the delayed calls due in the next seconds.'''
+    global now
+    end = now + seconds
+    while _queue and _queue[0][0] <= end:
+        due, sequence, function, args, kw = heapq.heappop(_queue)
+        now = max(now, due)
+        function(*args, **kw)
+    now = end
+
+
+def pending():
+    '''Return the number of delayed calls waiting.'''
+    return len(_queue)
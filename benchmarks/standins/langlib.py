@@ -0,0 +1,28 @@
+'''
+Stand-in for the EventScripts langlib module.
+'''
+import codecs
+
+default_language = 'en'
+
+
+def getDefaultLang():
+    return default_language
+
+
+class Strings(dict):
+    '''{identifier: {language: text,},} read from an INI file.'''
+    def __init__(self, filename):
+        dict.__init__(self)
+        section = None
+        for line in codecs.open(filename, encoding='utf-8-sig'):
+            line = line.strip()
+            if line.startswith('['):
+                section = self.setdefault(line[1:-1], {})
+            elif '=' in line and section is not None:
+                language, text = line.split('=', 1)
+                section[language.strip()] = text.strip().strip('"')
+
+    def expand(self, identifier, tokens=None, lang=None):
+        strings = self[identifier]
+        return strings.get(lang, strings.get(default_language))
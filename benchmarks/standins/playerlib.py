@@ -0,0 +1,28 @@
+'''
+Stand-in for the EventScripts playerlib module.
+
+Every userid is a connected player, the players in bots are bots.
+'''
+
+languages = {} # {userid: language}, 'en' if not set
+bots = set()
+
+
+class UseridError(Exception):
+    pass
+
+
+class Player(object):
+    def __init__(self, userid):
+        self.userid = userid
+
+    def get(self, attribute):
+        if attribute == 'lang':
+            return languages.get(self.userid, 'en')
+        if attribute == 'isbot':
+            return int(self.userid in bots)
+        raise KeyError(attribute)
+
+
+def getPlayer(userid):
+    return Player(userid)
@@ -1,41 +1,106 @@
 '''
 More Pythonic and object oriented way to handle tasks previously
 handled by popuplib
+
+The popup backends (radio and vgui) are imported on first access, the
+default popup classes come from the backend of the detected game type.
+from spmenu import * imports only the default backend, the other backend is
+imported when spmenu.radio or spmenu.vgui is used.
 '''
 __version__ = '20120916_053411'
-import spmenu_radio as radio
-import spmenu_vgui as vgui
+import sys
+import types
+
 import spmenu_resources
 import spmenu_common
+import spmenu_stats
+import spmenu_trace
 
 
-_language_data = spmenu_resources.load_language_data(spmenu_resources)
+# the language data is loaded by spmenu_resources on first use
 _game_data = spmenu_resources.get_game_data(spmenu_resources)
 
 _usermanager = spmenu_common._usermanager
-# distribute common information
-radio._usermanager = _usermanager
-radio._language_data = _language_data
-vgui._usermanager = _usermanager
-vgui._language_data = _language_data
-
 spmenu_common._game_data = _game_data
 
 PopupSet = spmenu_common.PopupSet
 GroupedPopup = spmenu_common.GroupedPopup
 PopupGroup = spmenu_common.PopupGroup
 PopuplibError = spmenu_common.PopuplibError
+MenuSelectEvent = spmenu_common.MenuSelectEvent
+memory_report = spmenu_common.memory_report
+set_deferred_display = spmenu_common.set_deferred_display
+set_menuselect_limit = spmenu_common.set_menuselect_limit
+start_recording = spmenu_trace.start
+stop_recording = spmenu_trace.stop
+
+
+def register_commands():
+    '''
+    Register the spmenu_stats and spmenu_record server commands again after
+    unregister_commands, they are registered on import.
+    '''
+    spmenu_stats.register_command()
+    spmenu_trace.register_command()
+
+
+def unregister_commands():
+    '''Unregister the spmenu server commands, call when unloading.'''
+    spmenu_stats.unregister_command()
+    spmenu_trace.unregister_command()
+
+_backends = {
+    'radio': ('spmenu_radio',),
+    # the vgui popups are built on the radio popups
+    'vgui': ('spmenu_radio', 'spmenu_vgui'),
+    }
+''' _backends = {popup type: (module names to import in order),} '''
+
+# the type dependent names taken from the default backend
+_backend_names = ('Popup', 'TemplatePopup', 'PersonalPopup', 'PagedMenu',
+    'PagedList', 'PersonalMenu', 'LazyPagedMenu', 'LazyPagedList',
+    'MenuOption', 'OptionColumns', 'ASYNC_THREAD', 'ASYNC_FUTURE')
+
+# the backend modules are left out so that a star import does not load both
+__all__ = ['default_module', 'PopupSet', 'GroupedPopup', 'PopupGroup',
+    'PopuplibError', 'MenuSelectEvent', 'memory_report',
+    'set_deferred_display', 'set_menuselect_limit', 'start_recording',
+    'stop_recording', 'register_commands', 'unregister_commands'
+    ] + list(_backend_names)
+
+
+def _load_backend(popup_type):
+    '''Import the backend module of the popup type and return it.'''
+    for name in _backends[popup_type]:
+        module = __import__(name, globals(), locals(), [])
+        # distribute common information
+        module._usermanager = _usermanager
+    return module
+
+
+class _LazyModule(types.ModuleType):
+    '''
+    The spmenu package module, loads the backends on first access.
+
+    Replaces the package module in sys.modules. The attributes are looked up
+    here only if they are not found in the module, so the loaded values are
+    stored in the module and each backend is loaded only once.
+    '''
+    def __getattr__(self, name):
+        if name in _backends:
+            value = _load_backend(name)
+        elif name == 'default_module':
+            value = _load_backend(_game_data['type'])
+        elif name in _backend_names:
+            value = getattr(self.default_module, name)
+        else:
+            raise AttributeError("'module' object has no attribute '%s'"%name)
+        setattr(self, name, value)
+        return value
+
 
-# get default type dependent popup classes
-if _game_data['type'] == 'radio':
-    default_module = radio
-elif _game_data['type'] == 'vgui':
-    default_module = vgui
-
-Popup = default_module.Popup
-TemplatePopup = default_module.TemplatePopup
-PersonalPopup = default_module.PersonalPopup
-PagedMenu = default_module.PagedMenu
-PagedList = default_module.PagedList
-PersonalMenu = default_module.PersonalMenu
-MenuOption = default_module.MenuOption
+_module = _LazyModule(__name__, __doc__)
+_module.__dict__.update(sys.modules[__name__].__dict__)
+# keep the original module alive, its globals are used by the functions
+_module._original_module = sys.modules[__name__]
+sys.modules[__name__] = _module
@@ -1,7 +1,11 @@
 '''
 Common (game-independent) classes defined here.
 '''
-import pprint
+import math
+import Queue
+import sys
+import threading
+import time
 import weakref
 
 import es
@@ -68,8 +72,19 @@ class GroupedPopup(object):
             if popup is not self:
                 popup.unsend(userid)
 
+    def send_many(self, userids, *args, **kw):
+        '''
+        Send the popup to multiple users. Unsend all others in group.
+        '''
+        userids = list(userids)
+        self._GP_popup.send_many(userids, *args, **kw)
+        for popup in self._GP_group:
+            if popup is not self:
+                for userid in userids:
+                    popup.unsend(userid)
+
     def __getattr__(self, attr):
-        if attr == 'send' or attr.startswith(('_GP_','__')):
+        if attr in ('send', 'send_many') or attr.startswith(('_GP_','__')):
             return vars(self)[attr]
         else:
             return getattr(self._GP_popup, attr)
@@ -152,6 +167,21 @@ class PopupGroup(dict):
         popup = self[lang]
         userpopup = popup._send(user, *args, **kw)
 
+    def send_many(self, userids, *args, **kw):
+        '''
+        Send popups from this group to the users specified by userids.
+
+        The users are grouped by the language chosen for them and each
+        language version is sent with its send_many. Bots are skipped.
+        '''
+        languages = {}
+        for userid in userids:
+            user = _usermanager[userid]
+            if not user.bot:
+                languages.setdefault(self._getlang(user), []).append(user)
+        for lang, users in languages.iteritems():
+            self[lang]._send_many(users, *args, **kw)
+
     def unsend(self, userid):
         '''
         Removes a popup of this group from user.
@@ -165,17 +195,6 @@ class PopupGroup(dict):
             return userpopup.unsend()
         return False
 
-    def __del__(self):
-        '''
-        No references to this group.
-
-        Normally this means an addon which created this group was unloaded.
-        For that we are going to clear all the popups in here.
-        '''
-        dbgmsg(1, 'Popuplib2: Deleting popup group')
-        dbgmsg_repr(2, self)
-        # the references for popups and userpopups will be gone along with this
-
     def _get_userpopup(self, user):
         '''Return the userpopup for the user.'''
         lang = self._getlang(user)
@@ -193,40 +212,532 @@ class PopupGroup(dict):
         """
         user = _usermanager[userid]
         userpopup = self._get_userpopup(user)
-        try:
-            return user.queue.index(userpopup)
-        except ValueError:
-            return None
+        return user.get_popup_index(userpopup)
 
     # TODO: more actions, relay to specific popups
 
 
+# the keys of MenuSelectEvent read from its attributes, and the keys only
+# menu responses have
+_EVENT_KEYS = ('userid', 'choice', 'popup', 'previous')
+_MENU_EVENT_KEYS = ('raw_choice', 'page', 'option', 'special')
+
+
+class MenuSelectEvent(object):
+    '''
+    A response of a user to a popup.
+
+    Given to the menuselect callbacks of popups that have menuselect_event
+    set, instead of the dict given to the other callbacks. The event is also
+    a read-only mapping with the keys of that dict, the menuselect_args of
+    the popup (and of the userpopup of personal menus) are read only when
+    looked up.
+
+    Attributes:
+    popup -- the popup responded to
+    userid -- the userid of the user
+    choice -- the choice of the selected option, or the key pressed
+    raw_choice -- the key pressed, None for popups without pages
+    page -- the page the user was on, None for popups without pages
+    option -- the MenuOption of the key pressed or None
+    special -- True if the key was not a selectable option, None for popups
+      without pages
+    previous -- the previous popup in the navigation history or None
+    '''
+    __slots__ = ('popup', 'userid', 'choice', 'raw_choice', 'page', 'option',
+        'special', 'previous', '_args')
+
+    def __init__(self, popup, userid, choice, raw_choice=None, page=None,
+            option=None, special=None, previous=None, args=None):
+        self.popup = popup
+        self.userid = userid
+        self.choice = choice
+        self.raw_choice = raw_choice
+        self.page = page
+        self.option = option
+        self.special = special
+        self.previous = previous
+        self._args = args # menuselect_args of the userpopup or None
+
+    def __getitem__(self, key):
+        # the same precedence as in the dict given to menuselect
+        if self.page is not None and key in _MENU_EVENT_KEYS:
+            return getattr(self, key)
+        if self._args and key in self._args:
+            return self._args[key]
+        popup_args = self.popup.menuselect_args
+        if key in popup_args:
+            return popup_args[key]
+        if key in _EVENT_KEYS:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        return (key in _EVENT_KEYS or key in self.popup.menuselect_args or
+            bool(self._args and key in self._args) or
+            (self.page is not None and key in _MENU_EVENT_KEYS))
+
+    def keys(self):
+        keys = set(_EVENT_KEYS)
+        keys.update(self.popup.menuselect_args)
+        if self._args:
+            keys.update(self._args)
+        if self.page is not None:
+            keys.update(_MENU_EVENT_KEYS)
+        return list(keys)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def as_dict(self):
+        '''Return the dict given to menuselect callbacks without events.'''
+        params = {
+            'userid': self.userid,
+            'choice': self.choice,
+            'popup': self.popup,
+            'previous': self.previous,
+            }
+        params.update(self.popup.menuselect_args)
+        if self._args:
+            params.update(self._args)
+        if self.page is not None:
+            params['raw_choice'] = self.raw_choice
+            params['page'] = self.page
+            params['option'] = self.option
+            params['special'] = self.special
+        return params
+
+    def __repr__(self):
+        return 'MenuSelectEvent(%r)'%self.as_dict()
+
+
+class _PopupQueue(object):
+    '''
+    The popup queue of a user.
+
+    The queue is ordered like a list but stored as a linked list with an
+    index of the nodes of each userpopup, so membership tests, removals
+    from the middle and pops from the head take constant time. Finding
+    the numeric index of a userpopup takes linear time.
+    '''
+    # A node is a list [previous node, next node, userpopup], the root node
+    # links to the first and the last node.
+
+    def __init__(self, iterable=()):
+        '''Initialize the queue, optionally with contents from iterable.'''
+        self._root = root = []
+        root[:] = [root, root, None]
+        self._nodes = {} # {userpopup: [node, ...],}
+        self._length = 0
+        for item in iterable:
+            self.append(item)
+
+    def __len__(self):
+        return self._length
+
+    def __iter__(self):
+        root = self._root
+        node = root[1]
+        while node is not root:
+            yield node[2]
+            node = node[1]
+
+    def __contains__(self, item):
+        return item in self._nodes
+
+    def __repr__(self):
+        return '%s(%r)'%(self.__class__.__name__, list(self))
+
+    def _node_at(self, index):
+        '''Return the node at index, raise IndexError if there is none.'''
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError('queue index out of range')
+        root = self._root
+        if index < self._length // 2:
+            node = root[1]
+            for i in xrange(index):
+                node = node[1]
+        else:
+            node = root[0]
+            for i in xrange(self._length - index - 1):
+                node = node[0]
+        return node
+
+    def _link(self, next_node, item):
+        '''Link a new node for item before next_node.'''
+        previous_node = next_node[0]
+        node = [previous_node, next_node, item]
+        previous_node[1] = node
+        next_node[0] = node
+        self._nodes.setdefault(item, []).append(node)
+        self._length += 1
+
+    def _unlink(self, node):
+        '''Unlink the node and return its item.'''
+        previous_node, next_node, item = node
+        previous_node[1] = next_node
+        next_node[0] = previous_node
+        nodes = self._nodes[item]
+        if len(nodes) == 1:
+            del self._nodes[item]
+        else:
+            # nodes are compared by identity, they are cyclic
+            for index, other in enumerate(nodes):
+                if other is node:
+                    del nodes[index]
+                    break
+        self._length -= 1
+        return item
+
+    def __getitem__(self, index):
+        '''queue[index]'''
+        return self._node_at(index)[2]
+
+    def __setitem__(self, index, item):
+        '''queue[index] = item'''
+        next_node = self._node_at(index)[1]
+        self._unlink(next_node[0])
+        self._link(next_node, item)
+
+    def __delitem__(self, index):
+        '''del queue[index]'''
+        self._unlink(self._node_at(index))
+
+    def append(self, item):
+        '''Add item to the end of the queue.'''
+        self._link(self._root, item)
+
+    def insert(self, index, item):
+        '''Insert item before index.'''
+        if index < 0:
+            index = max(0, index + self._length)
+        if index >= self._length:
+            self._link(self._root, item)
+        else:
+            self._link(self._node_at(index), item)
+
+    def pop(self, index=-1):
+        '''Remove and return the item at index (default last).'''
+        return self._unlink(self._node_at(index))
+
+    def popleft(self):
+        '''Remove and return the first item.'''
+        return self._unlink(self._node_at(0))
+
+    def _first_node(self, item):
+        '''Return the first node of item in queue order.'''
+        nodes = self._nodes[item]
+        if len(nodes) == 1:
+            return nodes[0]
+        node_ids = set([id(node) for node in nodes])
+        node = self._root[1]
+        while id(node) not in node_ids:
+            node = node[1]
+        return node
+
+    def remove(self, item):
+        '''Remove the first occurrence of item, raise ValueError if none.'''
+        if item not in self._nodes:
+            raise ValueError('item not in queue')
+        self._unlink(self._first_node(item))
+
+    def index(self, item):
+        '''Return the index of the first occurrence of item.'''
+        if item not in self._nodes:
+            raise ValueError('item not in queue')
+        first = self._first_node(item)
+        node = self._root[1]
+        index = 0
+        while node is not first:
+            node = node[1]
+            index += 1
+        return index
+
+    def clear(self):
+        '''Remove all items.'''
+        root = self._root
+        root[:] = [root, root, None]
+        self._nodes.clear()
+        self._length = 0
+
+
+class _Timer(object):
+    '''A timer scheduled in a _TimerWheel.'''
+    __slots__ = ('expires', 'callback', 'args', 'cancelled')
+
+    def __init__(self, expires, callback, args):
+        self.expires = expires
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+
+class _TimerWheel(object):
+    '''
+    A hashed timer wheel driven by a single gamethread.delayed chain.
+
+    Timers are put to the slot of the tick they expire on. The wheel wakes
+    up once per tick and calls the callbacks of all the timers expired on
+    that tick in a batch. The wheel only ticks while it has timers.
+    '''
+    def __init__(self, tick=1.0, size=64):
+        '''
+        Initialize the wheel.
+
+        Parameters:
+        tick -- the time in seconds between wake ups
+        size -- the number of slots, timers longer than size ticks stay in
+            their slot for multiple rounds
+        '''
+        self.tick = tick
+        self.slots = [[] for x in xrange(size)]
+        self.ticks = 0 # ticks passed
+        self.pending = 0 # timers that are not expired or cancelled
+        self.running = False
+        # True while the expired timers are called, at the start of a tick
+        self._advancing = False
+
+    def schedule(self, delay, callback, args=(), spread=0):
+        '''
+        Call callback(*args) after delay seconds, return the timer.
+
+        The timer expires on the first tick at least delay seconds away,
+        so it may expire up to one tick late but never early. If spread is
+        given, the timer may expire up to spread seconds later, on the first
+        tick with the least timers.
+        '''
+        expires = self.ticks + max(1, int(math.ceil(delay / self.tick)))
+        if self.running and not self._advancing:
+            # part of the current tick has passed already, the next tick is
+            # less than a tick away
+            expires += 1
+        if spread > 0:
+            size = len(self.slots)
+            latest = expires + int(spread / self.tick)
+            for tick in xrange(expires + 1, latest + 1):
+                if (len(self.slots[tick % size]) <
+                        len(self.slots[expires % size])):
+                    expires = tick
+        timer = _Timer(expires, callback, args)
+        self.slots[expires % len(self.slots)].append(timer)
+        self.pending += 1
+        if not self.running:
+            self.running = True
+            gamethread.delayed(self.tick, self._advance)
+        return timer
+
+    def cancel(self, timer):
+        '''Cancel the timer if it has not expired yet.'''
+        if not timer.cancelled:
+            timer.cancelled = True
+            self.pending -= 1
+            if not self.pending:
+                # only cancelled timers left
+                for slot in self.slots:
+                    del slot[:]
+
+    def _advance(self):
+        '''Advance the wheel by one tick and call the expired timers.'''
+        self.ticks += 1
+        index = self.ticks % len(self.slots)
+        slot = self.slots[index]
+        expired = [timer for timer in slot if timer.expires <= self.ticks]
+        if expired:
+            self.slots[index] = [
+                timer for timer in slot if timer.expires > self.ticks]
+        self._advancing = True
+        for timer in expired:
+            if timer.cancelled:
+                continue
+            timer.cancelled = True
+            self.pending -= 1
+            try:
+                timer.callback(*timer.args)
+            except Exception:
+                dbgmsg(0, 'Popuplib2: Timer callback raised:')
+                sys.excepthook(*sys.exc_info())
+                sys.exc_clear()
+        self._advancing = False
+        if self.pending:
+            gamethread.delayed(self.tick, self._advance)
+        else:
+            self.running = False
+            for slot in self.slots:
+                del slot[:]
+
+
+class _WorkerPool(object):
+    '''
+    Runs functions in worker threads and their completion handlers on the
+    game thread.
+
+    The results of the finished jobs are put to a queue that is polled from
+    a gamethread.delayed chain every tick while jobs are pending, so the
+    handlers never run concurrently with the game. Futures (objects with
+    done and result methods) can be watched in the same way. The worker
+    threads are started on first use.
+    '''
+    def __init__(self, threads=2):
+        '''
+        Initialize the pool.
+
+        Parameters:
+        threads -- the number of worker threads
+        '''
+        self.threads = threads
+        self._jobs = Queue.Queue()
+        self._results = Queue.Queue()
+        self._workers = []
+        self._futures = [] # [(future, handler),]
+        self.pending = 0 # jobs and futures not handled yet
+        self.polling = False
+
+    def submit(self, function, args, kw, handler):
+        '''
+        Call function(*args, **kw) in a worker thread, then
+        handler(result, exc_info) on the game thread. exc_info is None or
+        the sys.exc_info() of the exception raised by the function.
+        '''
+        while len(self._workers) < self.threads:
+            worker = threading.Thread(target=self._work,
+                name='spmenu worker %d'%(len(self._workers)+1))
+            worker.setDaemon(True)
+            worker.start()
+            self._workers.append(worker)
+        self._jobs.put((function, args, kw, handler))
+        self._add_pending()
+
+    def watch(self, future, handler):
+        '''
+        Call handler(result, exc_info) on the game thread when the future
+        is done, exc_info like in submit.
+        '''
+        self._futures.append((future, handler))
+        self._add_pending()
+
+    def _add_pending(self):
+        self.pending += 1
+        if not self.polling:
+            self.polling = True
+            gamethread.delayed(0, self._poll)
+
+    def _work(self):
+        '''Run the jobs, called in the worker threads.'''
+        while True:
+            function, args, kw, handler = self._jobs.get()
+            try:
+                result = function(*args, **kw)
+            except Exception:
+                self._results.put((handler, None, sys.exc_info()))
+            else:
+                self._results.put((handler, result, None))
+
+    def _poll(self):
+        '''Call the handlers of the finished jobs and futures.'''
+        finished = []
+        while True:
+            try:
+                finished.append(self._results.get_nowait())
+            except Queue.Empty:
+                break
+        if self._futures:
+            futures = []
+            for future, handler in self._futures:
+                if not future.done():
+                    futures.append((future, handler))
+                    continue
+                try:
+                    finished.append((handler, future.result(), None))
+                except Exception:
+                    finished.append((handler, None, sys.exc_info()))
+            self._futures = futures
+        for handler, result, exc_info in finished:
+            self.pending -= 1
+            try:
+                handler(result, exc_info)
+            except Exception:
+                dbgmsg(0, 'Popuplib2: Worker job handler raised:')
+                sys.excepthook(*sys.exc_info())
+                sys.exc_clear()
+        if self.pending:
+            gamethread.delayed(0, self._poll)
+        else:
+            self.polling = False
+
+
 class _UserManager(object):
     '''The class that manages users and interaction with them.'''
     def __init__(self):
         '''Initialize the class.'''
         self.users = {} # {userid: _User instance,}
         self.active_users = set() # users who have active popups
-        # for optimization, listen for es_map_start and player_disconnect
+        # delayed refreshes done, and how many of them sent the previously
+        # displayed text without rendering
+        self.timed_refreshes = 0
+        self.cached_refreshes = 0
+        # one timer wheel runs the delayed refreshes and popup timeouts of
+        # all users
+        self.timers = _TimerWheel()
+        # spread the refreshes of users evenly over the wheel ticks
+        self.stagger_refreshes = True
+        # runs asynchronous build_callbacks
+        self.workers = _WorkerPool()
+        # with deferred_display, users whose queue changed are refreshed
+        # once at the end of the tick instead of on every change
+        self.deferred_display = False
+        self._dirty = {} # {userid: _User instance,} to refresh
+        # refreshes saved by deferred_display
+        self.coalesced_refreshes = 0
+        # the menuselect commands a user may give per second and at once,
+        # a menuselect_rate of 0 disables the limit
+        self.menuselect_rate = 0
+        self.menuselect_burst = 10
+        # menuselects over the limit that were ignored, and page changes
+        # over the limit merged into one page move per tick
+        self.throttled_menuselects = 0
+        self.merged_page_moves = 0
+        # spmenu_trace.Recorder writing the popup traffic, None if not
+        # recording
+        self.recorder = None
+        # for optimization, listen for es_map_start, player_activate and
+        # player_disconnect
         es.addons.registerForEvent(self, 'es_map_start', self.es_map_start)
+        es.addons.registerForEvent(
+            self, 'player_activate', self.player_activate
+        )
         es.addons.registerForEvent(
             self, 'player_disconnect', self.player_disconnect
         )
 
     def __getitem__(self, userid):
         '''user = _usermanager[userid]'''
+        user = self.users.get(userid)
+        if user is not None:
+            return user
         if not isinstance(userid, int):
             raise TypeError(
                 "userid must be integer, got %s"%(
                     repr(type(userid)),
                 )
             )
-        if userid in self.users:
-            return self.users[userid]
-        else:
-            user = _User(userid)
-            self.users[userid] = user
-            return user
+        # the player was not activated while spmenu was loaded
+        user = _User(userid)
+        self.users[userid] = user
+        return user
 
     def activate(self, user):
         '''Mark user to have active popups, start listening to menuselect.'''
@@ -258,11 +769,43 @@ class _UserManager(object):
                     choice = int(args[1])
                 except ValueError:
                     return True
+                if self.recorder is not None:
+                    self.recorder.menuselect(userid, choice)
                 user = self.users[userid] #no indirect reference here for debug
+                if self.menuselect_rate > 0 and not user.take_token():
+                    user.throttle(choice)
+                    return False
+                if user._page_move is not None:
+                    # the choice is for the page the user sees
+                    user.apply_page_move()
                 user.got_response(choice)
                 return False
         return True
 
+    def mark_dirty(self, user):
+        '''Refresh the user at the end of the tick.'''
+        if user.userid in self._dirty:
+            self.coalesced_refreshes += 1
+            return
+        if not self._dirty:
+            gamethread.delayed(0, self.flush)
+        self._dirty[user.userid] = user
+
+    def flush(self):
+        '''Refresh the users marked dirty.'''
+        dirty = self._dirty
+        self._dirty = {}
+        for userid, user in dirty.iteritems():
+            if self.users.get(userid) is not user:
+                # disconnected meanwhile
+                continue
+            try:
+                user.refresh()
+            except Exception:
+                dbgmsg(0, 'Popuplib2: Deferred refresh raised:')
+                sys.excepthook(*sys.exc_info())
+                sys.exc_clear()
+
     # EVENT HANDLERS
 
     def es_map_start(self, event_var):
@@ -271,9 +814,36 @@ class _UserManager(object):
 
         This method is called by EventScripts automatically.
         '''
-        for userid, user in self.users.iteritems():
+        if self.recorder is not None:
+            self.recorder.map_start()
+        # only the active users and the users waiting for a deferred refresh
+        # have popups in queue
+        for userid in self.active_users:
+            self.users[userid].clear_queue()
+        for user in self._dirty.itervalues():
             user.clear_queue()
-        self.active_users.clear()
+        self._dirty.clear()
+        if self.active_users:
+            self.active_users.clear()
+            es.addons.unregisterClientCommandFilter(self.ccf)
+
+    def player_activate(self, event_var):
+        '''
+        Create the user of the activated player, or read the player
+        information of a known user again.
+
+        The player information is then not read in the middle of sending
+        the first popup. player_activate is also fired for every player on
+        map change, which keeps the languages up to date.
+        '''
+        userid = int(event_var['userid'])
+        try:
+            if userid in self.users:
+                self.users[userid].refresh_player()
+            else:
+                self.users[userid] = _User(userid)
+        except playerlib.UseridError:
+            dbgmsg(1, 'Popuplib2: Activated player %s not found', userid)
 
     def player_disconnect(self, event_var):
         '''
@@ -285,33 +855,63 @@ class _UserManager(object):
         only have the users that are on currently.
         '''
         userid = int(event_var['userid'])
+        if self.recorder is not None:
+            self.recorder.disconnect(userid)
         if userid in self.users:
-            self.users[userid]._delete()
-            del self.users[userid]
+            user = self.users.pop(userid)
+            user.inactivate()
+            user._delete()
 
     # TODO: more _Usermanager actions
 
 
 class _User(object):
     '''User object containing user's popup queue and settings.'''
+    __slots__ = ('userid', 'language', 'bot', 'queue', 'navstack',
+        '_delete_handlers', '_weak_delete_handlers', '_last_display',
+        '_refresh_timer', '_queue_timers', '_display_timer',
+        '__handling_response', '_tokens', '_token_time', '_page_move',
+        'throttled_menuselects')
+
     def __init__(self, userid):
         ''' Initializes a new _User,
 raises playerlib.UseridError if user not found. '''
         self.userid = userid
-        player = playerlib.getPlayer(userid)
-        self.language = player.get('lang')
-        self.bot = bool(player.get('isbot'))
-        self.queue = []
+        self.refresh_player()
+        self.queue = _PopupQueue()
         self.navstack = []
-        ''' self.queue = [Userpopup instance, Userpopup instance, ] '''
+        ''' self.queue = _PopupQueue([Userpopup instance, ]) '''
         self._delete_handlers = set()
-        self.__delayed_refresh = 0
+        # deletion handlers that are bound methods are held weakly
+        self._weak_delete_handlers = weakref.WeakKeyDictionary()
+        ''' self._weak_delete_handlers = {object: function,} '''
+        self._last_display = None
+        ''' self._last_display = (userpopup, render version, payload) '''
+        self._refresh_timer = None
+        self._queue_timers = {} # {userpopup: timer for max_queue_time,}
+        self._display_timer = None # (userpopup, timer for max_display_time)
         self.__handling_response = False
+        # the menuselect rate limit token bucket
+        self._tokens = None
+        self._token_time = 0
+        self._page_move = None # (userpopup, page after the merged changes)
+        self.throttled_menuselects = 0
+
+    def refresh_player(self):
+        '''
+        Read the language and the bot status of the player,
+        raises playerlib.UseridError if user not found.
+        '''
+        player = playerlib.getPlayer(self.userid)
+        self.language = player.get('lang')
+        self.bot = bool(player.get('isbot'))
 
     def inactivate(self):
         '''Mark this user having no popup activity.'''
         self.navstack = [] # make sure the navstack is empty
-        self.queue = [] # make sure the queue is empty
+        self.queue.clear() # make sure the queue is empty
+        self._last_display = None
+        self._cancel_timers()
         _usermanager.inactivate(self)
 
     def activate(self):
@@ -320,8 +920,9 @@ raises playerlib.UseridError if user not found. '''
 
     def clear_queue(self):
         '''Clear the queue, called on map start.'''
-        self.queue = []
-        self._delete_handlers = set()
+        self.queue.clear()
+        self._last_display = None
+        self._cancel_timers()
 
     def get_popup_index(self, popup):
         '''Return the queue index if in queue or None if not.'''
@@ -334,20 +935,27 @@ raises playerlib.UseridError if user not found. '''
         '''
         Add a deletion handler function which is called when
         the user disconnects.
+
+        A bound method does not keep its object alive, the handler is
+        dropped when the object is deleted.
         '''
-        self._delete_handlers.add(delfunc)
+        obj = getattr(delfunc, 'im_self', None)
+        if obj is not None:
+            self._weak_delete_handlers[obj] = delfunc.im_func
+        else:
+            self._delete_handlers.add(delfunc)
 
     def _delete(self):
         '''Call the deletion handler functions.'''
+        dbgmsg(1, 'Popuplib2: Deleting user %s', self.userid)
+        self._cancel_timers()
+        for obj, delfunc in self._weak_delete_handlers.items():
+            delfunc(obj)
         for delfunc in self._delete_handlers:
             delfunc()
+        del self._weak_delete_handlers
         del self._delete_handlers
 
-    def __del__(self):
-        '''Mark this user not being active when no references are left.'''
-        dbgmsg(1, 'Popuplib2: Deleting user %s'%(self.userid,))
-        self.inactivate()
-
     def want_popup(self, userpopup):
         '''
         Add popup to queue if it is not in there already.
@@ -355,18 +963,28 @@ raises playerlib.UseridError if user not found. '''
         If this is the first popup, display it.
         '''
         if self.bot:
-            dbgmsg(1, 'Popuplib2: Trying to send to bot (id %s), ignoring'%(
-                self.userid,))
+            dbgmsg(1, 'Popuplib2: Trying to send to bot (id %s), ignoring',
+                self.userid)
             return False
+        if _usermanager.recorder is not None:
+            _usermanager.recorder.send(self.userid, userpopup)
 
         if userpopup not in self.queue or (
             self.__handling_response and self.queue[0] is userpopup
         ):
             self.queue.append(userpopup)
-        index = self.queue.index(userpopup)
-        dbgmsg(1, 'Popuplib2: User %s wants popup, index %s'%(
-            self.userid, index))
-        self.refresh() # make sure the current popup is visible
+        if __debug__ and _debug.level >= 1:
+            dbgmsg(1, 'Popuplib2: User %s wants popup, queue length %s',
+                self.userid, len(self.queue))
+        max_queue_time = userpopup._popup.max_queue_time
+        if max_queue_time:
+            # every send starts the time in queue from the beginning
+            timers = _usermanager.timers
+            if userpopup in self._queue_timers:
+                timers.cancel(self._queue_timers[userpopup])
+            self._queue_timers[userpopup] = timers.schedule(
+                max_queue_time, self._queue_time_expired, (userpopup,))
+        self._request_refresh() # make sure the current popup is visible
         return True
 
     def remove_popup(self, userpopup):
@@ -379,18 +997,40 @@ raises playerlib.UseridError if user not found. '''
         Return False if the popup was not in queue.
         '''
         if userpopup in self.queue:
-            index = self.queue.index(userpopup)
-            if index == 0:
+            if self.queue[0] is userpopup:
                 # This was the first popup, needs updating!
                 if not self.next_popup():
                     # No more popups to display, goodbye!
                     self.inactivate()
                     userpopup.hide_display()
             else:
-                del self.queue[index]
+                self.queue.remove(userpopup)
+                self._left_queue(userpopup)
+
+    def _left_queue(self, userpopup):
+        '''Cancel the max_queue_time timer of a userpopup no longer queued.'''
+        if userpopup in self._queue_timers and userpopup not in self.queue:
+            _usermanager.timers.cancel(self._queue_timers.pop(userpopup))
+
+    def displayed(self, userpopup, payload):
+        '''Remember the payload displayed by the userpopup for refreshes.'''
+        self._last_display = (
+            userpopup, userpopup._popup._render_version, payload)
+
+    def _request_refresh(self):
+        '''Refresh now, or at the end of the tick with deferred_display.'''
+        if _usermanager.deferred_display:
+            _usermanager.mark_dirty(self)
+        else:
+            self.refresh()
+
+    def refresh(self, timed=False):
+        '''
+        Display the popup first in queue.
 
-    def refresh(self):
-        '''Display the popup first in queue.'''
+        A timed refresh sends the previously displayed text again if the
+        popup has not changed since.
+        '''
         if self.__handling_response:
             return False
         if not self.queue:
@@ -399,19 +1039,73 @@ raises playerlib.UseridError if user not found. '''
         userpopup = self.queue[0]
         if userpopup in self.navstack:
             self.navstack.remove(userpopup)
-        dbgmsg(1, 'Popuplib2: Displaying popup')
-        userpopup.display()
+        last_display = self._last_display
+        if timed:
+            _usermanager.timed_refreshes += 1
+        if (timed and last_display is not None
+            and last_display[0] is userpopup
+            and last_display[1] == userpopup._popup._render_version
+            and not userpopup._popup.rebuild_on_refresh):
+            dbgmsg(1, 'Popuplib2: Displaying popup again')
+            _usermanager.cached_refreshes += 1
+            userpopup._popup._stats.cache_hits += 1
+            userpopup._show(last_display[2])
+        else:
+            dbgmsg(1, 'Popuplib2: Displaying popup')
+            userpopup.display()
+        max_display_time = userpopup._popup.max_display_time
+        if self._display_timer is not None:
+            if self._display_timer[0] is not userpopup:
+                _usermanager.timers.cancel(self._display_timer[1])
+                self._display_timer = None
+        if self._display_timer is None and max_display_time:
+            self._display_timer = (userpopup, _usermanager.timers.schedule(
+                max_display_time, self._display_time_expired, (userpopup,)))
         dbgmsg(2, 'Popuplib2: Activating user listening')
         self.activate()
         refresh_time = _game_data.get('refresh', 0)
-        if self.__delayed_refresh == 0 and refresh_time > 0:
-            self.__delayed_refresh += 1
-            gamethread.delayed(refresh_time, self.__delayed_refresh_call)
+        if self._refresh_timer is None and refresh_time > 0:
+            if _usermanager.stagger_refreshes and not timed:
+                # delay the first refresh to the least busy tick, the
+                # following refreshes keep the refresh interval
+                spread = refresh_time / 2.0
+            else:
+                spread = 0
+            self._refresh_timer = _usermanager.timers.schedule(
+                refresh_time, self._timed_refresh, spread=spread)
         return True
 
-    def __delayed_refresh_call(self):
-        self.__delayed_refresh -= 1
-        self.refresh()
+    def _timed_refresh(self):
+        '''Refresh called by the timer wheel.'''
+        self._refresh_timer = None
+        self.refresh(timed=True)
+
+    def _queue_time_expired(self, userpopup):
+        '''Remove the userpopup which has been in queue too long.'''
+        del self._queue_timers[userpopup]
+        if userpopup in self.queue:
+            dbgmsg(1, 'Popuplib2: Popup queue time expired')
+            self.remove_popup(userpopup)
+
+    def _display_time_expired(self, userpopup):
+        '''Remove the userpopup which has been displayed too long.'''
+        self._display_timer = None
+        if self.queue and self.queue[0] is userpopup:
+            dbgmsg(1, 'Popuplib2: Popup display time expired')
+            self.remove_popup(userpopup)
+
+    def _cancel_timers(self):
+        '''Cancel the scheduled delayed refresh and popup timeouts.'''
+        timers = _usermanager.timers
+        if self._refresh_timer is not None:
+            timers.cancel(self._refresh_timer)
+            self._refresh_timer = None
+        for timer in self._queue_timers.itervalues():
+            timers.cancel(timer)
+        self._queue_timers.clear()
+        if self._display_timer is not None:
+            timers.cancel(self._display_timer[1])
+            self._display_timer = None
 
     def next_popup(self):
         '''Remove the first popup from queue, display next if possible.'''
@@ -432,9 +1126,9 @@ raises playerlib.UseridError if user not found. '''
 
     def pop(self, index):
         '''Remove specified popup index from queue.'''
-        self.queue.pop(index)
+        self._left_queue(self.queue.pop(index))
         if index == 0 and len(self.queue) > 0:
-            self.refresh()
+            self._request_refresh()
             return True
         return False
 
@@ -444,7 +1138,9 @@ raises playerlib.UseridError if user not found. '''
 
         Will display the next popup.
         '''
-        dbgmsg(1, 'Popuplib2: User %s got response %s'%(self.userid, choice))
+        if __debug__ and _debug.level >= 1:
+            dbgmsg(1, 'Popuplib2: User %s got response %s', self.userid,
+                choice)
         userpopup = self.queue[0]
         self.__handling_response = True # prevent circular calls messing up
         response = userpopup.response(choice)
@@ -466,24 +1162,174 @@ raises playerlib.UseridError if user not found. '''
                 dbgmsg(1, 'New submenu, adding previous popup to history.')
                 self.navstack.append(userpopup)
             self.refresh()
-        dbgmsg(2, 'Popuplib2: Queue is')
-        dbgmsg_repr(2, self.queue)
+        if __debug__ and _debug.level >= 2:
+            dbgmsg(2, 'Popuplib2: Queue is')
+            dbgmsg_repr(2, self.queue)
+
+    def take_token(self):
+        '''
+        Take a token for a menuselect command, return False if the user is
+        over the rate limit of the user manager.
+        '''
+        now = time.time()
+        if self._tokens is None:
+            tokens = _usermanager.menuselect_burst
+        else:
+            tokens = min(_usermanager.menuselect_burst, self._tokens +
+                (now - self._token_time) * _usermanager.menuselect_rate)
+        self._token_time = now
+        if tokens < 1:
+            self._tokens = tokens
+            return False
+        self._tokens = tokens - 1
+        return True
+
+    def throttle(self, choice):
+        '''
+        Handle a menuselect over the rate limit.
+
+        Page changes of the displayed popup are merged and the net page move
+        is displayed at the end of the tick, other choices are ignored.
+        '''
+        if not self.queue:
+            return
+        userpopup = self.queue[0]
+        pagenum = None
+        if self._page_move is not None and self._page_move[0] is userpopup:
+            pagenum = self._page_move[1]
+        if choice in (8, 9):
+            pagenum = userpopup._merge_page_change(pagenum, choice)
+        else:
+            pagenum = None
+        if pagenum is None:
+            self.throttled_menuselects += 1
+            _usermanager.throttled_menuselects += 1
+            return
+        if self._page_move is None:
+            gamethread.delayed(0, self.apply_page_move)
+        self._page_move = (userpopup, pagenum)
+        _usermanager.merged_page_moves += 1
+
+    def apply_page_move(self):
+        '''Move the page by the merged page changes and display it once.'''
+        if self._page_move is None:
+            return
+        userpopup, pagenum = self._page_move
+        self._page_move = None
+        if _usermanager.users.get(self.userid) is not self:
+            # disconnected meanwhile
+            return
+        if self.queue and self.queue[0] is userpopup:
+            if userpopup._move_page(pagenum):
+                self.refresh()
 
     # TODO: more _User actions
 
 _usermanager = _UserManager()
 
+_popups = weakref.WeakValueDictionary()
+''' _popups = {id(popup): popup,} of all live popups '''
+
+
+def register_popup(popup):
+    '''Track a new popup for memory_report.'''
+    _popups[id(popup)] = popup
+
+
+def memory_report():
+    '''
+    Return a list of (popup, number of userpopups) tuples for all live
+    popups, the popups with most userpopups first.
+    '''
+    report = [(len(popup._users), id(popup), popup)
+        for popup in _popups.values()]
+    report.sort(reverse=True)
+    return [(popup, count) for count, popup_id, popup in report]
+
+
+def set_deferred_display(enabled):
+    '''
+    Set the deferred display mode of all users.
+
+    In deferred display mode sending, unsending and answering popups only
+    marks the user to be refreshed, and the first popup in the queue of each
+    such user is displayed once at the end of the tick. Sending multiple
+    popups to a user in a tick then renders and sends one menu. Turning the
+    mode off refreshes the marked users immediately.
+    '''
+    _usermanager.deferred_display = bool(enabled)
+    if not enabled:
+        _usermanager.flush()
+
+
+def set_menuselect_limit(rate, burst=10):
+    '''
+    Limit the menuselect commands each user can give.
+
+    A user can give burst commands at once and rate commands per second on
+    average, commands over the limit are ignored. Page changes over the
+    limit are merged so that the net page move is displayed once per tick.
+    A rate of 0 removes the limit.
+    '''
+    _usermanager.menuselect_rate = rate
+    _usermanager.menuselect_burst = burst
+    for user in _usermanager.users.itervalues():
+        user._tokens = None
+
 
-def dbgmsg(level, text):
+class _DebugLevel(object):
+    '''
+    The value of eventscripts_debug, read again when a server variable
+    changes and on map start.
+
+    Used to skip building debug messages: dbgmsg does not format messages
+    over the level, and the hot paths check it before computing the message
+    arguments. The value may be out of date until the next map if the server
+    does not announce changes of eventscripts_debug, so constant messages
+    are still passed to es.dbgmsg for filtering.
+    '''
+    def __init__(self):
+        self.level = 0
+        self.refresh()
+        es.addons.registerForEvent(self, 'server_cvar', self.server_cvar)
+        es.addons.registerForEvent(self, 'es_map_start', self.refresh)
+
+    def refresh(self, event_var=None):
+        '''Read eventscripts_debug.'''
+        try:
+            self.level = int(es.ServerVar('eventscripts_debug'))
+        except ValueError:
+            self.level = 0
+
+    def server_cvar(self, event_var):
+        if event_var.get('cvarname') == 'eventscripts_debug':
+            self.refresh()
+
+_debug = _DebugLevel()
+'''
+Hot paths check _debug.level before formatting a message, as in
+    if __debug__ and _debug.level >= 2:
+        dbgmsg(2, 'text %s', repr(obj))
+so the message costs nothing when debugging is off, and python -O compiles
+the check out.
+'''
+
+
+def dbgmsg(level, text, *args):
+    '''
+    Print the debug message text, formatted with args if given.
+
+    A message with args is not formatted if level is over the debug level.
+    '''
+    if args:
+        if level > _debug.level:
+            return
+        text = text%args
     return es.dbgmsg(level, text) # fixed in build 169 or so
 
-    for s in xrange(0, len(text), 240):
-        es.dbgmsg(level, text[s:s+240])
 
 def dbgmsg_repr(level, obj):
+    if level > _debug.level:
+        return
     return es.dbgmsg(level, repr(obj)) # fixed in build 169 or so
 
-    if level <= int(es.ServerVar('eventscripts_debug')):
-        for line in pprint.pformat(obj).splitlines():
-            es.dbgmsg(level, line)
-
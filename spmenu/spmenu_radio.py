@@ -2,20 +2,46 @@
 More Pythonic and object oriented way to handle tasks previously
 handled by popuplib, in-game radio menu type popups
 '''
+import array
+import bisect
 import string
 import sys
+import time
 import warnings
+import weakref
 
 import es
 import gamethread
 import langlib
 
-from spmenu_common import dbgmsg, dbgmsg_repr
+from spmenu_common import dbgmsg, dbgmsg_repr, PopuplibError, register_popup
+from spmenu_common import _debug
+from spmenu_common import MenuSelectEvent
 import spmenu_resources
+import spmenu_stats
+
+
+# the async_build modes of PersonalPopup and PersonalMenu
+ASYNC_THREAD = 'thread'
+ASYNC_FUTURE = 'future'
 
 
 # UserPopup classes
 
+
+def _page_position(pagenum, pages):
+    '''Return the name of the menu chrome footer for the page.'''
+    if pages == 0:
+        return 'empty'
+    elif pages == 1:
+        return 'single'
+    elif pagenum == 1:
+        return 'first'
+    elif pagenum == pages:
+        return 'last'
+    return 'middle'
+
+
 class UserPopup(object):
     '''
     A basic userpopup class, other userpopups subclass this.
@@ -34,18 +60,20 @@ class UserPopup(object):
         self._send_args = None
         self._send_kw = None
         self._being_hidden = False
+        # the use count of the popup when this userpopup was last used
+        self._last_used = 0
+        # True while a deferred menuselect of this userpopup has not run
+        self._response_pending = False
 
-    def __del__(self):
-        '''
-        No references to this userpopup.
-        '''
-        dbgmsg(1, 'Popuplib2: Deleting userpopup')
-        dbgmsg_repr(2, self)
+    def _prepare(self, *args, **kw):
+        '''Store the send parameters for this popup.'''
+        self._send_args = args or ()
+        self._send_kw = kw or {}
 
     def _send(self, *args, **kw):
         '''Send this popup to queue of the user.'''
-        self._send_args = args or ()
-        self._send_kw = kw or {}
+        self._prepare(*args, **kw)
+        self._popup._stats.sends += 1
         self._user.want_popup(self)
 
     def get_language(self):
@@ -61,14 +89,54 @@ class UserPopup(object):
         dbgmsg(1, 'Popuplib2: Userpopup building self')
         return '\n'.join(self._popup)
 
+    def _view_key(self):
+        '''
+        Return the key of the view this userpopup shows.
+
+        Userpopups of the same popup with equal keys display the same text,
+        which is rendered once and its payload cached in the popup. None
+        means the view is personal and never cached.
+        '''
+        return self.get_language()
+
+    def _payload(self, text):
+        '''Return the payload that displays the text, the encoded text.'''
+        if isinstance(text, unicode):
+            text = text.encode('utf-8')
+        return text
+
+    def _get_payload(self):
+        '''Return the payload to display, rendering it if necessary.'''
+        key = self._view_key()
+        render_cache = self._popup._render_cache
+        if key in render_cache:
+            self._popup._stats.cache_hits += 1
+            return render_cache[key]
+        payload = self._payload(self.generate_text())
+        if key is not None:
+            render_cache[key] = payload
+        return payload
+
     def display(self):
         '''Create a GUI panel and display it for the user.'''
         self._being_hidden = False
-        text = self.generate_text()
-        if isinstance(text, unicode):
-            text = text.encode('utf-8')
-        dbgmsg(2, 'Popuplib2: Calling es.menu(%s, %s, textlen=%s, %s)'%(
-            0, self._user.userid, len(text), self._popup.enable_keys))
+        self._popup._stats.displays += 1
+        self._show(self._get_payload())
+
+    def _show(self, text):
+        '''
+        Send the rendered payload to the user.
+
+        The payload is remembered by the user so delayed refreshes can send
+        it again without rendering.
+        '''
+        self._user.displayed(self, text)
+        stats = self._popup._stats
+        stats.menu_calls += 1
+        stats.bytes_sent += len(text)
+        if __debug__ and _debug.level >= 2:
+            dbgmsg(2, 'Popuplib2: Calling es.menu(%s, %s, textlen=%s, %s)',
+                0, self._user.userid, len(text), self._popup.enable_keys)
         es.menu(0, self._user.userid, text, self._popup.enable_keys)
 
     def response(self, choice):
@@ -79,13 +147,28 @@ class UserPopup(object):
         Returns False otherwise.
         '''
         if not self._being_hidden:
-            self._popup._menuselect_special = {}
             return self._popup._response(self._user, choice)
         else:
             return True
 
+    def _merge_page_change(self, pagenum, choice):
+        '''
+        Return the page that the page change choice (8 or 9) leads to from
+        pagenum, or from the current page if pagenum is None.
+
+        Return None if the choice is not a page change that can be merged
+        with others without calling menuselect.
+        '''
+        return None
+
+    def _move_page(self, pagenum):
+        '''Display the page reached by merged page changes.'''
+        return False
+
     def unsend(self):
         '''Remove this popup from user queue.'''
+        if _usermanager.recorder is not None:
+            _usermanager.recorder.unsend(self._user.userid, self)
         return self._user.remove_popup(self)
 
     def hide_display(self):
@@ -96,11 +179,31 @@ class UserPopup(object):
 
     def _user_deleted(self):
         '''The user is no longer in game, this popup is not needed anymore.'''
-        del self._popup._users[self._userid]
+        if self._popup._users.get(self._userid) is self:
+            del self._popup._users[self._userid]
+
+    def _is_idle(self):
+        '''Return True if this userpopup is not queued or in navigation.'''
+        return (self not in self._user.queue and
+            self not in self._user.navstack)
 
     # TODO: more basic userpopup actions
 
 
+# the types of the template parameters whose substituted text can be cached
+_PLAIN_TYPES = frozenset((str, unicode, int, long, float, bool, type(None)))
+
+
+def _is_plain_value(value):
+    '''Return True if value is of a plain type or a tuple of such values.'''
+    if type(value) is tuple:
+        for item in value:
+            if not _is_plain_value(item):
+                return False
+        return True
+    return type(value) in _PLAIN_TYPES
+
+
 class UserTemplatePopup(UserPopup):
     '''
     A template userpopup class for TemplatePopup
@@ -108,17 +211,107 @@ class UserTemplatePopup(UserPopup):
     A userpopup is a view to specific Popup, specific to a single user.
     Each user for each popup have their own userpopup instances.
     '''
+    def _view_key(self):
+        '''
+        The substituted text depends on the send parameters, userpopups
+        sent with equal parameters share the text. The text is not cached
+        if a parameter is not a plain value, an object may change between
+        sends without its identity changing.
+        '''
+        args = self._send_args
+        if len(args) == 1 and type(args[0]) is dict:
+            values = tuple(sorted(args[0].iteritems()))
+            args = (dict, values)
+        else:
+            values = args
+        kw = tuple(sorted(self._send_kw.iteritems()))
+        if not (_is_plain_value(values) and _is_plain_value(kw)):
+            return None
+        return (args, kw)
+
+    def generate_text(self):
+        '''
+        Generate the string that is to be displayed in the popup.
+        '''
+        dbgmsg(1, 'Popuplib2: Template Userpopup building self')
+        render_cache = self._popup._render_cache
+        if len(render_cache) >= self._popup.max_cached_texts:
+            render_cache.clear()
+        return self._popup._get_template().substitute(
+            *self._send_args, **self._send_kw)
+
+
+class _UserBuildMixin(object):
+    '''
+    Mixin for the userpopups of popups with a build_callback.
+
+    The subclasses implement _collect returning the final contents and
+    _show_built displaying them. With asynchronous builds the previously
+    built contents, or a loading text before the first build, are shown
+    until the new contents are ready.
+    '''
+
+    # the attributes build_callback may set, taken from the staging
+    # userpopup of an asynchronous build
+    _built_attributes = ('_contents', 'menuselect_args')
+
+    _build_job = None # the staging userpopup of the running build
+    _built = False
+    _prefetch_job = None # the staging userpopup of the running prefetch
+    _prefetched = None # the staging userpopup built by the last prefetch
+    _page_turn = False # the next display is for a page turn
+
     def display(self):
         '''Create a GUI panel and display it for the user.'''
-        dbgmsg(1, 'Popuplib2: Template Userpopup building self')
-        text_template = string.Template('\n'.join(self._popup))
-        text = text_template.substitute(*self._send_args, **self._send_kw)
-        dbgmsg(2, 'Popuplib2: Calling es.menu(%f, %d, textlen=%d, %s)'%(
-            0, self._user.userid, len(text), self._popup.enable_keys))
-        es.menu(0, self._user.userid, text, self._popup.enable_keys)
+        self._popup._stats.displays += 1
+        if self._popup.async_build:
+            self._popup._start_build(self)
+        elif not self._take_prefetched():
+            self._build()
+        self._being_hidden = False
+        self._show_built()
 
+    def _take_prefetched(self):
+        '''
+        Take the prefetched contents if this display is for a page turn.
 
-class UserPersonalPopup(UserPopup):
+        Return True if the contents were taken.
+        '''
+        prefetched = self._prefetched
+        page_turn = self._page_turn
+        self._prefetched = None
+        self._page_turn = False
+        if prefetched is None or not page_turn:
+            return False
+        self._take_built(prefetched)
+        return True
+
+    def _build(self):
+        '''Call build_callback to build the contents.'''
+        self._contents = []
+        start = time.time()
+        try:
+            self._popup.build_callback(self._user.userid, self)
+        except TypeError, e:
+            warnings.warn('TypeError when calling build_callback: %s'%e)
+        else:
+            self._final_contents = self._collect()
+            self._built = True
+        self._popup._stats.build_done(self._popup, time.time() - start)
+
+    def _take_built(self, staging):
+        '''Take the contents built to the staging userpopup.'''
+        for attribute in self._built_attributes:
+            setattr(self, attribute, getattr(staging, attribute))
+        self._final_contents = self._collect()
+        self._built = True
+
+    def _loading(self):
+        '''Return True if the contents are being built for the first time.'''
+        return not self._built and self._build_job is not None
+
+
+class UserPersonalPopup(_UserBuildMixin, UserPopup):
     '''
     A userpopup class for PersonalPopup.
 
@@ -169,20 +362,22 @@ class UserPersonalPopup(UserPopup):
     def remove(self, line):
         return self._contents.remove(line)
 
-    def display(self):
-        self._contents = []
-        try:
-            self._popup.build_callback(self._user.userid, self)
-        except TypeError, e:
-            warnings.warn('TypeError when calling build_callback: %s'%e)
-        else:
-            self._final_contents = list(self._popup) + self._contents
-        self._being_hidden = False
+    def _view_key(self):
+        '''The contents are personal.'''
+        return None
+
+    def _collect(self):
+        '''Return the lines of the popup.'''
+        return list(self._popup) + self._contents
+
+    def _show_built(self):
+        '''Display the built contents.'''
+        lines = self._final_contents
+        if self._loading():
+            lines = list(self._popup) + [
+                spmenu_resources.get_string('loading', self.get_language())]
         dbgmsg(1, 'Popuplib2: Userpopup building self')
-        text = '\n'.join(self._final_contents)
-        dbgmsg(2, 'Popuplib2: Calling es.menu(%s, %s, textlen=%s, %s)'%(
-            0, self._user.userid, len(text), self._popup.enable_keys))
-        es.menu(0, self._user.userid, text, self._popup.enable_keys)
+        self._show(self._payload('\n'.join(lines)))
 
 
 class UserPagedMenu(UserPopup):
@@ -192,6 +387,10 @@ class UserPagedMenu(UserPopup):
     A userpopup is a view to specific Popup, specific to a single user.
     Each user for each popup have their own userpopup instances.
     '''
+    # the options of the page fetched in a worker thread, see
+    # PagedMenu._prefetch_adjacent
+    _fetched_options = None
+
     def __init__(self, *args, **kw):
         '''Initialize a new Userpopup '''
         super(UserPagedMenu, self).__init__(*args, **kw)
@@ -201,67 +400,76 @@ class UserPagedMenu(UserPopup):
         '''Count the number of pages in this popup.'''
         return self._popup.pages()
 
+    def _page_options(self, start, stop):
+        '''Return the options of the page, from index start to stop.'''
+        if self._fetched_options is not None:
+            return self._fetched_options
+        return self._popup._option_slice(start, stop)
+
     def _add_options(self, tb):
         '''Add options to builder block tb.'''
         minopt = (self.pagenum-1)*self._popup.options_per_page
         maxopt = self.pagenum*self._popup.options_per_page
         index = 0
-        for index, option in enumerate(self._popup[minopt:maxopt]):
+        options = self._page_options(minopt, maxopt)
+        for index, option in enumerate(options):
             tb.append(str(option)%(index+1))
         for i in xrange(self._popup.options_per_page-index-1):
             tb.append(' ')
 
-    def _send(self, page=1, *args, **kw):
-        '''Send this popup to queue of the user (override for page control).'''
+    def _prepare(self, page=1, *args, **kw):
+        '''Store the send parameters (override for page control).'''
         self.pagenum = self._popup.isvalidpage(page) and page or 1
         self._send_args = args or ()
         self._send_kw = kw or {}
-        self._user.want_popup(self)
 
-    def display(self):
-        '''Create a GUI panel and display it for the user.'''
+    def _merge_page_change(self, pagenum, choice):
+        '''Page changes can be merged if menuselect does not see them.'''
+        if self._popup.call_special:
+            return None
+        if pagenum is None:
+            pagenum = self.pagenum
+        if choice == 8 and pagenum > 1:
+            return pagenum - 1
+        if choice == 9 and pagenum < self.pages():
+            return pagenum + 1
+        return pagenum
+
+    def _move_page(self, pagenum):
+        '''Display the page, return True if it changed.'''
+        if not self._popup.isvalidpage(pagenum) or pagenum == self.pagenum:
+            return False
+        self.pagenum = pagenum
+        return True
+
+    def generate_text(self):
+        '''
+        Generate the string that is to be displayed in the popup.
+        '''
         pages = self.pages() or 1
-        language = self.get_language()
+        chrome = spmenu_resources.get_chrome(self.get_language())
         tb = []
         # add title
         tb.append('%-25s'%(self._popup.title))
         # add description
         if self._popup.description:
             tb.append('%s\n'%self._popup.description)
-        # add separating slashes
-        if pages == 0:
-            # empty menu
-            tb.append(spmenu_resources.get_string('empty', language))
-        else:
+        if pages != 0:
             # add options
             self._add_options(tb)
-            # add separating slashes
-            tb.append(' ')
-            # add page navigation links
-            if pages > 1:
-                s_prev = spmenu_resources.get_string('prev', language)
-                s_next = spmenu_resources.get_string('next', language)
-                if self.pagenum == 1:
-                    # tb.append('8. %s'%s_prev)
-                    tb.append(' ')
-                else:
-                    tb.append('->8. %s\n'%s_prev)
-                if self.pagenum == pages:
-                    # tb.append('9. %s\n'%s_next)
-                    tb.append(' ')
-                else:
-                    tb.append('->9. %s\n'%s_next)
-            else:
-                tb.append(' ')
-                tb.append(' ')
+        # add page navigation links and exit button
+        tb.append(chrome['paged_' + _page_position(self.pagenum, pages)])
+        return '\n'.join(tb)
 
-        # add exit button
-        tb.append('0. %s'%spmenu_resources.get_string('cancel', language))
-        #display it
-        text = '\n'.join(tb)
-        dbgmsg(2, 'es.menu(%d, %d, textlen=%d, %s'%(
-            0, self._user.userid, len(text), self._popup.enable_keys))
-        es.menu(0, self._user.userid, text, self._popup.enable_keys)
+    def _view_key(self):
+        '''The page shown depends on the language and the page number.'''
+        return (self.get_language(), self.pagenum, self.pages())
+
+    def display(self):
+        '''Create a GUI panel and display it for the user.'''
+        super(UserPagedMenu, self).display()
+        if self._popup.prefetch_pages:
+            self._popup._prefetch_adjacent(self)
 
     def response(self, choice):
         '''
@@ -270,29 +478,25 @@ class UserPagedMenu(UserPopup):
         Returns True if next popup may be shown;
         Returns False otherwise.
         '''
-        self._popup._menuselect_special = {}
-        self._popup._menuselect_special['raw_choice'] = choice
-        self._popup._menuselect_special['page'] = self.pagenum
-        self._popup._menuselect_special['option'] = None
         achoice = None
+        nchoice = None
         if choice < 8:
             nopt = (self.pagenum-1)*self._popup.options_per_page + choice - 1
             try:
-                nchoice = self._popup[nopt]
+                nchoice = self._popup._option_at(nopt)
                 achoice = nchoice.choice
-                self._popup._menuselect_special['option'] = nchoice
                 if nchoice.selectable:
                     # valid option, handle it
-                    self._popup._menuselect_special['special'] = False
-                    return self._popup._response(self._user, achoice)
+                    return self._popup._response(self._user, achoice,
+                        choice, self.pagenum, nchoice, False)
             except IndexError:
                 # invalid option, go on...
                 pass
         # the choice was either special or non-existing option
         result = True
         if self._popup.call_special:
-            self._popup._menuselect_special['special'] = True
-            result = self._popup._response(self._user, achoice)
+            result = self._popup._response(self._user, achoice, choice,
+                self.pagenum, nchoice, True)
         if result:
             if choice == 8:
                 # previous!
@@ -326,7 +530,7 @@ class UserPagedList(UserPagedMenu):
         minopt = (self.pagenum-1)*self._popup.options_per_page
         maxopt = self.pagenum*self._popup.options_per_page
         index = 0
-        for index, text in enumerate(self._popup[minopt:maxopt]):
+        for index, text in enumerate(self._page_options(minopt, maxopt)):
             tb.append(self._generate_line(index+minopt+1, index, text))
         if self.pagenum > 1:
             for i in xrange(self._popup.options_per_page-index-1):
@@ -339,13 +543,10 @@ class UserPagedList(UserPagedMenu):
         Returns True if next popup may be shown;
         Returns False otherwise.
         '''
-        self._popup._menuselect_special = {}
-        self._popup._menuselect_special['raw_choice'] = choice
-        self._popup._menuselect_special['page'] = self.pagenum
         result = True
         if self._popup.call_special:
-            self._popup._menuselect_special['special'] = True
-            result = self._popup._response(self._user, choice)
+            result = self._popup._response(self._user, choice, choice,
+                self.pagenum, None, True)
         if result:
             if choice == 8:
                 # previous!
@@ -362,7 +563,7 @@ class UserPagedList(UserPagedMenu):
         return False
 
 
-class UserPersonalMenu(UserPagedMenu):
+class UserPersonalMenu(_UserBuildMixin, UserPagedMenu):
     '''
     A userpopup class for PersonalMenu.
 
@@ -381,6 +582,10 @@ class UserPersonalMenu(UserPagedMenu):
     menuselect_args -- a dictionary containing extra information that is put
       to the menuselect callback dict
     '''
+
+    _built_attributes = ('_contents', 'menuselect_args', 'title',
+        'description')
+
     def __init__(self, *args, **kw):
         '''Initialize a new Userpopup '''
         super(UserPersonalMenu, self).__init__(*args, **kw)
@@ -438,21 +643,34 @@ class UserPersonalMenu(UserPagedMenu):
     def pages(self):
         '''Count the number of pages in this popup.'''
         full_pages, left_over_options = divmod(
-            len(self._popup)+len(self._contents), self._popup.options_per_page
+            self._popup._option_count()+len(self._contents),
+            self._popup.options_per_page
         )
         return full_pages + (1 if left_over_options else 0)
 
+    def _view_key(self):
+        '''The contents are personal.'''
+        return None
+
     def display(self):
         '''Create a GUI panel and display it for the user.'''
-        self._contents = []
-        try:
-            self._popup.build_callback(self._user.userid, self)
-        except TypeError, e:
-            warnings.warn('TypeError when calling build_callback: %s'%e)
-        else:
-            self._final_contents = list(self._popup) + self._contents
+        super(UserPersonalMenu, self).display()
+        if self._popup.prefetch_pages and not self._popup.async_build:
+            self._popup._prefetch_build(self)
+
+    def _move_page(self, pagenum):
+        '''Display the page, showing the contents built ahead.'''
+        self._page_turn = True
+        return super(UserPersonalMenu, self)._move_page(pagenum)
+
+    def _collect(self):
+        '''Return the options of the menu.'''
+        return self._popup._option_slice(0, None) + self._contents
+
+    def _show_built(self):
+        '''Display the built contents.'''
         pages = self.pages()
-        language = self.get_language()
+        chrome = spmenu_resources.get_chrome(self.get_language())
         tb = []
         # add title
         tb.append('%-25s(%d/%d)'%(self.title or self._popup.title,
@@ -461,11 +679,11 @@ class UserPersonalMenu(UserPagedMenu):
         if self.description:
             tb.append('%s\n'%self.description or self._popup.description)
         # add separating slashes
-        tb.append('-'*30)
-        if pages == 0:
-            # empty menu
-            tb.append(spmenu_resources.get_string('empty', language))
-        else:
+        tb.append(chrome['separator'])
+        if self._loading():
+            tb.append(spmenu_resources.get_string('loading',
+                self.get_language()))
+        if pages != 0:
             # add options
             minopt = (self.pagenum-1)*self._popup.options_per_page
             maxopt = self.pagenum*self._popup.options_per_page
@@ -474,30 +692,14 @@ class UserPersonalMenu(UserPagedMenu):
                 tb.append(str(option)%(index+1))
             for i in xrange(self._popup.options_per_page-index-1):
                 tb.append(' ')
-            # add separating slashes
-            tb.append('-'*30)
-            # add page navigation links
-            if pages > 1:
-                s_prev = spmenu_resources.get_string('prev', language)
-                s_next = spmenu_resources.get_string('next', language)
-                if self.pagenum == 1:
-                    tb.append('8. %s'%s_prev)
-                else:
-                    tb.append('->8. %s\n'%s_prev)
-                if self.pagenum == pages:
-                    tb.append('9. %s\n'%s_next)
-                else:
-                    tb.append('->9. %s\n'%s_next)
-            else:
-                tb.append(' ')
-                tb.append(' ')
-        # add exit button
-        tb.append('0. %s'%spmenu_resources.get_string('cancel', language))
+        # add separating slashes, page navigation links and exit button
+        position = _page_position(self.pagenum, pages)
+        if position == 'empty' and self._loading():
+            # not empty, the options are coming
+            position = 'single'
+        tb.append(chrome['personal_' + position])
         #display it
-        text = '\n'.join(tb)
-        dbgmsg(2, 'es.menu(%d, %d, textlen=%d, %s'%(
-            0, self._user.userid, len(text), self._popup.enable_keys))
-        es.menu(0, self._user.userid, text, self._popup.enable_keys)
+        self._show(self._payload('\n'.join(tb)))
 
     def response(self, choice):
         '''
@@ -508,30 +710,29 @@ class UserPersonalMenu(UserPagedMenu):
         '''
         # this is very similar to UserPagedMenu's response method (diff marked)
         # TODO: Combine the two?
-        self._popup._menuselect_special = dict(self.menuselect_args) #new
-        self._popup._menuselect_special['raw_choice'] = choice
-        self._popup._menuselect_special['page'] = self.pagenum
-        self._popup._menuselect_special['option'] = None
         achoice = None
+        nchoice = None
         if choice < 8:
             nopt = (self.pagenum-1)*self._popup.options_per_page + choice - 1
             try:
                 nchoice = self._final_contents[nopt] #edited
                 achoice = nchoice.choice
-                self._popup._menuselect_special['option'] = nchoice
                 if nchoice.selectable:
                     # valid option, handle it
-                    self._popup._menuselect_special['special'] = False
-                    return self._popup._response(self._user, achoice)
+                    return self._popup._response(self._user, achoice,
+                        choice, self.pagenum, nchoice, False,
+                        self.menuselect_args) #edited
             except IndexError:
                 # invalid option, go on...
                 pass
         # the choice was either special or non-existing option
         result = True
         if self._popup.call_special:
-            self._popup._menuselect_special['special'] = True
-            result = self._popup._response(self._user, achoice)
+            result = self._popup._response(self._user, achoice, choice,
+                self.pagenum, nchoice, True, self.menuselect_args) #edited
         if result:
+            # the contents built ahead can be shown for the new page
+            self._page_turn = choice in (8, 9)
             if choice == 8:
                 # previous!
                 if self.pagenum > 1:
@@ -560,19 +761,219 @@ class MenuOption(object):
     text -- the text to show in the menu
     selectable -- if this option can be selected
     '''
+    __slots__ = ('_choice', '_text', '_selectable', '_fragment', '_owners',
+        '_row')
+
     def __init__(self, choice, text, selectable=True):
         '''Initialize a new MenuOption.'''
-        self.choice = choice
-        self.text = text
-        self.selectable = selectable
+        self._choice = choice
+        self._text = text
+        self._selectable = selectable
+        # (weak reference, index) of the menus this option has been added to,
+        # the index is where the option was added or None if not known
+        self._owners = None
+        # the row id of an option made by OptionColumns
+        self._row = None
+        self._build_fragment()
+
+    def _build_fragment(self):
+        '''Build the escaped display line, formatted with the option number.'''
+        # unfortunately ('%s'%d) is faster than ('%d'%d) which would be more
+        # explicit
+        if self._selectable:
+            self._fragment = "->%%s. %s"%(self._text.replace('%', '%%'))
+        else:
+            self._fragment = "%%s. %s"%(self._text.replace('%', '%%'))
+
+    def _get_choice(self):
+        return self._choice
+
+    def _set_choice(self, choice):
+        self._choice = choice
+        self._notify_owners()
+
+    choice = property(_get_choice, _set_choice)
+
+    def _get_text(self):
+        return self._text
+
+    def _set_text(self, text):
+        self._text = text
+        self._build_fragment()
+        self._notify_owners()
+
+    text = property(_get_text, _set_text)
+
+    def _get_selectable(self):
+        return self._selectable
+
+    def _set_selectable(self, selectable):
+        self._selectable = selectable
+        self._build_fragment()
+        self._notify_owners()
+
+    selectable = property(_get_selectable, _set_selectable)
+
+    def _notify_owners(self):
+        '''Notify the menus displaying this option that it has changed.'''
+        if self._owners:
+            for ref, index in self._owners:
+                menu = ref()
+                if menu is not None:
+                    menu._option_changed(self, index)
+
+    def _add_owner(self, menu, index=None):
+        '''
+        Remember that this option is displayed in the menu at index, return
+        True if the menu was displaying it already.
+        '''
+        owners = [owner for owner in self._owners or ()
+            if owner[0]() is not None]
+        for position, (ref, old_index) in enumerate(owners):
+            if ref() is menu:
+                owners[position] = (ref, index)
+                self._owners = owners
+                return True
+        owners.append((weakref.ref(menu), index))
+        self._owners = owners
+        return False
+
+    def _owner_index(self, menu):
+        '''Return the index recorded for the menu, None if not known.'''
+        for ref, index in self._owners or ():
+            if ref() is menu:
+                return index
+        return None
 
     def __str__(self):
-        # this method needs to be optimized and unfortunately
-        # ('%s'%d) is faster than ('%d'%d) which would be more explicit
-        if self.selectable:
-            return "->%%s. %s"%(self.text.replace('%', '%%'))
+        return self._fragment
+
+
+class OptionColumns(object):
+    '''
+    Menu options of a PagedMenu stored in column form.
+
+    The choices, texts and selectable flags of the options are kept in
+    parallel lists instead of a MenuOption instance for each option.
+    MenuOption instances are created only for the options that are accessed.
+    Each row has an id, the ids increase in row order, so the row of a
+    MenuOption made from the columns can be found by its id after other rows
+    have been removed.
+    '''
+    def __init__(self):
+        '''Initialize new empty columns.'''
+        self.choices = []
+        self.texts = []
+        self.flags = array.array('B')
+        self.ids = array.array('L')
+        self._next_id = 0
+
+    def __len__(self):
+        return len(self.choices)
+
+    def count(self):
+        '''Return the number of options.'''
+        return len(self.choices)
+
+    def append(self, choice, text, selectable=True):
+        '''Add a new option to the end of the columns.'''
+        self.choices.append(choice)
+        self.texts.append(text)
+        self.flags.append(bool(selectable))
+        self.ids.append(self._next_id)
+        self._next_id += 1
+
+    def index(self, choice):
+        '''Return the index of the option, raises ValueError if not found.'''
+        return self.choices.index(choice)
+
+    def option(self, index):
+        '''Return a MenuOption for the option at index.'''
+        option = MenuOption(
+            self.choices[index], self.texts[index], bool(self.flags[index]))
+        option._row = self.ids[index]
+        return option
+
+    def row(self, option):
+        '''
+        Return the current index of a MenuOption made by these columns, or
+        None if the option has been removed.
+        '''
+        if option._row is None:
+            return None
+        index = bisect.bisect_left(self.ids, option._row)
+        if index < len(self.ids) and self.ids[index] == option._row:
+            return index
+        return None
+
+    def slice(self, start, stop):
+        '''Return a list of MenuOptions for the options from start to stop.'''
+        option = self.option
+        return [option(index)
+            for index in xrange(*slice(start, stop).indices(len(self)))]
+
+    def update(self, index, choice, text, selectable):
+        '''Change the option at index.'''
+        self.choices[index] = choice
+        self.texts[index] = text
+        self.flags[index] = bool(selectable)
+
+    def pop(self, index):
+        '''Remove the option at index and return a MenuOption for it.'''
+        option = self.option(index)
+        del self.choices[index]
+        del self.texts[index]
+        del self.flags[index]
+        del self.ids[index]
+        return option
+
+
+# Template classes
+
+
+class _CompiledTemplate(object):
+    '''
+    A string.Template compiled to a %-format string.
+
+    The common $name and ${name} placeholders are substituted with a single
+    string formatting operation. Templates with invalid placeholders fall
+    back to string.Template to raise the same errors.
+    '''
+    def __init__(self, template):
+        '''Compile the template string.'''
+        self.template = template
+        self._format = None
+        self._fallback = None
+        parts = []
+        position = 0
+        for match in string.Template.pattern.finditer(template):
+            if match.group('invalid') is not None:
+                self._fallback = string.Template(template)
+                return
+            parts.append(template[position:match.start()].replace('%', '%%'))
+            if match.group('escaped') is not None:
+                parts.append('$')
+            else:
+                parts.append('%%(%s)s'%(
+                    match.group('named') or match.group('braced')))
+            position = match.end()
+        parts.append(template[position:].replace('%', '%%'))
+        self._format = ''.join(parts)
+
+    def substitute(self, *args, **kw):
+        '''Substitute like string.Template.substitute.'''
+        if self._fallback is not None:
+            return self._fallback.substitute(*args, **kw)
+        if len(args) > 1:
+            raise TypeError('Too many positional arguments')
+        if not args:
+            mapping = kw
+        elif kw:
+            mapping = dict(args[0])
+            mapping.update(kw)
         else:
-            return "%%s. %s"%(self.text.replace('%', '%%'))
+            mapping = args[0]
+        return self._format%mapping
 
 
 # Popup classes
@@ -593,49 +994,217 @@ class Popup(list):
       submenu and displayed immediately after processing the resonse.
     menuselect_args -- a dictionary containing extra information that is put
       to the menuselect callback dict
+    rebuild_on_refresh -- if True, delayed refreshes render the popup again
+      instead of sending the previously displayed text, needed when the
+      content of a personal popup changes without the popup being sent again
+    max_queue_time -- seconds the popup may stay in a user's queue after it
+      was sent, None for no limit
+    max_display_time -- seconds the popup may stay displayed to a user,
+      None for no limit
+    max_idle_userpopups -- the number of userpopups kept for users who do
+      not have the popup in queue, least recently used ones are dropped
+    defer_slow_menuselect -- if True and the recent menuselect calls have
+      taken longer than spmenu_stats.callback_budget on average, menuselect
+      is called on the next tick instead of inside the client command
+      filter; the popup stays displayed until then
+    menuselect_event -- if True, menuselect is given a MenuSelectEvent
+      instead of a dict; the event has the same keys as the dict
     '''
 
     _user_popup_class = UserPopup
 
-    # FIXME: add max queue time and max visibility times
     def __init__(self, *args, **kw):
         '''Initialize a new Popup.'''
         super(Popup, self).__init__(*args, **kw)
         self._users = {}
         ''' self._users = {userid: Userpopup instance,} '''
-        self._menuselect_special = {}
+        self._render_cache = {}
+        ''' self._render_cache = {userpopup view key: encoded text,} '''
+        # incremented whenever the rendered content may have changed
+        self._render_version = 0
         self.language = None
         self.enable_keys = "0123456789"
         self.menuselect = None
         self.menuselect_args = {}
+        self.rebuild_on_refresh = False
+        self.max_queue_time = None
+        self.max_display_time = None
+        self.max_idle_userpopups = 16
+        self.defer_slow_menuselect = False
+        self.menuselect_event = False
+        self._use_count = 0
+        self._eviction_limit = self.max_idle_userpopups
+        # the performance counters, see spmenu_stats
+        self._stats = spmenu_stats.track(self)
+        register_popup(self)
 
     def _delete(self):
         '''Deletes this popup user information.'''
         self.menuselect = None
         self.menuselect_args = {}
 
-    def __del__(self):
-        '''
-        No references to this popup.
-        '''
-        dbgmsg(1, 'Popuplib2: Deleting popup')
-        dbgmsg_repr(2, self)
-
     def _get_userpopup(self, user):
         '''Return userpopup and create one if necessary.'''
         if user.userid not in self._users:
+            if len(self._users) >= self._eviction_limit:
+                self._evict_idle()
             userpopup = self._user_popup_class(user, self)
             self._users[user.userid] = userpopup
         else:
             userpopup = self._users[user.userid]
+        self._use_count += 1
+        userpopup._last_used = self._use_count
         return userpopup
 
+    def _evict_idle(self):
+        '''
+        Drop the least recently used idle userpopups exceeding
+        max_idle_userpopups.
+        '''
+        idle = [(userpopup._last_used, userid)
+            for userid, userpopup in self._users.iteritems()
+            if userpopup._is_idle()]
+        idle.sort()
+        for last_used, userid in idle[:-self.max_idle_userpopups or None]:
+            del self._users[userid]
+        # check again when the same amount of new userpopups is created
+        self._eviction_limit = len(self._users) + self.max_idle_userpopups
+
+    # Content change tracking, the list methods changing the contents report
+    # the changed index range to _contents_changed.
+
+    def _contents_changed(self, start=0, stop=None):
+        '''
+        Called after the contents from index start to stop have changed.
+
+        A stop of None means that every item after start may have changed.
+        '''
+        self._render_version += 1
+        self._render_cache.clear()
+
+    def _contents_added(self, items, start):
+        '''Called with the items that were added to the contents at start.'''
+        pass
+
+    def _normalize_index(self, index):
+        '''Return the non-negative list index for index.'''
+        if index < 0:
+            index = max(0, len(self) + index)
+        return min(index, len(self))
+
+    def __setitem__(self, index, value):
+        '''popup[index] = value'''
+        if isinstance(index, slice):
+            value = list(value)
+            start = index.indices(len(self))[0]
+            super(Popup, self).__setitem__(index, value)
+            self._contents_added(value, start)
+            self._contents_changed(start)
+        else:
+            super(Popup, self).__setitem__(index, value)
+            index = self._normalize_index(index)
+            self._contents_added((value,), index)
+            self._contents_changed(index, index+1)
+
+    def __delitem__(self, index):
+        '''del popup[index]'''
+        if isinstance(index, slice):
+            start = index.indices(len(self))[0]
+        else:
+            start = self._normalize_index(index)
+        super(Popup, self).__delitem__(index)
+        self._contents_changed(start)
+
+    def __setslice__(self, i, j, sequence):
+        '''popup[i:j] = sequence'''
+        self.__setitem__(slice(i, j), sequence)
+
+    def __delslice__(self, i, j):
+        '''del popup[i:j]'''
+        self.__delitem__(slice(i, j))
+
+    def __iadd__(self, sequence):
+        '''popup += sequence'''
+        self.extend(sequence)
+        return self
+
+    def __imul__(self, count):
+        '''popup *= count'''
+        super(Popup, self).__imul__(count)
+        self._contents_changed()
+        return self
+
+    def append(self, item):
+        '''Append item to the end of the contents.'''
+        super(Popup, self).append(item)
+        self._contents_added((item,), len(self)-1)
+        self._contents_changed(len(self)-1, len(self))
+
+    def extend(self, sequence):
+        '''Extend the contents by appending items from the sequence.'''
+        sequence = list(sequence)
+        start = len(self)
+        super(Popup, self).extend(sequence)
+        self._contents_added(sequence, start)
+        self._contents_changed(start)
+
+    def insert(self, index, item):
+        '''Insert item before index.'''
+        index = self._normalize_index(index)
+        super(Popup, self).insert(index, item)
+        self._contents_added((item,), index)
+        self._contents_changed(index)
+
+    def pop(self, index=-1):
+        '''Remove and return item at index (default last).'''
+        start = self._normalize_index(index)
+        item = super(Popup, self).pop(index)
+        self._contents_changed(start)
+        return item
+
+    def remove(self, item):
+        '''Remove first occurrence of item.'''
+        self.__delitem__(self.index(item))
+
+    def reverse(self):
+        '''Reverse the contents in place.'''
+        super(Popup, self).reverse()
+        self._contents_changed()
+
+    def sort(self, *args, **kw):
+        '''Sort the contents in place.'''
+        super(Popup, self).sort(*args, **kw)
+        self._contents_changed()
+
     def _send(self, user, *args, **kw):
         '''Send this popup to _User object.'''
         userpopup = self._get_userpopup(user)
         userpopup._send(*args, **kw)
         return userpopup
 
+    def _send_many(self, users, *args, **kw):
+        '''
+        Send this popup to multiple _User objects.
+
+        The userpopups are grouped by their view and each distinct view is
+        rendered once before the popup is queued to the users, the queued
+        userpopups then display the shared payload from the render cache.
+        '''
+        userpopups = []
+        views = set()
+        for user in users:
+            userpopup = self._get_userpopup(user)
+            userpopup._prepare(*args, **kw)
+            key = userpopup._view_key()
+            if key is not None and key not in views:
+                views.add(key)
+                userpopup._get_payload()
+            userpopups.append(userpopup)
+        self._stats.sends += len(userpopups)
+        for userpopup in userpopups:
+            userpopup._user.want_popup(userpopup)
+        return userpopups
+
     def _unsend(self, user):
         '''Remove this popup from _User queue.'''
         if user.userid in self._users:
@@ -643,25 +1212,48 @@ class Popup(list):
             return userpopup.unsend()
         return False
 
-    def _response(self, user, choice):
-        '''Handle response from a user.'''
+    def _call_menuselect(self, params):
+        '''Call menuselect with the params and return the result.'''
+        start = time.time()
+        try:
+            submenu = self.menuselect(params)
+        except Exception:
+            # print the exception as normal, but pretend nothing happened
+            dbgmsg(1, 'Popuplib2: Called menuselect function raised:')
+            sys.excepthook(*sys.exc_info())
+            sys.exc_clear()
+            submenu = None
+        self._stats.menuselect_done(self, time.time() - start)
+        return submenu
+
+    def _response(self, user, choice, raw_choice=None, page=None,
+            option=None, special=None, args=None):
+        '''
+        Handle response from a user.
+
+        The userpopups of menus give the key pressed, the page and the
+        option, and personal menus their menuselect_args, see
+        MenuSelectEvent.
+        '''
         if callable(self.menuselect):
-            params = {
-                'userid': user.userid,
-                'choice': choice,
-                'popup': self,
-                'previous': user.get_previous_popup(),
-            }
-            params.update(self.menuselect_args)
-            params.update(self._menuselect_special)
-            try:
-                submenu = self.menuselect(params)
-            except Exception:
-                # print the exception as normal, but pretend nothing happened
-                dbgmsg(1, 'Popuplib2: Called menuselect function raised:')
-                sys.excepthook(*sys.exc_info())
-                sys.exc_clear()
-                submenu = None
+            userpopup = user.queue[0]
+            if userpopup._response_pending:
+                # the deferred menuselect of an earlier choice has not run
+                dbgmsg(1, 'Popuplib2: Ignoring choice, menuselect pending')
+                return False
+            params = MenuSelectEvent(self, user.userid, choice, raw_choice,
+                page, option, special, user.get_previous_popup(), args)
+            if not self.menuselect_event:
+                params = params.as_dict()
+            if (self.defer_slow_menuselect and self._stats.menuselect_slow and
+                not special):
+                # keep the popup displayed until the callback has been run
+                dbgmsg(1, 'Popuplib2: Deferring slow menuselect')
+                userpopup._response_pending = True
+                gamethread.delayed(0, self._deferred_response,
+                    (user, userpopup, params))
+                return False
+            submenu = self._call_menuselect(params)
             if submenu is not None:
                 try:
                     user.queue[0] = submenu._get_userpopup(user)
@@ -671,11 +1263,49 @@ class Popup(list):
                     dbgmsg_repr(0, submenu)
         return True
 
+    def _deferred_response(self, user, userpopup, params):
+        '''
+        Call the deferred menuselect and finish handling the response like
+        _response and _User.got_response would have.
+        '''
+        userpopup._response_pending = False
+        if (_usermanager.users.get(user.userid) is not user or
+                not user.queue or user.queue[0] is not userpopup):
+            # the user has moved on or left meanwhile
+            return
+        submenu = self._call_menuselect(params)
+        if not user.queue or user.queue[0] is not userpopup:
+            # the callback moved the user on
+            return
+        if submenu is not None:
+            try:
+                user.queue[0] = submenu._get_userpopup(user)
+            except AttributeError:
+                dbgmsg(0, 'Popuplib2: got non-popup return value from callback function')
+                dbgmsg_repr(0, submenu)
+            else:
+                user.navstack.append(userpopup)
+                user.refresh()
+                return
+        user.remove_popup(userpopup)
+
     def send(self, userid, *args, **kw):
         '''Send this popup to user specified by userid.'''
         user = _usermanager[userid]
         return self._send(user, *args, **kw)
 
+    def send_many(self, userids, *args, **kw):
+        '''
+        Send this popup to all users specified by userids.
+
+        Equal to calling send for each userid, but each distinct view of the
+        popup is rendered only once. Bots are skipped.
+        '''
+        users = [_usermanager[userid] for userid in userids]
+        return self._send_many(
+            [user for user in users if not user.bot], *args, **kw
+        )
+
     def unsend(self, userid):
         '''
         Remove this popup from user queue.
@@ -697,10 +1327,7 @@ class Popup(list):
         """
         user = _usermanager[userid]
         userpopup = self._get_userpopup(user)
-        try:
-            return user.queue.index(userpopup)
-        except ValueError:
-            return None
+        return user.get_popup_index(userpopup)
 
     # TODO: more basic popup actions
 
@@ -720,12 +1347,125 @@ class TemplatePopup(Popup):
       submenu and displayed immediately after processing the resonse.
     menuselect_args -- a dictionary containing extra information that is put
       to the menuselect callback dict
+    max_cached_texts -- the number of substituted texts kept for reuse
     '''
 
     _user_popup_class = UserTemplatePopup
 
+    def __init__(self, *args, **kw):
+        '''Initialize a new TemplatePopup.'''
+        super(TemplatePopup, self).__init__(*args, **kw)
+        self._template = None
+        self.max_cached_texts = 64
+
+    def _contents_changed(self, start=0, stop=None):
+        '''The template needs to be compiled again.'''
+        super(TemplatePopup, self)._contents_changed(start, stop)
+        self._template = None
 
-class PersonalPopup(Popup):
+    def _get_template(self):
+        '''Return the compiled template, compiling it if necessary.'''
+        if self._template is None:
+            self._template = _CompiledTemplate('\n'.join(self))
+        return self._template
+
+
+class _BuildCallbackMixin(object):
+    '''
+    Mixin for the popups with a build_callback.
+
+    With async_build set, build_callback fills a staging userpopup, which is
+    not displayed, outside of the game thread or in a future. The contents
+    of the staging userpopup are taken to the userpopup of the user on the
+    game thread when the build is done. The place of the userpopup in the
+    queue and the navigation history of the user are not changed.
+    '''
+
+    def _send(self, user, *args, **kw):
+        '''Send this popup to _User object.'''
+        userpopup = self._get_userpopup(user)
+        if self.async_build:
+            self._start_build(userpopup, args, kw)
+        else:
+            userpopup._contents = []
+            start = time.time()
+            self.build_callback(user.userid, userpopup, *args, **kw)
+            self._stats.build_done(self, time.time() - start)
+        userpopup._send()
+        return userpopup
+
+    def _send_many(self, users, *args, **kw):
+        '''Send this popup to multiple _User objects.'''
+        return [self._send(user, *args, **kw) for user in users]
+
+    def _start_build(self, userpopup, args=(), kw=None):
+        '''Start building the userpopup if it is not being built already.'''
+        if userpopup._build_job is not None:
+            return
+        user = userpopup._user
+        staging = self._user_popup_class(user, self)
+        userpopup._build_job = staging
+        def handler(result, exc_info):
+            self._build_finished(userpopup, staging, exc_info)
+        if self.async_build == ASYNC_THREAD:
+            _usermanager.workers.submit(self.build_callback,
+                (user.userid, staging) + tuple(args), kw or {}, handler)
+            return
+        start = time.time()
+        try:
+            future = self.build_callback(user.userid, staging, *args,
+                **(kw or {}))
+        except Exception:
+            userpopup._build_job = None
+            raise
+        self._stats.build_done(self, time.time() - start)
+        if hasattr(future, 'done') and hasattr(future, 'result'):
+            _usermanager.workers.watch(future, handler)
+        else:
+            # built without a future
+            userpopup._build_job = None
+            userpopup._take_built(staging)
+
+    def _prefetch_build(self, userpopup):
+        '''
+        Build the contents for the next page turn of the userpopup in a
+        worker thread.
+        '''
+        if userpopup._prefetch_job is not None:
+            return
+        user = userpopup._user
+        staging = self._user_popup_class(user, self)
+        userpopup._prefetch_job = staging
+        userpopup._prefetched = None
+        def handler(result, exc_info):
+            if userpopup._prefetch_job is staging:
+                userpopup._prefetch_job = None
+            if exc_info is not None:
+                dbgmsg(0, 'Popuplib2: Prefetching build_callback raised:')
+                sys.excepthook(*exc_info)
+            else:
+                userpopup._prefetched = staging
+        _usermanager.workers.submit(self.build_callback,
+            (user.userid, staging), {}, handler)
+
+    def _build_finished(self, userpopup, staging, exc_info):
+        '''Take the built contents and show them if the popup is visible.'''
+        if userpopup._build_job is staging:
+            userpopup._build_job = None
+        if exc_info is None:
+            userpopup._take_built(staging)
+        else:
+            dbgmsg(0, 'Popuplib2: Asynchronous build_callback raised:')
+            sys.excepthook(*exc_info)
+            # stop loading, keep the previous contents
+            userpopup._built = True
+        user = userpopup._user
+        if (user.queue and user.queue[0] is userpopup and
+            not userpopup._being_hidden):
+            userpopup._show_built()
+
+
+class PersonalPopup(_BuildCallbackMixin, Popup):
     '''
     Callback-based dynamically created popup.
 
@@ -748,6 +1488,12 @@ class PersonalPopup(Popup):
       submenu and displayed immediately after processing the resonse.
     menuselect_args -- a dictionary containing extra information that is put
       to the menuselect callback dict
+    async_build -- None to call build_callback on the game thread (default),
+      ASYNC_THREAD to call it in a worker thread or ASYNC_FUTURE if it
+      returns a future (an object with done and result methods); the
+      userpopup given to an asynchronous build_callback is a staging copy
+      which is displayed when the build is done, until then the previous
+      contents or a loading text are displayed
     '''
 
     _user_popup_class = UserPersonalPopup
@@ -756,14 +1502,7 @@ class PersonalPopup(Popup):
         '''Initialize a new PersonalPopup.'''
         super(PersonalPopup, self).__init__(*args, **kw)
         self.build_callback = build_callback
-
-    def _send(self, user, *args, **kw):
-        '''Send this popup to _User object.'''
-        userpopup = self._get_userpopup(user)
-        userpopup._contents = []
-        self.build_callback(user.userid, userpopup, *args, **kw)
-        userpopup._send()
-        return userpopup
+        self.async_build = None
 
 
 class PagedMenu(Popup):
@@ -783,23 +1522,207 @@ class PagedMenu(Popup):
     title -- the title of the menu
     description -- the description of the menu
     call_special -- bool, will menuselect be called with non-choice inputs too
+    prefetch_pages -- if True, the options of the pages before and after a
+      displayed page are read in a worker thread and the pages rendered to
+      the render cache, so turning the page does not need to read the
+      options; for menus whose options come from a slow source, such as a
+      LazyPagedMenu provider reading a database, which must then be safe to
+      use from the worker thread
+
+    Giving the constructor keyword argument columns=True stores the options
+    added with add in column form (see OptionColumns), which saves memory in
+    menus with a lot of options. The options of such menus must be handled
+    with the methods add, find and remove.
     '''
 
     _user_popup_class = UserPagedMenu
 
+    # attributes whose change affects every rendered page
+    _page_attributes = ('title', 'description', 'options_per_page')
+
     def __init__(self, *args, **kw):
         '''Initialize a new PagedMenu.'''
+        columns = kw.pop('columns', False)
         super(PagedMenu, self).__init__(*args, **kw)
-        self._menuselect_special = {
-            'raw_choice': None,
-            'page': None,
-        } # maybe needed for Popup._response with custom userpopups
+        self._columns = OptionColumns() if columns else None
         self.title = ''
         self.description = ''
         self.call_special = False
         self.options_per_page = 7 # do not change, or at least don't increase
+        self.prefetch_pages = False
+        # the view keys of the pages being prefetched
+        self._prefetching = set()
+        # True when the indexes recorded to the options are up to date
+        self._options_indexed = True
 
         self.enable_keys = "0123456789"
+        # the options given to the constructor
+        self._contents_added(self, 0)
+
+    def __setattr__(self, attr, value):
+        '''menu.attr = value'''
+        super(PagedMenu, self).__setattr__(attr, value)
+        if attr in self._page_attributes:
+            self._render_version += 1
+            self._render_cache.clear()
+
+    def _prefetch_adjacent(self, userpopup):
+        '''
+        Read the options of the pages next to the page of the userpopup in
+        a worker thread unless the pages are cached or being prefetched
+        already. The pages are rendered on the game thread.
+        '''
+        pages = userpopup.pages()
+        language = userpopup.get_language()
+        for pagenum in (userpopup.pagenum - 1, userpopup.pagenum + 1):
+            if not 1 <= pagenum <= pages:
+                continue
+            # the _view_key of the page
+            key = (language, pagenum, pages)
+            if key in self._render_cache or key in self._prefetching:
+                continue
+            self._prefetching.add(key)
+            start = (pagenum-1)*self.options_per_page
+            _usermanager.workers.submit(self._fetch_options,
+                (start, start + self.options_per_page), {},
+                self._prefetch_handler(userpopup._user, pagenum, key,
+                self._render_version))
+
+    def _prefetch_handler(self, user, pagenum, key, version):
+        '''Return the handler rendering the page from the fetched options.'''
+        def handler(options, exc_info):
+            self._prefetching.discard(key)
+            if exc_info is not None:
+                dbgmsg(0, 'Popuplib2: Prefetching a page raised:')
+                sys.excepthook(*exc_info)
+                return
+            if (version != self._render_version or
+                    _usermanager.users.get(user.userid) is not user):
+                return
+            self._register_options(options)
+            # renders the page without changing the page of the user
+            renderer = self._user_popup_class(user, self)
+            renderer._prepare(pagenum)
+            renderer._fetched_options = options
+            if renderer._view_key() == key:
+                self._render_cache[key] = renderer._payload(
+                    renderer.generate_text())
+        return handler
+
+    def _contents_changed(self, start=0, stop=None):
+        '''
+        Forget the cached pages showing the contents from start to stop.
+
+        Pages rendered for a different page count are forgotten too, their
+        navigation links are no longer valid.
+        '''
+        self._render_version += 1
+        if stop is None:
+            # the options after start may have moved
+            self._options_indexed = False
+        render_cache = self._render_cache
+        if not render_cache:
+            return
+        first = start // self.options_per_page + 1
+        if stop is None:
+            last = None
+        else:
+            last = (stop - 1) // self.options_per_page + 1
+        pages = self.pages()
+        # the keys are (language, page number, page count)
+        for key in render_cache.keys():
+            if key[2] != pages or (
+                key[1] >= first and (last is None or key[1] <= last)
+            ):
+                del render_cache[key]
+
+    def _contents_added(self, items, start):
+        '''Register this menu to be notified when added options change.'''
+        for index, item in enumerate(items):
+            if (isinstance(item, MenuOption) and
+                    item._add_owner(self, start + index)):
+                # the option may be in this menu more than once
+                self._options_indexed = False
+
+    def _index_options(self):
+        '''
+        Record the index of each option in this menu to the option, -1 for
+        the options in this menu more than once.
+        '''
+        seen = set()
+        for index, option in enumerate(self):
+            if isinstance(option, MenuOption):
+                if id(option) in seen:
+                    option._add_owner(self, -1)
+                else:
+                    seen.add(id(option))
+                    option._add_owner(self, index)
+        self._options_indexed = True
+
+    def _option_changed(self, option, index):
+        '''
+        Forget the cached pages showing the changed option, index is the
+        index recorded to the option.
+        '''
+        if self._columns is not None:
+            # store the change in the row the option was made from
+            index = self._columns.row(option)
+            if index is None:
+                return
+            self._columns.update(
+                index, option.choice, option.text, option.selectable)
+            self._contents_changed(index, index+1)
+            return
+        if not self._options_indexed:
+            # the options have moved or been added more than once
+            self._index_options()
+            index = option._owner_index(self)
+        if index is None or index >= len(self) or (
+                index >= 0 and self[index] is not option):
+            # the option is no longer in this menu
+            return
+        if index >= 0:
+            self._contents_changed(index, index+1)
+            return
+        for index, opt in enumerate(self):
+            if opt is option:
+                self._contents_changed(index, index+1)
+
+    def _option_count(self):
+        '''Return the number of options in this menu.'''
+        if self._columns is None:
+            return len(self)
+        return len(self._columns)
+
+    def _fetch_options(self, start, stop):
+        '''
+        Return a list of the options from index start to stop without
+        registering this menu as their owner, may be called in a worker
+        thread.
+        '''
+        if self._columns is None:
+            return self[start:stop]
+        return self._columns.slice(start, stop)
+
+    def _register_options(self, options):
+        '''Register this menu as the owner of the fetched options.'''
+        if self._columns is not None:
+            for option in options:
+                option._add_owner(self)
+
+    def _option_slice(self, start, stop):
+        '''Return a list of the options from index start to stop.'''
+        options = self._fetch_options(start, stop)
+        self._register_options(options)
+        return options
+
+    def _option_at(self, index):
+        '''Return the option at index, raise IndexError if there is none.'''
+        if self._columns is None:
+            return self[index]
+        option = self._columns.option(index)
+        option._add_owner(self)
+        return option
 
     def add(self, choice, text, selectable=True):
         '''
@@ -815,6 +1738,11 @@ class PagedMenu(Popup):
         Return value:
         the MenuOption instance added to the menu
         '''
+        if self._columns is not None:
+            self._columns.append(choice, text, selectable)
+            index = len(self._columns) - 1
+            self._contents_changed(index, index+1)
+            return self._option_at(index)
         opt = MenuOption(choice, text, selectable)
         self.append(opt)
         return opt
@@ -823,6 +1751,11 @@ class PagedMenu(Popup):
         '''
         Find added menu option and return it or None if not found.
         '''
+        if self._columns is not None:
+            try:
+                return self._option_at(self._columns.index(choice))
+            except ValueError:
+                return None
         for opt in self:
             if opt.choice == choice:
                 return opt
@@ -832,6 +1765,14 @@ class PagedMenu(Popup):
         '''
         Find added menu option and remove it, returning it.
         '''
+        if self._columns is not None:
+            try:
+                index = self._columns.index(choice)
+            except ValueError:
+                return None
+            opt = self._columns.pop(index)
+            self._contents_changed(index)
+            return opt
         for index, opt in enumerate(self):
             if opt.choice == choice:
                 return self.pop(index)
@@ -839,7 +1780,8 @@ class PagedMenu(Popup):
 
     def pages(self):
         '''Count the number of pages in this popup.'''
-        full_pages, left_over_options = divmod(len(self), self.options_per_page)
+        full_pages, left_over_options = divmod(
+            self._option_count(), self.options_per_page)
         return full_pages + (1 if left_over_options else 0)
 
     def isvalidpage(self, pagenum):
@@ -852,7 +1794,7 @@ class PagedMenu(Popup):
 
 
 
-class PersonalMenu(PagedMenu):
+class PersonalMenu(_BuildCallbackMixin, PagedMenu):
     '''
     A paged menu popup that displays personal information to users.
 
@@ -875,6 +1817,16 @@ class PersonalMenu(PagedMenu):
     menuselect_args -- a dictionary containing extra information that is put
       to the menuselect callback dict
     call_special -- bool, will menuselect be called with non-choice inputs too
+    prefetch_pages -- if True and async_build is None, build_callback is
+      called in a worker thread after each display and a page turn shows
+      the contents built ahead instead of calling build_callback, which
+      must then be safe to call from the worker thread
+    async_build -- None to call build_callback on the game thread (default),
+      ASYNC_THREAD to call it in a worker thread or ASYNC_FUTURE if it
+      returns a future (an object with done and result methods); the
+      userpopup given to an asynchronous build_callback is a staging copy
+      which is displayed when the build is done, until then the previous
+      contents or a loading text are displayed
     '''
 
     _user_popup_class = UserPersonalMenu
@@ -883,14 +1835,7 @@ class PersonalMenu(PagedMenu):
         '''Initialize a new PersonalMenu.'''
         super(PersonalMenu, self).__init__(*args, **kw)
         self.build_callback = build_callback
-
-    def _send(self, user, *args, **kw):
-        '''Send this popup to _User object.'''
-        userpopup = self._get_userpopup(user)
-        userpopup._contents = []
-        self.build_callback(user.userid, userpopup, *args, **kw)
-        userpopup._send()
-        return userpopup
+        self.async_build = None
 
 
 class PagedList(PagedMenu):
@@ -921,3 +1866,119 @@ class PagedList(PagedMenu):
         self.options_per_page = 10
 
 
+class LazyPagedMenu(PagedMenu):
+    '''
+    A paged menu popup that gets its options from a data provider.
+
+    The constructor parameter provider must be an object with two methods:
+    count() returning the number of options, and slice(start, stop) returning
+    a list of the MenuOption instances from index start to stop. Only the
+    options of the displayed page are requested from the provider, so the
+    options do not need to exist in memory. OptionColumns instances can be
+    used as providers.
+
+    Rendered pages are cached like in PagedMenu; call invalidate when the
+    data of the provider changes.
+
+    Attributes:
+    provider -- the data provider of the options
+    language -- the abbreviated language for automatically created content,
+      filled automatically if added to PopupGroup
+    menuselect -- callback function that is called when user gives response
+      to this popup; the callback function must accept one parameter, a dict
+      that contains at least keys "popup", "userid" and "choice". The callback
+      function may return a popup or popupgroup object which will be used as a
+      submenu and displayed immediately after processing the resonse.
+    menuselect_args -- a dictionary containing extra information that is put
+      to the menuselect callback dict
+    title -- the title of the menu
+    description -- the description of the menu
+    call_special -- bool, will menuselect be called with non-choice inputs too
+    '''
+
+    def __init__(self, provider, *args, **kw):
+        '''Initialize a new LazyPagedMenu.'''
+        super(LazyPagedMenu, self).__init__(*args, **kw)
+        self.provider = provider
+
+    def invalidate(self, start=0, stop=None):
+        '''
+        Forget the rendered pages showing the options from index start to
+        stop, all of them by default.
+        '''
+        self._contents_changed(start, stop)
+
+    def _option_changed(self, option, index):
+        '''
+        The options of the provider may have moved since the option was
+        read, forget all pages.
+        '''
+        self._contents_changed()
+
+    def _option_count(self):
+        '''Return the number of options in this menu.'''
+        return self.provider.count()
+
+    def _fetch_options(self, start, stop):
+        '''Return a list of the options from index start to stop.'''
+        if stop is None:
+            stop = self.provider.count()
+        return self.provider.slice(start, stop)
+
+    def _register_options(self, options):
+        '''Register this menu as the owner of the fetched options.'''
+        for option in options:
+            if isinstance(option, MenuOption):
+                option._add_owner(self)
+
+    def _option_at(self, index):
+        '''Return the option at index, raise IndexError if there is none.'''
+        options = index >= 0 and self._option_slice(index, index+1)
+        if not options:
+            raise IndexError('option index out of range')
+        return options[0]
+
+    def add(self, choice, text, selectable=True):
+        '''The options come from the provider.'''
+        raise PopuplibError('LazyPagedMenu options come from its provider')
+
+    def find(self, choice):
+        '''
+        Find menu option and return it or None if not found.
+
+        The provider is scanned a page at a time, use sparingly.
+        '''
+        count = self.provider.count()
+        for start in xrange(0, count, self.options_per_page):
+            for opt in self._option_slice(start, start+self.options_per_page):
+                if opt.choice == choice:
+                    return opt
+        return None
+
+    def remove(self, choice):
+        '''The options come from the provider.'''
+        raise PopuplibError('LazyPagedMenu options come from its provider')
+
+
+class LazyPagedList(LazyPagedMenu, PagedList):
+    '''
+    A paged list popup that gets its items from a data provider.
+
+    The provider is used like in LazyPagedMenu, its slice method may return
+    strings or MenuOption instances.
+
+    Attributes:
+    provider -- the data provider of the items
+    language -- the abbreviated language for automatically created content,
+      filled automatically if added to PopupGroup
+    menuselect -- callback function that is called when user gives response
+      to this popup; the callback function must accept one parameter, a dict
+      that contains at least keys "popup", "userid" and "choice". The callback
+      function may return a popup or popupgroup object which will be used as a
+      submenu and displayed immediately after processing the resonse.
+    menuselect_args -- a dictionary containing extra information that is put
+      to the menuselect callback dict
+    title -- the title of the list
+    description -- the description of the list
+    options_per_page -- the number of items displayed per page (default 10)
+    '''
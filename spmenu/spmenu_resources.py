@@ -1,45 +1,168 @@
 '''
 Resource loading module for spmenu.
+
+The parsed INI files are cached in marshal files next to them, see
+_load_cached. The language data is loaded on first use.
 '''
+import marshal
 import os
 
 import es
 
 import langlib
-from configobj import ConfigObj
 
 from spmenu_common import dbgmsg, dbgmsg_repr
 
-def load_language_data(module):
+# bump when the format of the cached data changes
+CACHE_VERSION = 1
+
+lang_data = None
+''' lang_data = {identifier: {language: text,},} or None if not loaded '''
+
+_chrome = {}
+''' _chrome = {language: {chrome part name: text,},} '''
+
+def _load_cached(filename, parse):
+    '''
+    Return parse(filename), cached in a marshal file next to the file.
+
+    The cache is keyed by the modification time and the size of the file,
+    so the file is only parsed again when it changes. The parsed data must
+    be marshallable. Failing to write the cache is not an error.
+    '''
+    stat = os.stat(filename)
+    key = (CACHE_VERSION, int(stat.st_mtime), stat.st_size)
+    cachename = os.path.splitext(filename)[0] + '.cache'
+    try:
+        cachefile = open(cachename, 'rb')
+        try:
+            cached_key, data = marshal.load(cachefile)
+        finally:
+            cachefile.close()
+        if cached_key == key:
+            dbgmsg(2, 'spmenu: using cache %s', cachename)
+            return data
+    except (IOError, EOFError, ValueError, TypeError):
+        pass
+    dbgmsg(1, 'spmenu: parsing %s', filename)
+    data = parse(filename)
+    try:
+        cachefile = open(cachename, 'wb')
+        try:
+            marshal.dump((key, data), cachefile)
+        finally:
+            cachefile.close()
+    except IOError:
+        dbgmsg(1, 'spmenu: could not write cache %s', cachename)
+    return data
+
+def _parse_language_data(filename):
+    '''Parse the language file to {identifier: {language: text,},}.'''
+    strings = langlib.Strings(filename)
+    return dict((identifier, dict(texts))
+        for identifier, texts in strings.iteritems())
+
+def _parse_game_data(filename):
+    '''Parse the game file to {game name: {key: value,},}.'''
+    # ConfigObj is only needed when the cache is out of date
+    from configobj import ConfigObj
+    return dict((gamename, dict(section))
+        for gamename, section in ConfigObj(filename).iteritems())
+
+def _data_filename(module, name):
+    if module is None:
+        mypath = os.path.dirname(os.path.abspath(__file__))
+    else:
+        mypath = os.path.split(module.__file__)[0]
+    return os.path.join(mypath, name)
+
+def load_language_data(module=None):
     global lang_data
-    mypath = os.path.split(module.__file__)[0]
-    filename = os.path.join(mypath, 'language_data.ini')
-    lang_data = langlib.Strings(filename)
+    filename = _data_filename(module, 'language_data.ini')
+    lang_data = _load_cached(filename, _parse_language_data)
+    # pre-render the menu chrome for the known languages
+    _chrome.clear()
+    languages = set()
+    for strings in lang_data.itervalues():
+        languages.update(strings)
+    for language in languages:
+        _chrome[language] = build_chrome(language)
     return lang_data
 
-def load_game_data(module):
-    mypath = os.path.split(module.__file__)[0]
-    filename = os.path.join(mypath, 'game_data.ini')
-    data = ConfigObj(filename)
-    return data
+def load_game_data(module=None):
+    filename = _data_filename(module, 'game_data.ini')
+    return _load_cached(filename, _parse_game_data)
 
-def get_game_data(module):
+def get_game_data(module=None):
     global game_data
     data = load_game_data(module)
     # GJ HAX:
     gamename = str(es.ServerVar('eventscripts_gamedir')).replace('\\', '/').rpartition('/')[2].lower()
-    dbgmsg(1, 'spmenu: game name is %s'%repr(gamename))
+    dbgmsg(1, 'spmenu: game name is %r', gamename)
     if gamename not in data:
         dbgmsg(1, 'spmenu: game not found, going default')
         gamename = 'default'
     this_game = data[gamename]
     game_data = {
         'type': this_game['type'],
-        'refresh': this_game.as_int('refresh') if this_game['type'] == 'radio' else 0,
+        'refresh': int(this_game['refresh']) if this_game['type'] == 'radio' else 0,
         }
     dbgmsg_repr(2, game_data)
     return game_data
 
 def get_string(identifier, language):
-    return lang_data.expand(identifier, lang=language)
+    '''
+    Return the text of the identifier in the language.
+
+    Falls back to the server default language, then to English and then to
+    any language the text is available in.
+    '''
+    if lang_data is None:
+        load_language_data()
+    strings = lang_data[identifier]
+    if language in strings:
+        return strings[language]
+    language = langlib.getDefaultLang()
+    if language in strings:
+        return strings[language]
+    if 'en' in strings:
+        return strings['en']
+    return strings.values()[0]
+
+def build_chrome(language):
+    '''
+    Build the menu chrome for the language.
+
+    Returns a dict with the separator line and the footers of the menu
+    pages. The footers are named by the menu type and the page position:
+    paged_* for PagedMenu and personal_* for PersonalMenu pages, followed
+    by first, middle, last, single or empty. A footer contains the page
+    navigation links and the exit button.
+    '''
+    separator = '-'*30
+    s_empty = get_string('empty', language)
+    s_prev = get_string('prev', language)
+    s_next = get_string('next', language)
+    cancel = '0. %s'%get_string('cancel', language)
+    prev = '->8. %s\n'%s_prev
+    next = '->9. %s\n'%s_next
+    footers = {
+        'single': ((' ', ' ', ' '), (separator, ' ', ' ')),
+        'first': ((' ', ' ', next), (separator, '8. %s'%s_prev, next)),
+        'middle': ((' ', prev, next), (separator, prev, next)),
+        'last': ((' ', prev, ' '), (separator, prev, '9. %s\n'%s_next)),
+        'empty': ((s_empty,), (s_empty,)),
+    }
+    chrome = {'separator': separator}
+    for position, (paged, personal) in footers.iteritems():
+        chrome['paged_' + position] = '\n'.join(paged + (cancel,))
+        chrome['personal_' + position] = '\n'.join(personal + (cancel,))
+    return chrome
 
+def get_chrome(language):
+    '''Return the menu chrome for the language, see build_chrome.'''
+    if lang_data is None:
+        load_language_data()
+    if language not in _chrome:
+        _chrome[language] = build_chrome(language)
+    return _chrome[language]
@@ -0,0 +1,414 @@
+'''
+Performance counters of spmenu popups.
+
+Every popup has a PopupStats instance as its _stats attribute which the
+popup code updates directly, so the counting is cheap enough to be always
+on. The counters of deleted popups are added to the totals of their class.
+The spmenu_stats server command prints the class totals and the top popups.
+It is registered on import, unregister_command removes it when the addon
+using spmenu unloads and register_command registers it again.
+
+The menuselect and build_callback calls are also timed into rolling latency
+histograms of the popups. A call taking longer than callback_budget is
+reported with a warning, at most once per warning_interval per popup. The
+smoothed menuselect time decides whether a popup with defer_slow_menuselect
+defers its menuselect calls.
+
+The menuselects over the rate limit of the user manager are counted per
+user, spmenu_stats abuse prints the users with the most of them.
+'''
+import array
+import time
+import weakref
+
+import es
+import cmdlib
+
+
+FIELDS = ('sends', 'displays', 'cache_hits', 'menu_calls', 'bytes_sent',
+    'menuselects', 'menuselect_time', 'build_time', 'over_budget')
+
+# seconds a menuselect or build_callback call may take without a warning
+callback_budget = 0.005
+# minimum seconds between the budget warnings of a popup
+warning_interval = 30.0
+# the weight of the latest call in the smoothed menuselect time
+smoothing = 0.25
+
+# the upper bounds in milliseconds of the latency histogram buckets, the
+# last bucket has the slower calls
+LATENCY_BOUNDS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100)
+
+# the columns of the printed report, (field, header, width)
+_COLUMNS = (
+    ('sends', 'sends', 8),
+    ('displays', 'disp', 8),
+    ('cache_hits', 'hits', 8),
+    ('menu_calls', 'menus', 8),
+    ('bytes_sent', 'bytes', 11),
+    ('menuselects', 'select', 8),
+    ('menuselect_time', 'sel ms', 10),
+    ('build_time', 'build ms', 10),
+    ('over_budget', 'over', 6),
+    )
+
+
+class LatencyHistogram(object):
+    '''
+    Histogram of the latencies of the last calls.
+
+    The bucket of each of the last size calls is kept in a ring, so adding a
+    call also removes the oldest one from the counts.
+    '''
+    __slots__ = ('counts', '_ring', '_position', 'calls')
+
+    def __init__(self, size=256):
+        self.counts = [0]*(len(LATENCY_BOUNDS) + 1)
+        self._ring = array.array('B', [0])*size
+        self._position = 0
+        self.calls = 0 # calls in the histogram, at most size
+
+    def add(self, seconds):
+        '''Add a call that took seconds.'''
+        milliseconds = seconds * 1000
+        bucket = 0
+        for bound in LATENCY_BOUNDS:
+            if milliseconds <= bound:
+                break
+            bucket += 1
+        ring = self._ring
+        if self.calls == len(ring):
+            self.counts[ring[self._position]] -= 1
+        else:
+            self.calls += 1
+        ring[self._position] = bucket
+        self.counts[bucket] += 1
+        self._position = (self._position + 1) % len(ring)
+
+    def percentile(self, fraction):
+        '''
+        Return the upper bound in milliseconds of the bucket of the fraction
+        of the calls, None for the slowest bucket or if there are no calls.
+        '''
+        if not self.calls:
+            return None
+        limit = fraction * self.calls
+        total = 0
+        for bound, count in zip(LATENCY_BOUNDS, self.counts):
+            total += count
+            if total >= limit:
+                return bound
+        return None
+
+    def __repr__(self):
+        return 'LatencyHistogram(%r)'%dict(zip(
+            LATENCY_BOUNDS + ('slower',), self.counts))
+
+
+class PopupStats(object):
+    '''
+    The counters of a popup or of all popups of a class.
+
+    Attributes:
+    sends -- popup sent to a user queue
+    displays -- popup displays, not counting the timed refreshes that sent
+      the previously displayed text again
+    cache_hits -- display used a cached rendering, including timed refreshes
+      that sent the previously displayed text again
+    menu_calls -- es.menu (or es.escmenu) calls
+    bytes_sent -- the total length of the radio menu texts and the ESC menu
+      titles, messages and items sent
+    menuselects -- menuselect callback calls
+    menuselect_time -- seconds spent in the menuselect callback
+    build_time -- seconds spent in the build_callback of personal popups
+    over_budget -- menuselect and build_callback calls over callback_budget
+    menuselect_latency -- LatencyHistogram of the menuselect calls
+    build_latency -- LatencyHistogram of the build_callback calls
+    menuselect_average -- exponentially smoothed seconds of the menuselect
+      calls, None before the first call
+    menuselect_slow -- True if menuselect_average is over callback_budget
+    '''
+    __slots__ = FIELDS + ('menuselect_latency', 'build_latency',
+        'menuselect_average', '_last_warning')
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        '''Set all counters to zero.'''
+        for field in FIELDS:
+            setattr(self, field, 0)
+        # the histograms are created for the popups that have callbacks
+        self.menuselect_latency = None
+        self.build_latency = None
+        self.menuselect_average = None
+        self._last_warning = 0
+
+    def add(self, other):
+        '''Add the counters of other PopupStats to these.'''
+        for field in FIELDS:
+            setattr(self, field, getattr(self, field) + getattr(other, field))
+
+    def menuselect_done(self, popup, seconds):
+        '''The menuselect callback of the popup took seconds.'''
+        self.menuselects += 1
+        self.menuselect_time += seconds
+        if self.menuselect_latency is None:
+            self.menuselect_latency = LatencyHistogram()
+        self.menuselect_latency.add(seconds)
+        if self.menuselect_average is None:
+            self.menuselect_average = seconds
+        else:
+            self.menuselect_average += (
+                seconds - self.menuselect_average) * smoothing
+        self._check_budget(popup, 'menuselect', seconds)
+
+    def _get_menuselect_slow(self):
+        return (self.menuselect_average is not None and
+            self.menuselect_average > callback_budget)
+
+    menuselect_slow = property(_get_menuselect_slow)
+
+    def build_done(self, popup, seconds):
+        '''The build_callback of the popup took seconds.'''
+        self.build_time += seconds
+        if self.build_latency is None:
+            self.build_latency = LatencyHistogram()
+        self.build_latency.add(seconds)
+        self._check_budget(popup, 'build_callback', seconds)
+
+    def _check_budget(self, popup, callback, seconds):
+        if seconds <= callback_budget:
+            return
+        self.over_budget += 1
+        now = time.time()
+        if now - self._last_warning < warning_interval:
+            return
+        self._last_warning = now
+        histogram = getattr(self, callback == 'menuselect' and
+            'menuselect_latency' or 'build_latency')
+        p99 = histogram.percentile(0.99)
+        es.dbgmsg(0, 'spmenu: %s of %s took %.1f ms, budget %.1f ms, '
+            '%d calls over budget, p99 %s'%(callback, _popup_label(popup),
+            seconds*1000, callback_budget*1000, self.over_budget,
+            p99 is None and 'over %s ms'%LATENCY_BOUNDS[-1] or '%s ms'%p99))
+
+    def __repr__(self):
+        return 'PopupStats(%s)'%', '.join(['%s=%r'%(field, getattr(self, field))
+            for field in FIELDS])
+
+
+_live = {}
+''' _live = {id(popup): (weakref to popup, class name, PopupStats),} '''
+
+_retired = {}
+''' _retired = {class name: PopupStats of the deleted popups,} '''
+
+
+def _class_name(cls):
+    '''Return the backend qualified name of the popup class.'''
+    return '%s.%s'%(cls.__module__.rpartition('.')[2], cls.__name__)
+
+
+def track(popup):
+    '''Return the new PopupStats of the popup.'''
+    key = id(popup)
+    name = _class_name(type(popup))
+    stats = PopupStats()
+    def retire(ref):
+        # the popup was deleted, keep its counters in the class totals
+        if _live.get(key, (None,))[0] is ref:
+            del _live[key]
+        if name not in _retired:
+            _retired[name] = PopupStats()
+        _retired[name].add(stats)
+    _live[key] = (weakref.ref(popup, retire), name, stats)
+    return stats
+
+
+def reset():
+    '''Reset the counters of all popups and classes.'''
+    _retired.clear()
+    for ref, name, stats in _live.values():
+        stats.reset()
+
+
+def class_totals():
+    '''Return {class name: PopupStats} of live and deleted popups.'''
+    totals = {}
+    for name, stats in _retired.iteritems():
+        totals[name] = PopupStats()
+        totals[name].add(stats)
+    for ref, name, stats in _live.values():
+        if name not in totals:
+            totals[name] = PopupStats()
+        totals[name].add(stats)
+    return totals
+
+
+def top_popups(field='menu_calls', count=10):
+    '''Return a list of (popup, PopupStats), highest field values first.'''
+    report = []
+    for ref, name, stats in _live.values():
+        popup = ref()
+        if popup is not None:
+            report.append((getattr(stats, field), id(popup), popup, stats))
+    report.sort(reverse=True)
+    return [(popup, stats) for value, popup_id, popup, stats in report[:count]]
+
+
+def _format_row(label, stats):
+    values = []
+    for field, header, width in _COLUMNS:
+        value = getattr(stats, field)
+        if field.endswith('_time'):
+            # seconds to milliseconds
+            values.append('%*.1f'%(width, value*1000))
+        else:
+            values.append('%*d'%(width, value))
+    return '%-32s%s'%(label[:31], ''.join(values))
+
+
+def _popup_label(popup):
+    title = getattr(popup, 'title', None)
+    label = '%s#%x'%(type(popup).__name__, id(popup))
+    if title:
+        label = '%s %s'%(label, title)
+    return label
+
+
+def print_report(field='menu_calls', count=10):
+    '''Print the class totals and the top popups by field to the console.'''
+    from spmenu_common import _usermanager
+    header = '%-32s%s'%('', ''.join(['%*s'%(width, header)
+        for column, header, width in _COLUMNS]))
+    es.dbgmsg(0, 'spmenu: timed refreshes %d, sent without rendering %d, '
+        'coalesced refreshes %d'%(_usermanager.timed_refreshes,
+        _usermanager.cached_refreshes, _usermanager.coalesced_refreshes))
+    es.dbgmsg(0, header)
+    totals = class_totals().items()
+    totals.sort(key=lambda item: getattr(item[1], field), reverse=True)
+    for name, stats in totals:
+        es.dbgmsg(0, _format_row(name, stats))
+    es.dbgmsg(0, 'spmenu: top %d popups by %s'%(count, field))
+    for popup, stats in top_popups(field, count):
+        es.dbgmsg(0, _format_row(_popup_label(popup), stats))
+
+
+def _format_bound(bound):
+    if bound is None:
+        return '>%s'%LATENCY_BOUNDS[-1]
+    return str(bound)
+
+
+def print_latency(count=10):
+    '''Print the callback latencies of the popups with most budget overruns.'''
+    es.dbgmsg(0, 'spmenu: callback latency in ms, budget %.1f ms'%(
+        callback_budget*1000))
+    es.dbgmsg(0, '%-32s%-16s%8s%8s%8s%8s'%('', 'callback', 'calls', 'p50',
+        'p90', 'p99'))
+    for popup, stats in top_popups('over_budget', count):
+        for callback, histogram in (('menuselect', stats.menuselect_latency),
+                ('build_callback', stats.build_latency)):
+            if histogram is not None:
+                es.dbgmsg(0, '%-32s%-16s%8d%8s%8s%8s'%(
+                    _popup_label(popup)[:31], callback, histogram.calls,
+                    _format_bound(histogram.percentile(0.5)),
+                    _format_bound(histogram.percentile(0.9)),
+                    _format_bound(histogram.percentile(0.99))))
+
+
+def top_abusers(count=10):
+    '''Return a list of (userid, throttled menuselects), most first.'''
+    from spmenu_common import _usermanager
+    report = [(user.throttled_menuselects, userid) for userid, user
+        in _usermanager.users.iteritems() if user.throttled_menuselects]
+    report.sort(reverse=True)
+    return [(userid, throttled) for throttled, userid in report[:count]]
+
+
+def print_abuse(count=10):
+    '''Print the menuselect rate limit counters to the console.'''
+    from spmenu_common import _usermanager
+    if _usermanager.menuselect_rate > 0:
+        es.dbgmsg(0, 'spmenu: menuselect limit %s per second, burst %s'%(
+            _usermanager.menuselect_rate, _usermanager.menuselect_burst))
+    else:
+        es.dbgmsg(0, 'spmenu: no menuselect limit')
+    es.dbgmsg(0, 'spmenu: ignored menuselects %d, merged page changes %d'%(
+        _usermanager.throttled_menuselects, _usermanager.merged_page_moves))
+    for userid, throttled in top_abusers(count):
+        es.dbgmsg(0, '%8d%10d'%(userid, throttled))
+
+
+def stats_command(args):
+    '''
+    spmenu_stats [field] [count] -- print the top popups by field
+    spmenu_stats latency [count] -- print the callback latency histograms
+    spmenu_stats abuse [count] -- print the users over the menuselect limit
+    spmenu_stats budget [milliseconds] -- show or set callback_budget
+    spmenu_stats reset -- reset the counters
+    '''
+    global callback_budget
+    field = 'menu_calls'
+    count = 10
+    if args and args[0] == 'reset':
+        reset()
+        es.dbgmsg(0, 'spmenu: statistics reset')
+        return
+    if args and args[0] == 'budget':
+        if len(args) > 1:
+            try:
+                callback_budget = float(args[1]) / 1000
+            except ValueError:
+                pass
+        es.dbgmsg(0, 'spmenu: callback budget is %.1f ms'%(
+            callback_budget*1000))
+        return
+    if args and args[0] == 'latency':
+        if len(args) > 1 and args[1].isdigit():
+            count = int(args[1])
+        print_latency(count)
+        return
+    if args and args[0] == 'abuse':
+        if len(args) > 1 and args[1].isdigit():
+            count = int(args[1])
+        print_abuse(count)
+        return
+    if args:
+        field = args[0]
+        if field not in FIELDS:
+            es.dbgmsg(0, 'spmenu: unknown field %s, use one of: %s'%(
+                field, ', '.join(FIELDS)))
+            return
+    if len(args) > 1:
+        try:
+            count = int(args[1])
+        except ValueError:
+            pass
+    print_report(field, count)
+
+
+_command_registered = False
+
+
+def register_command():
+    '''Register the spmenu_stats server command, once.'''
+    global _command_registered
+    if _command_registered:
+        return
+    cmdlib.registerServerCommand('spmenu_stats', stats_command,
+        'Print spmenu popup statistics: spmenu_stats [field] [count] | '
+        'latency [count] | abuse [count] | budget [milliseconds] | reset')
+    _command_registered = True
+
+
+def unregister_command():
+    '''Unregister the spmenu_stats server command if it is registered.'''
+    global _command_registered
+    if _command_registered:
+        cmdlib.unregisterServerCommand('spmenu_stats')
+        _command_registered = False
+
+
+register_command()
@@ -0,0 +1,223 @@
+'''
+Recording of popup traffic for replaying it in load tests.
+
+When a Recorder is set as the recorder of the user manager, the menuselect
+commands, popup sends and unsends, disconnects and map starts are written
+to a binary trace file. The popups themselves can not be stored, so each
+popup is described by its class name and size when it first appears in the
+trace. benchmarks/replay.py replays a trace against stand-in popups.
+
+Trace file format, all integers little-endian:
+    header: MAGIC, version (B)
+    record: milliseconds since the start (I), event type (B), event data
+
+Event data by type:
+    EVENT_POPUP: popup number (I), item count (I), class name length (B),
+      class name
+    EVENT_SEND: userid (H), popup number (I), page (H)
+    EVENT_UNSEND: userid (H), popup number (I)
+    EVENT_MENUSELECT: userid (H), choice (B)
+    EVENT_DISCONNECT: userid (H)
+    EVENT_MAP_START: nothing
+
+Recording from the server console, the spmenu_record command is registered
+on import and removed by unregister_command:
+    spmenu_record start <filename>
+    spmenu_record stop
+'''
+import struct
+import time
+import weakref
+
+import es
+import cmdlib
+
+
+MAGIC = 'SPMT'
+VERSION = 1
+
+EVENT_POPUP = 1
+EVENT_SEND = 2
+EVENT_UNSEND = 3
+EVENT_MENUSELECT = 4
+EVENT_DISCONNECT = 5
+EVENT_MAP_START = 6
+
+EVENT_NAMES = {
+    EVENT_POPUP: 'popup',
+    EVENT_SEND: 'send',
+    EVENT_UNSEND: 'unsend',
+    EVENT_MENUSELECT: 'menuselect',
+    EVENT_DISCONNECT: 'disconnect',
+    EVENT_MAP_START: 'map_start',
+    }
+
+_record_header = struct.Struct('<IB')
+_event_formats = {
+    EVENT_POPUP: struct.Struct('<IIB'),
+    EVENT_SEND: struct.Struct('<HIH'),
+    EVENT_UNSEND: struct.Struct('<HI'),
+    EVENT_MENUSELECT: struct.Struct('<HB'),
+    EVENT_DISCONNECT: struct.Struct('<H'),
+    EVENT_MAP_START: struct.Struct(''),
+    }
+
+
+def _item_count(popup):
+    '''Return the number of options or lines in the popup.'''
+    if hasattr(popup, '_option_count'):
+        return popup._option_count()
+    return len(popup)
+
+
+class Recorder(object):
+    '''
+    Writes the popup traffic to a trace file.
+
+    The methods are called by the user manager and the users while this is
+    the recorder of the user manager.
+    '''
+    def __init__(self, filename):
+        '''Open the trace file, overwriting an existing file.'''
+        self.filename = filename
+        self._file = open(filename, 'wb')
+        self._file.write(MAGIC + struct.pack('<B', VERSION))
+        self._start = time.time()
+        self._popups = {}
+        ''' self._popups = {id(popup): (weakref to popup, popup number),} '''
+        self._next_number = 1
+        self.events = 0
+
+    def _write(self, event, *data):
+        milliseconds = int((time.time() - self._start) * 1000)
+        self._file.write(_record_header.pack(milliseconds, event) +
+            _event_formats[event].pack(*data))
+        self.events += 1
+
+    def _popup_number(self, popup):
+        '''Return the number of the popup, describing it first if new.'''
+        key = id(popup)
+        if key in self._popups:
+            ref, number = self._popups[key]
+            if ref() is popup:
+                return number
+        number = self._next_number
+        self._next_number += 1
+        self._popups[key] = (weakref.ref(popup), number)
+        name = type(popup).__name__[:255]
+        self._write(EVENT_POPUP, number, _item_count(popup), len(name))
+        self._file.write(name)
+        return number
+
+    def send(self, userid, userpopup):
+        '''The userpopup was sent to the user.'''
+        number = self._popup_number(userpopup._popup)
+        page = getattr(userpopup, 'pagenum', 0)
+        self._write(EVENT_SEND, userid, number, min(page, 0xffff))
+
+    def unsend(self, userid, userpopup):
+        '''The userpopup was unsent from the user.'''
+        self._write(EVENT_UNSEND, userid, self._popup_number(userpopup._popup))
+
+    def menuselect(self, userid, choice):
+        '''The user gave a menuselect command.'''
+        self._write(EVENT_MENUSELECT, userid, choice & 0xff)
+
+    def disconnect(self, userid):
+        self._write(EVENT_DISCONNECT, userid)
+
+    def map_start(self):
+        self._write(EVENT_MAP_START)
+
+    def close(self):
+        self._file.close()
+
+
+def read_trace(filename):
+    '''
+    Iterate the records of a trace file.
+
+    Yields (seconds since the start, event type, event data tuple). The data
+    of EVENT_POPUP records is (popup number, item count, class name).
+    '''
+    tracefile = open(filename, 'rb')
+    try:
+        header = tracefile.read(len(MAGIC) + 1)
+        if header[:len(MAGIC)] != MAGIC:
+            raise ValueError('%s is not a spmenu trace file'%filename)
+        version = struct.unpack('<B', header[len(MAGIC):])[0]
+        if version != VERSION:
+            raise ValueError('unsupported trace version %d'%version)
+        while True:
+            record = tracefile.read(_record_header.size)
+            if len(record) < _record_header.size:
+                break
+            milliseconds, event = _record_header.unpack(record)
+            event_format = _event_formats[event]
+            data = event_format.unpack(tracefile.read(event_format.size))
+            if event == EVENT_POPUP:
+                number, count, length = data
+                data = (number, count, tracefile.read(length))
+            yield milliseconds / 1000.0, event, data
+    finally:
+        tracefile.close()
+
+
+def start(filename):
+    '''Start recording to the file, stopping a running recording first.'''
+    from spmenu_common import _usermanager
+    stop()
+    _usermanager.recorder = Recorder(filename)
+
+
+def stop():
+    '''Stop recording, return the number of events recorded or None.'''
+    from spmenu_common import _usermanager
+    recorder = _usermanager.recorder
+    if recorder is None:
+        return None
+    _usermanager.recorder = None
+    recorder.close()
+    return recorder.events
+
+
+def record_command(args):
+    '''
+    spmenu_record start <filename> -- start recording popup traffic
+    spmenu_record stop -- stop recording
+    '''
+    if len(args) == 2 and args[0] == 'start':
+        start(args[1])
+        es.dbgmsg(0, 'spmenu: recording to %s'%args[1])
+    elif len(args) == 1 and args[0] == 'stop':
+        events = stop()
+        if events is None:
+            es.dbgmsg(0, 'spmenu: not recording')
+        else:
+            es.dbgmsg(0, 'spmenu: recorded %d events'%events)
+    else:
+        es.dbgmsg(0, 'Usage: spmenu_record start <filename> | stop')
+
+
+_command_registered = False
+
+
+def register_command():
+    '''Register the spmenu_record server command, once.'''
+    global _command_registered
+    if _command_registered:
+        return
+    cmdlib.registerServerCommand('spmenu_record', record_command,
+        'Record spmenu popup traffic: spmenu_record start <filename> | stop')
+    _command_registered = True
+
+
+def unregister_command():
+    '''Unregister the spmenu_record server command if it is registered.'''
+    global _command_registered
+    if _command_registered:
+        cmdlib.unregisterServerCommand('spmenu_record')
+        _command_registered = False
+
+
+register_command()
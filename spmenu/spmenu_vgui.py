@@ -1 +1,256 @@
-#todo
\ No newline at end of file
+'''
+More Pythonic and object oriented way to handle tasks previously
+handled by popuplib, ESC menu (VGUI) type popups
+
+The popups are rendered like the radio popups and the rendered text is
+converted to the KeyValues of an ESC menu: the first line is the title,
+numbered lines are the menu items and the rest is the message. The items
+send the same menuselect client command as radio menu keys, so the queue
+and response handling is shared with the radio popups.
+'''
+import itertools
+import re
+
+import es
+
+from spmenu_common import dbgmsg, _debug
+import spmenu_radio
+
+
+# the time in seconds an ESC menu stays available if the popup has no
+# max_display_time
+ESC_MENU_TIME = 200
+
+# radio menu line with an option: optional selection arrow, key and text
+_option_line = re.compile(r'^(->)?([0-9])\. (.*)$')
+
+_keygroup_names = itertools.count(1)
+
+
+class _EscMenu(object):
+    '''
+    The KeyValues of an ESC menu stored in an EventScripts keygroup.
+
+    The keygroup is built once from the rendered text and shared by every
+    user displaying the same view of a popup. It is deleted along with this
+    object when the view is dropped from the render cache of the popup.
+    '''
+    def __init__(self, text, marked_options):
+        '''
+        Build the keygroup.
+
+        Parameters:
+        text -- the rendered radio menu text
+        marked_options -- if True, only lines with a selection arrow and the
+            exit line are items, otherwise every numbered line is an item
+        '''
+        self.name = 'spmenu_%d'%_keygroup_names.next()
+        lines = text.split('\n')
+        message = []
+        items = []
+        for line in lines[1:]:
+            match = _option_line.match(line)
+            if match and (match.group(1) or not marked_options or
+                          match.group(2) == '0'):
+                items.append((match.group(2), match.group(3)))
+            elif line.strip():
+                message.append(line)
+        title = lines[0].strip()
+        message = '\n'.join(message)
+        # the length of the texts sent to the user per display
+        self.size = len(title) + len(message)
+        es.keygroupcreate(self.name)
+        es.keycreate(self.name, 'menu')
+        es.keysetvalue(self.name, 'menu', 'title', title)
+        es.keysetvalue(self.name, 'menu', 'msg', message)
+        for key, item_text in items:
+            self.size += len(item_text)
+            # key 0 is sent as menuselect 10 like in radio menus
+            choice = key == '0' and '10' or key
+            es.keycreate(self.name, key)
+            es.keysetvalue(self.name, key, 'msg', item_text)
+            es.keysetvalue(self.name, key, 'command', 'menuselect %s'%choice)
+
+    def __del__(self):
+        '''The view is no longer cached, free the keygroup.'''
+        es.keygroupdelete(self.name)
+
+
+# UserPopup classes
+
+
+class _EscMenuDisplay(object):
+    '''
+    Mixin for userpopups displaying ESC menus instead of radio menus.
+    '''
+
+    # only the options with a selection arrow are menu items
+    _marked_options = False
+
+    def _payload(self, text):
+        '''Return the payload that displays the text, an _EscMenu.'''
+        text = super(_EscMenuDisplay, self)._payload(text)
+        return _EscMenu(text, self._marked_options)
+
+    def _show(self, payload):
+        '''
+        Send the ESC menu to the user.
+
+        The payload is remembered by the user so delayed refreshes can send
+        it again without rendering.
+        '''
+        self._user.displayed(self, payload)
+        stats = self._popup._stats
+        stats.menu_calls += 1
+        stats.bytes_sent += payload.size
+        duration = self._popup.max_display_time or ESC_MENU_TIME
+        if __debug__ and _debug.level >= 2:
+            dbgmsg(2, 'Popuplib2: Calling es.escmenu(%s, %s, %s)',
+                duration, self._user.userid, payload.name)
+        es.escmenu(duration, self._user.userid, payload.name)
+
+    def hide_display(self):
+        '''Remove this popup type from display.'''
+        # an ESC menu can not be closed, it is ignored when hidden
+        self._being_hidden = True
+
+
+class UserPopup(_EscMenuDisplay, spmenu_radio.UserPopup):
+    '''
+    A basic userpopup class, other userpopups subclass this.
+
+    A userpopup is a view to specific Popup, specific to a single user.
+    Each user for each popup have their own userpopup instances.
+    '''
+
+
+class UserTemplatePopup(_EscMenuDisplay, spmenu_radio.UserTemplatePopup):
+    '''
+    A template userpopup class for TemplatePopup
+
+    A userpopup is a view to specific Popup, specific to a single user.
+    Each user for each popup have their own userpopup instances.
+    '''
+
+
+class UserPersonalPopup(_EscMenuDisplay, spmenu_radio.UserPersonalPopup):
+    '''
+    A userpopup class for PersonalPopup.
+
+    See spmenu_radio.UserPersonalPopup for the usage.
+    '''
+
+
+class UserPagedMenu(_EscMenuDisplay, spmenu_radio.UserPagedMenu):
+    '''
+    A userpopup class for PagedMenu.
+
+    A userpopup is a view to specific Popup, specific to a single user.
+    Each user for each popup have their own userpopup instances.
+    '''
+    _marked_options = True
+
+
+class UserPagedList(_EscMenuDisplay, spmenu_radio.UserPagedList):
+    '''
+    A userpopup class for PagedList.
+
+    A userpopup is a view to specific Popup, specific to a single user.
+    Each user for each popup have their own userpopup instances.
+    '''
+    _marked_options = True
+
+
+class UserPersonalMenu(_EscMenuDisplay, spmenu_radio.UserPersonalMenu):
+    '''
+    A userpopup class for PersonalMenu.
+
+    See spmenu_radio.UserPersonalMenu for the usage.
+    '''
+    _marked_options = True
+
+
+# Option classes
+
+
+MenuOption = spmenu_radio.MenuOption
+OptionColumns = spmenu_radio.OptionColumns
+
+ASYNC_THREAD = spmenu_radio.ASYNC_THREAD
+ASYNC_FUTURE = spmenu_radio.ASYNC_FUTURE
+
+
+# Popup classes
+
+
+class Popup(spmenu_radio.Popup):
+    '''
+    A basic popup class, other popups subclass this.
+
+    See spmenu_radio.Popup for the attributes. The numbered lines of the
+    popup are shown as the items of the ESC menu.
+    '''
+    _user_popup_class = UserPopup
+
+
+class TemplatePopup(spmenu_radio.TemplatePopup):
+    '''
+    A template popup class, popup supporting run-time replacements.
+
+    See spmenu_radio.TemplatePopup for the attributes.
+    '''
+    _user_popup_class = UserTemplatePopup
+
+
+class PersonalPopup(spmenu_radio.PersonalPopup):
+    '''
+    Callback-based dynamically created popup.
+
+    See spmenu_radio.PersonalPopup for the usage and the attributes.
+    '''
+    _user_popup_class = UserPersonalPopup
+
+
+class PagedMenu(spmenu_radio.PagedMenu):
+    '''
+    A paged menu popup.
+
+    See spmenu_radio.PagedMenu for the attributes.
+    '''
+    _user_popup_class = UserPagedMenu
+
+
+class PersonalMenu(spmenu_radio.PersonalMenu):
+    '''
+    A paged menu popup that displays personal information to users.
+
+    See spmenu_radio.PersonalMenu for the usage and the attributes.
+    '''
+    _user_popup_class = UserPersonalMenu
+
+
+class PagedList(spmenu_radio.PagedList):
+    '''
+    A paged list popup.
+
+    See spmenu_radio.PagedList for the attributes.
+    '''
+    _user_popup_class = UserPagedList
+
+
+class LazyPagedMenu(spmenu_radio.LazyPagedMenu):
+    '''
+    A paged menu popup that gets its options from a data provider.
+
+    See spmenu_radio.LazyPagedMenu for the usage and the attributes.
+    '''
+    _user_popup_class = UserPagedMenu
+
+
+class LazyPagedList(spmenu_radio.LazyPagedList):
+    '''
+    A paged list popup that gets its items from a data provider.
+
+    See spmenu_radio.LazyPagedList for the usage and the attributes.
+    '''
+    _user_popup_class = UserPagedList
@@ -0,0 +1,52 @@
+'''
+Shared setup of the spmenu tests.
+
+The tests run against the stand-in EventScripts modules in
+benchmarks/standins, so no game server is needed:
+    python -m unittest discover -s tests
+'''
+import os
+import sys
+import unittest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(TESTS_DIR)
+sys.path[:0] = [os.path.join(ROOT_DIR, 'benchmarks', 'standins'), ROOT_DIR]
+
+import es
+import gamethread
+import playerlib
+
+import spmenu
+
+
+class SpmenuTestCase(unittest.TestCase):
+    '''Resets the popup state and activates the users before each test.'''
+
+    userids = (1, 2)
+    # {userid: language} of the users, 'en' if not given
+    languages = {}
+    bots = ()
+
+    def setUp(self):
+        es.addons.fire('es_map_start', {})
+        # run the delayed calls left by the previous test
+        gamethread.advance(3600)
+        self.usermanager = spmenu._usermanager
+        self.usermanager.users.clear()
+        spmenu.set_menuselect_limit(0)
+        playerlib.languages.clear()
+        playerlib.bots.clear()
+        playerlib.bots.update(self.bots)
+        for userid in self.userids:
+            playerlib.languages[userid] = self.languages.get(userid, 'en')
+            es.addons.fire('player_activate', {'userid': str(userid)})
+        es.reset_capture()
+
+    def select(self, userid, key):
+        '''Press a menuselect key as the user.'''
+        return self.usermanager.ccf(userid, ['menuselect', str(key)])
+
+    def displayed(self, userid):
+        '''Return the text last sent to the user.'''
+        return es.last_menu[userid][1]
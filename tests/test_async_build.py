@@ -0,0 +1,112 @@
+'''Tests of the asynchronous build_callback of the personal popups.'''
+import sys
+import thread
+import unittest
+
+import support
+import gamethread
+from spmenu import radio
+
+
+class Future(object):
+    '''A future completed by the test.'''
+
+    def __init__(self):
+        self.finished = False
+
+    def done(self):
+        return self.finished
+
+    def result(self):
+        return None
+
+
+class FutureBuildTest(support.SpmenuTestCase):
+
+    def setUp(self):
+        super(FutureBuildTest, self).setUp()
+        self.futures = []
+        self.popup = radio.PersonalPopup(self._build)
+        self.popup.async_build = radio.ASYNC_FUTURE
+
+    def _build(self, userid, userpopup):
+        future = Future()
+        self.futures.append(future)
+        userpopup.append('built for %s'%userid)
+        return future
+
+    def tearDown(self):
+        self._finish()
+
+    def _finish(self):
+        # the futures must be done before advancing the stand-in clock,
+        # the worker pool polls the pending futures on every tick
+        for future in self.futures:
+            future.finished = True
+        gamethread.advance(0)
+
+    def test_loading_until_done(self):
+        self.popup.send(1)
+        self.assertTrue('Loading' in self.displayed(1))
+        self._finish()
+        self.assertTrue('built for 1' in self.displayed(1))
+        self.assertFalse('Loading' in self.displayed(1))
+
+    def test_build_is_not_started_twice(self):
+        self.popup.send(1)
+        self.popup.send(1)
+        self.assertEqual(len(self.futures), 1)
+
+    def test_hidden_popup_is_not_shown(self):
+        other = radio.Popup()
+        other.append('other')
+        other.send(1)
+        self.popup.send(1)
+        self._finish()
+        self.assertTrue('other' in self.displayed(1))
+        self.select(1, 1)
+        self.assertTrue('built for 1' in self.displayed(1))
+
+    def test_callback_without_future(self):
+        self.popup.build_callback = lambda userid, userpopup: \
+            userpopup.append('built at once')
+        self.popup.send(1)
+        self.assertTrue('built at once' in self.displayed(1))
+
+
+class ThreadBuildTest(support.SpmenuTestCase):
+
+    def setUp(self):
+        super(ThreadBuildTest, self).setUp()
+        self.threads = []
+        self.popup = radio.PersonalPopup(self._build)
+        self.popup.async_build = radio.ASYNC_THREAD
+
+    def _build(self, userid, userpopup):
+        self.threads.append(thread.get_ident())
+        userpopup.append('built in thread')
+
+    def test_built_in_worker_thread(self):
+        self.popup.send(1)
+        # runs the handlers as the worker finishes
+        gamethread.advance(0)
+        self.assertEqual(len(self.threads), 1)
+        self.assertNotEqual(self.threads[0], thread.get_ident())
+        self.assertTrue('built in thread' in self.displayed(1))
+
+    def test_failed_build_stops_loading(self):
+        def fail(userid, userpopup):
+            raise RuntimeError('build failed')
+        self.popup.build_callback = fail
+        excepthook = sys.excepthook
+        sys.excepthook = lambda *exc_info: None
+        try:
+            self.popup.send(1)
+            gamethread.advance(0)
+        finally:
+            sys.excepthook = excepthook
+        self.assertFalse('Loading' in self.displayed(1))
+
+
+if __name__ == '__main__':
+    unittest.main()
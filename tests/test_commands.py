@@ -0,0 +1,48 @@
+'''Tests of the server commands registered by spmenu.'''
+import unittest
+
+import support
+import cmdlib
+import spmenu
+from spmenu import spmenu_stats
+from spmenu import spmenu_trace
+
+
+class StatsCommandTest(unittest.TestCase):
+
+    def tearDown(self):
+        spmenu_stats.register_command()
+
+    def test_registered_on_import(self):
+        self.assertTrue(
+            cmdlib.server_commands['spmenu_stats'] is spmenu_stats.stats_command)
+
+    def test_unregister_and_register_again(self):
+        spmenu_stats.unregister_command()
+        self.assertFalse('spmenu_stats' in cmdlib.server_commands)
+        spmenu_stats.unregister_command()
+        spmenu_stats.register_command()
+        spmenu_stats.register_command()
+        self.assertTrue('spmenu_stats' in cmdlib.server_commands)
+
+
+class RecordCommandTest(unittest.TestCase):
+
+    def tearDown(self):
+        spmenu.register_commands()
+
+    def test_registered_on_import(self):
+        self.assertTrue(cmdlib.server_commands['spmenu_record'] is
+            spmenu_trace.record_command)
+
+    def test_package_unregisters_both(self):
+        spmenu.unregister_commands()
+        self.assertFalse('spmenu_stats' in cmdlib.server_commands)
+        self.assertFalse('spmenu_record' in cmdlib.server_commands)
+        spmenu.register_commands()
+        self.assertTrue('spmenu_stats' in cmdlib.server_commands)
+        self.assertTrue('spmenu_record' in cmdlib.server_commands)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+'''Tests of the debug messages and the cached debug level.'''
+import unittest
+
+import support
+import es
+from spmenu import spmenu_common
+
+
+class Unformattable(object):
+    def __str__(self):
+        raise AssertionError('formatted')
+
+    __repr__ = __str__
+
+
+class DebugMessageTest(unittest.TestCase):
+
+    def setUp(self):
+        self.messages = []
+        self.es_dbgmsg = es.dbgmsg
+        es.dbgmsg = lambda level, text: self.messages.append((level, text))
+
+    def tearDown(self):
+        es.dbgmsg = self.es_dbgmsg
+        self._set_level('0')
+
+    def _set_level(self, level):
+        es.server_vars['eventscripts_debug'] = level
+        es.addons.fire('server_cvar', {'cvarname': 'eventscripts_debug',
+            'cvarvalue': level})
+
+    def test_level_follows_server_variable(self):
+        self._set_level('2')
+        self.assertEqual(spmenu_common._debug.level, 2)
+        self._set_level('0')
+        self.assertEqual(spmenu_common._debug.level, 0)
+
+    def test_message_over_level_is_not_formatted(self):
+        spmenu_common.dbgmsg(1, 'value %s', Unformattable())
+        spmenu_common.dbgmsg_repr(1, Unformattable())
+        self.assertEqual(self.messages, [])
+
+    def test_message_within_level_is_formatted(self):
+        self._set_level('1')
+        spmenu_common.dbgmsg(1, 'value %s', 3)
+        spmenu_common.dbgmsg_repr(1, 'text')
+        self.assertEqual(self.messages, [(1, 'value 3'), (1, "'text'")])
+
+    def test_constant_message_is_passed_on(self):
+        spmenu_common.dbgmsg(1, '100% constant')
+        self.assertEqual(self.messages, [(1, '100% constant')])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+'''Tests of refreshing the users at the end of the tick.'''
+import unittest
+
+import support
+import es
+import gamethread
+import spmenu
+from spmenu import radio
+from spmenu.spmenu_common import _usermanager
+
+
+def make_popup(text):
+    popup = radio.Popup()
+    popup.append(text)
+    return popup
+
+
+class DeferredDisplayTest(support.SpmenuTestCase):
+
+    def setUp(self):
+        super(DeferredDisplayTest, self).setUp()
+        spmenu.set_deferred_display(True)
+
+    def tearDown(self):
+        spmenu.set_deferred_display(False)
+
+    def test_sends_are_displayed_at_the_end_of_the_tick(self):
+        first = make_popup('first')
+        second = make_popup('second')
+        first.send(1)
+        second.send(1)
+        self.assertEqual(es.menu_calls, 0)
+        gamethread.advance(0)
+        self.assertEqual(es.menu_calls, 1)
+        self.assertTrue('first' in self.displayed(1))
+
+    def test_unsend_and_send_display_once(self):
+        first = make_popup('first')
+        second = make_popup('second')
+        first.send(1)
+        second.send(1)
+        gamethread.advance(0)
+        es.reset_capture()
+        first.unsend(1)
+        make_popup('third').send(1)
+        self.assertEqual(es.menu_calls, 0)
+        gamethread.advance(0)
+        self.assertEqual(es.menu_calls, 1)
+        self.assertTrue('second' in self.displayed(1))
+
+    def test_coalesced_refreshes_are_counted(self):
+        coalesced = _usermanager.coalesced_refreshes
+        for text in ('first', 'second', 'third'):
+            make_popup(text).send(1)
+        make_popup('other').send(2)
+        gamethread.advance(0)
+        self.assertEqual(_usermanager.coalesced_refreshes - coalesced, 2)
+        self.assertEqual(es.menu_calls, 2)
+
+    def test_disconnected_users_are_skipped(self):
+        make_popup('first').send(1)
+        make_popup('first').send(2)
+        es.addons.fire('player_disconnect', {'userid': '1'})
+        gamethread.advance(0)
+        self.assertFalse(1 in es.last_menu)
+        self.assertTrue(2 in es.last_menu)
+
+    def test_turning_off_flushes(self):
+        make_popup('first').send(1)
+        spmenu.set_deferred_display(False)
+        self.assertEqual(es.menu_calls, 1)
+        self.assertTrue('first' in self.displayed(1))
+        gamethread.advance(0)
+        self.assertEqual(es.menu_calls, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+'''Tests of the bounded userpopup registry of the popups.'''
+import gc
+import unittest
+
+import support
+import es
+import spmenu
+from spmenu import radio
+
+
+class IdleEvictionTest(support.SpmenuTestCase):
+
+    userids = tuple(xrange(1, 41))
+
+    def setUp(self):
+        super(IdleEvictionTest, self).setUp()
+        self.popup = radio.Popup()
+        self.popup.append('popup')
+        self.popup.max_idle_userpopups = 4
+
+    def _answer(self, userids):
+        for userid in userids:
+            self.popup.send(userid)
+            self.select(userid, 1)
+
+    def test_idle_userpopups_are_bounded(self):
+        self._answer(self.userids)
+        self.assertTrue(len(self.popup._users) <= 2*4)
+
+    def test_least_recently_used_are_dropped(self):
+        self._answer(self.userids)
+        self.assertTrue(40 in self.popup._users)
+        self.assertFalse(1 in self.popup._users)
+
+    def test_queued_userpopups_are_kept(self):
+        first = radio.Popup()
+        first.append('first')
+        first.send(1)
+        self.popup.send(1)
+        self._answer(self.userids[1:])
+        self.assertTrue(1 in self.popup._users)
+        self.select(1, 1)
+        self.assertTrue('popup' in self.displayed(1))
+
+    def test_disconnect_drops_userpopups(self):
+        self.popup.send(3)
+        es.addons.fire('player_disconnect', {'userid': '3'})
+        self.assertFalse(3 in self.popup._users)
+
+
+class PopupRegistryTest(support.SpmenuTestCase):
+
+    def _reported(self, popup):
+        return [count for reported, count in spmenu.memory_report()
+            if reported is popup]
+
+    def test_memory_report(self):
+        popup = radio.Popup()
+        popup.append('reported')
+        popup.send(1)
+        popup.send(2)
+        self.assertEqual(self._reported(popup), [2])
+
+    def test_deleted_popup_is_forgotten(self):
+        popup = radio.Popup()
+        popup_id = id(popup)
+        del popup
+        gc.collect()
+        self.assertFalse([reported for reported, count in
+            spmenu.memory_report() if id(reported) == popup_id])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+'''Tests of the paged menus reading their options from a provider.'''
+import unittest
+
+import support
+from spmenu import radio
+
+
+class RecordingProvider(object):
+    '''Makes the options on request and records the requested slices.'''
+
+    def __init__(self, count):
+        self.size = count
+        self.slices = []
+
+    def count(self):
+        return self.size
+
+    def slice(self, start, stop):
+        self.slices.append((start, stop))
+        return [radio.MenuOption(index, 'option %d'%index)
+            for index in xrange(start, min(stop, self.size))]
+
+
+class LazyPagedMenuTest(support.SpmenuTestCase):
+
+    def setUp(self):
+        super(LazyPagedMenuTest, self).setUp()
+        self.provider = RecordingProvider(100000)
+        self.menu = radio.LazyPagedMenu(self.provider)
+        self.menu.title = 'Lazy'
+        self.choices = []
+        self.menu.menuselect = lambda params: self.choices.append(
+            params['choice'])
+
+    def test_only_displayed_page_is_read(self):
+        self.menu.send(1, 5)
+        self.assertEqual(self.provider.slices, [(28, 35)])
+        self.assertTrue('option 28' in self.displayed(1))
+        self.assertEqual(self.menu.pages(), 14286)
+
+    def test_rendered_page_is_shared(self):
+        self.menu.send(1, 5)
+        self.menu.send(2, 5)
+        self.assertEqual(len(self.provider.slices), 1)
+
+    def test_choice_reads_one_option(self):
+        self.menu.send(1, 5)
+        del self.provider.slices[:]
+        self.select(1, 3)
+        self.assertEqual(self.choices, [30])
+        self.assertEqual(self.provider.slices, [(30, 31)])
+
+    def test_next_page(self):
+        self.menu.send(1)
+        self.select(1, 9)
+        self.assertEqual(self.provider.slices, [(0, 7), (7, 14)])
+
+    def test_invalidate(self):
+        self.menu.send(1)
+        self.menu.invalidate()
+        self.menu.send(2)
+        self.assertEqual(len(self.provider.slices), 2)
+
+    def test_option_edit_invalidates(self):
+        self.menu.send(1)
+        option = self.menu._option_at(0)
+        option.text = 'edited'
+        self.assertFalse(self.menu._render_cache)
+
+    def test_options_cannot_be_added(self):
+        self.assertRaises(radio.PopuplibError, self.menu.add, 1, 'added')
+
+
+class ColumnProviderTest(support.SpmenuTestCase):
+
+    def test_option_columns_as_provider(self):
+        columns = radio.OptionColumns()
+        for index in xrange(20):
+            columns.append(index, 'row %d'%index, index % 2)
+        menu = radio.LazyPagedList(columns)
+        menu.send(1, 2)
+        self.assertTrue('row 10' in self.displayed(1))
+        self.assertFalse('row 9' in self.displayed(1))
+
+
+if __name__ == '__main__':
+    unittest.main()
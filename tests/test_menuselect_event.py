@@ -0,0 +1,75 @@
+'''Tests of the MenuSelectEvent given to menuselect callbacks.'''
+import unittest
+
+import support
+from spmenu import radio
+from spmenu.spmenu_common import MenuSelectEvent
+
+
+class MenuSelectEventTest(support.SpmenuTestCase):
+
+    def setUp(self):
+        super(MenuSelectEventTest, self).setUp()
+        self.responses = []
+        self.menu = radio.PagedMenu()
+        self.menu.title = 'Events'
+        for index in xrange(10):
+            self.menu.add('choice %d'%index, 'option %d'%index)
+        self.menu.menuselect_args['team'] = 2
+        self.menu.menuselect = self.responses.append
+
+    def _respond(self, event):
+        self.menu.menuselect_event = event
+        self.menu.send(1)
+        self.select(1, 3)
+        return self.responses.pop()
+
+    def test_dict_by_default(self):
+        params = self._respond(False)
+        self.assertEqual(type(params), dict)
+        self.assertEqual(params['choice'], 'choice 2')
+        self.assertEqual(params['team'], 2)
+
+    def test_event_matches_dict(self):
+        params = self._respond(False)
+        event = self._respond(True)
+        self.assertTrue(isinstance(event, MenuSelectEvent))
+        self.assertEqual(sorted(event.keys()), sorted(params))
+        self.assertEqual(event.as_dict(), params)
+        self.assertEqual(dict(event.items()), params)
+        self.assertEqual(len(event), len(params))
+
+    def test_event_attributes(self):
+        event = self._respond(True)
+        self.assertEqual(event.userid, 1)
+        self.assertEqual(event.choice, 'choice 2')
+        self.assertEqual(event.raw_choice, 3)
+        self.assertEqual(event.page, 1)
+        self.assertTrue(event.popup is self.menu)
+        self.assertFalse(event.special)
+        self.assertEqual(event['team'], 2)
+        self.assertTrue('team' in event)
+        self.assertEqual(event.get('missing', 'default'), 'default')
+        self.assertRaises(KeyError, lambda: event['missing'])
+
+    def test_args_are_read_when_looked_up(self):
+        event = self._respond(True)
+        self.menu.menuselect_args['team'] = 3
+        self.assertEqual(event['team'], 3)
+
+    def test_popup_without_pages(self):
+        popup = radio.Popup()
+        popup.append('question')
+        popup.menuselect = self.responses.append
+        popup.menuselect_event = True
+        popup.send(1)
+        self.select(1, 5)
+        event = self.responses.pop()
+        self.assertEqual(event.choice, 5)
+        self.assertEqual(event.page, None)
+        self.assertFalse('page' in event)
+        self.assertEqual(sorted(event.keys()), sorted(event.as_dict()))
+
+
+if __name__ == '__main__':
+    unittest.main()
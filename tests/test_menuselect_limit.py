@@ -0,0 +1,83 @@
+'''Tests of the menuselect rate limit of the users.'''
+import unittest
+
+import support
+import gamethread
+import spmenu
+from spmenu import radio
+
+
+class MenuselectLimitTest(support.SpmenuTestCase):
+
+    def setUp(self):
+        super(MenuselectLimitTest, self).setUp()
+        self.calls = []
+        self.menu = radio.PagedMenu()
+        self.menu.title = 'Limited'
+        self.menu.menuselect = self.calls.append
+        for index in xrange(100):
+            self.menu.add(index, 'option %d'%index)
+        self.menu.send(1)
+        self.userpopup = self.menu._users[1]
+        spmenu.set_menuselect_limit(10, 3)
+        support.es.reset_capture()
+        self.throttled = self.usermanager.throttled_menuselects
+        self.merged = self.usermanager.merged_page_moves
+
+    def tearDown(self):
+        spmenu.set_menuselect_limit(0)
+
+    def test_burst_is_handled(self):
+        for press in xrange(3):
+            self.select(1, 9)
+        self.assertEqual(self.userpopup.pagenum, 4)
+        self.assertEqual(support.es.menu_calls, 3)
+        self.assertEqual(self.usermanager.throttled_menuselects,
+            self.throttled)
+
+    def test_page_moves_over_limit_are_merged(self):
+        for press in xrange(3):
+            self.select(1, 9)
+        for press in xrange(20):
+            self.select(1, 9)
+        for press in xrange(5):
+            self.select(1, 8)
+        self.assertEqual(support.es.menu_calls, 3)
+        gamethread.advance(0)
+        self.assertEqual(support.es.menu_calls, 4)
+        # the next page moves stop at the last page, 15
+        self.assertEqual(self.userpopup.pagenum, 10)
+        self.assertEqual(self.usermanager.merged_page_moves,
+            self.merged + 25)
+
+    def test_choices_over_limit_are_dropped(self):
+        for press in xrange(3):
+            self.select(1, 9)
+        self.select(1, 1)
+        gamethread.advance(0)
+        self.assertEqual(self.calls, [])
+        self.assertEqual(self.usermanager.throttled_menuselects,
+            self.throttled + 1)
+        self.assertEqual(self.usermanager[1].throttled_menuselects, 1)
+
+    def test_pending_page_move_applies_before_choice(self):
+        for press in xrange(6):
+            self.select(1, 9)
+        self.assertEqual(self.userpopup.pagenum, 4)
+        # the choice is for page 7, displayed at the end of the tick
+        self.usermanager[1]._tokens = 5
+        self.select(1, 1)
+        self.assertEqual(self.userpopup.pagenum, 7)
+        self.assertEqual([params['choice'] for params in self.calls], [42])
+
+    def test_no_limit(self):
+        spmenu.set_menuselect_limit(0)
+        for press in xrange(30):
+            self.select(1, 9)
+        self.assertEqual(support.es.menu_calls, 30)
+        self.assertEqual(self.usermanager.throttled_menuselects,
+            self.throttled)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+'''Tests of MenuOption change tracking and the column form of PagedMenu.'''
+import unittest
+
+import support
+from spmenu import radio
+import test_render_cache
+
+
+class ColumnPagedMenuCacheTest(test_render_cache.PagedMenuCacheTest):
+
+    columns = True
+
+    def test_option_edit_after_insert(self):
+        # column menus have no insert
+        pass
+
+    def test_removed_option_edit_keeps_cache(self):
+        removed = self.menu.remove(0)
+        self.menu.send(1)
+        removed.text = 'gone'
+        self.options[0].text = 'gone too'
+        self.assertEqual(len(self.menu._render_cache), 1)
+        self.assertFalse('gone' in self.displayed(1))
+        self.assertTrue('option 1' in self.displayed(1))
+
+    def test_remove_rerenders(self):
+        self.menu.send(1)
+        self.menu.send(2, 2)
+        self.menu.remove(3)
+        self.assertFalse(self.menu._render_cache)
+        self.menu.send(1)
+        self.assertFalse('option 3' in self.displayed(1))
+        self.assertTrue('option 7' in self.displayed(1))
+
+    def test_edit_after_remove_updates_its_row(self):
+        self.menu.remove(0)
+        self.menu.remove(5)
+        self.options[8].text = 'edited'
+        self.assertEqual(self.menu._columns.texts[6], 'edited')
+        self.menu.send(1, 1)
+        self.assertTrue('edited' in self.displayed(1))
+
+    def test_choice_edit_is_stored(self):
+        self.options[2].choice = 'new choice'
+        self.assertEqual(self.menu.find('new choice').text, 'option 2')
+        self.assertEqual(self.menu.find(2), None)
+
+    def test_removals_are_not_remembered(self):
+        for index in xrange(10):
+            self.menu.remove(index)
+        self.menu.add(10, 'after removals')
+        columns = self.menu._columns
+        self.assertEqual(len(columns.ids), 1)
+        self.assertEqual(columns.row(self.menu.find(10)), 0)
+
+
+class DuplicateOptionTest(support.SpmenuTestCase):
+
+    def test_duplicate_choices_edit_their_own_rows(self):
+        menu = radio.PagedMenu(columns=True)
+        menu.add('a', 'first')
+        first = menu.add('dup', 'first dup')
+        second = menu.add('dup', 'second dup')
+        second.text = 'second edited'
+        self.assertEqual(menu._columns.texts,
+            ['first', 'first dup', 'second edited'])
+        menu.remove('a')
+        first.text = 'first edited'
+        second.selectable = False
+        self.assertEqual(menu._columns.texts,
+            ['first edited', 'second edited'])
+        self.assertEqual(list(menu._columns.flags), [1, 0])
+
+    def test_same_option_on_two_pages(self):
+        menu = radio.PagedMenu()
+        option = radio.MenuOption('same', 'same option')
+        menu.append(option)
+        for index in xrange(10):
+            menu.add(index, 'option %d'%index)
+        menu.append(option)
+        menu.send(1)
+        menu.send(2, 2)
+        option.text = 'edited'
+        self.assertFalse(menu._render_cache)
+
+    def test_same_option_in_two_menus(self):
+        option = radio.MenuOption('same', 'same option')
+        menus = [radio.PagedMenu([option]), radio.PagedMenu()]
+        menus[1].append(option)
+        for userid, menu in zip(self.userids, menus):
+            menu.send(userid)
+        option.text = 'edited'
+        for userid, menu in zip(self.userids, menus):
+            self.assertFalse(menu._render_cache)
+            menu.send(userid)
+            self.assertTrue('edited' in self.displayed(userid))
+
+
+class ConstructorOptionsTest(support.SpmenuTestCase):
+
+    def test_constructor_option_edit_rerenders(self):
+        options = [radio.MenuOption(index, 'option %d'%index)
+            for index in xrange(3)]
+        menu = radio.PagedMenu(options)
+        menu.send(1)
+        options[1].text = 'edited'
+        menu.send(1)
+        self.assertTrue('edited' in self.displayed(1))
+        self.assertFalse('option 1' in self.displayed(1))
+
+
+if __name__ == '__main__':
+    unittest.main()
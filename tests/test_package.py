@@ -0,0 +1,37 @@
+'''Tests of the lazy loading of the popup backends.'''
+import os
+import subprocess
+import sys
+import unittest
+
+import support
+
+
+def _loaded_modules(statement):
+    '''Run the statement in a new interpreter, return the loaded modules.'''
+    script = ('import sys; sys.path[:0] = %r; %s; '
+        'print " ".join(sorted(sys.modules))'%(sys.path[:2], statement))
+    output = subprocess.Popen([sys.executable, '-c', script],
+        stdout=subprocess.PIPE, cwd=support.ROOT_DIR).communicate()[0]
+    return output.split()
+
+
+class LazyBackendTest(unittest.TestCase):
+
+    def test_import_loads_no_backend(self):
+        modules = _loaded_modules('import spmenu')
+        self.assertFalse('spmenu_radio' in modules or
+            'spmenu.spmenu_radio' in modules)
+
+    def test_star_import_loads_default_backend_only(self):
+        modules = _loaded_modules('from spmenu import *')
+        self.assertTrue('spmenu.spmenu_radio' in modules)
+        self.assertFalse('spmenu.spmenu_vgui' in modules)
+
+    def test_backend_loaded_on_access(self):
+        modules = _loaded_modules('import spmenu; spmenu.vgui')
+        self.assertTrue('spmenu.spmenu_vgui' in modules)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+'''Tests of the linked popup queue of the users.'''
+import random
+import unittest
+
+import support
+from spmenu.spmenu_common import _PopupQueue
+
+
+def _call(function, *args):
+    '''Return the result of the call or the type of the raised error.'''
+    try:
+        return function(*args)
+    except (IndexError, ValueError), error:
+        return type(error)
+
+
+class PopupQueueTest(unittest.TestCase):
+
+    def test_list_operations(self):
+        queue = _PopupQueue('abc')
+        queue.append('d')
+        queue.insert(0, 'z')
+        self.assertEqual(list(queue), ['z', 'a', 'b', 'c', 'd'])
+        self.assertEqual(queue.pop(0), 'z')
+        queue.remove('c')
+        self.assertEqual(list(queue), ['a', 'b', 'd'])
+        self.assertEqual(queue[0], 'a')
+        self.assertEqual(queue[-1], 'd')
+        self.assertEqual(queue.index('d'), 2)
+        self.assertTrue('b' in queue)
+        self.assertFalse('c' in queue)
+        self.assertEqual(len(queue), 3)
+
+    def test_duplicates(self):
+        queue = _PopupQueue('abab')
+        queue.remove('a')
+        self.assertEqual(list(queue), ['b', 'a', 'b'])
+        self.assertEqual(queue.index('b'), 0)
+        del queue[0]
+        self.assertEqual(list(queue), ['a', 'b'])
+        self.assertTrue('b' in queue)
+
+    def test_errors(self):
+        queue = _PopupQueue()
+        self.assertRaises(IndexError, queue.pop)
+        self.assertRaises(IndexError, lambda: queue[0])
+        self.assertRaises(ValueError, queue.remove, 'a')
+        self.assertRaises(ValueError, queue.index, 'a')
+
+    def test_matches_list(self):
+        rng = random.Random(1)
+        items = 'abcdef'
+        for trial in xrange(300):
+            queue = _PopupQueue()
+            expected = []
+            for step in xrange(30):
+                item = rng.choice(items)
+                operation = rng.choice(('append', 'insert', 'pop', 'remove',
+                    'set', 'del', 'index'))
+                if operation == 'append':
+                    queue.append(item)
+                    expected.append(item)
+                elif operation == 'insert':
+                    index = rng.randint(-3, 8)
+                    queue.insert(index, item)
+                    expected.insert(index, item)
+                elif operation == 'pop':
+                    index = rng.randint(-3, 5)
+                    self.assertEqual(_call(queue.pop, index),
+                        _call(expected.pop, index))
+                elif operation == 'remove':
+                    self.assertEqual(_call(queue.remove, item),
+                        _call(expected.remove, item))
+                elif operation == 'index':
+                    self.assertEqual(_call(queue.index, item),
+                        _call(expected.index, item))
+                elif expected:
+                    index = rng.randint(-len(expected), len(expected)-1)
+                    if operation == 'set':
+                        queue[index] = item
+                        expected[index] = item
+                    else:
+                        del queue[index]
+                        del expected[index]
+                self.assertEqual(list(queue), expected)
+                self.assertEqual(len(queue), len(expected))
+                for item in items:
+                    self.assertEqual(item in queue, item in expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+'''Tests of prefetching the pages next to the displayed page.'''
+import sys
+import threading
+import unittest
+
+import support
+import es
+import gamethread
+from spmenu import radio
+
+
+class BlockingProvider(object):
+    '''Makes the options, the reads in worker threads wait for release.'''
+
+    def __init__(self, count):
+        self.size = count
+        self.slices = []
+        self.released = threading.Event()
+        self.released.set()
+        self.main_thread = threading.current_thread()
+
+    def count(self):
+        return self.size
+
+    def slice(self, start, stop):
+        if threading.current_thread() is not self.main_thread:
+            self.released.wait(5)
+        self.slices.append((start, stop))
+        return [radio.MenuOption(index, 'option %d'%index)
+            for index in xrange(start, min(stop, self.size))]
+
+
+class PrefetchTest(support.SpmenuTestCase):
+
+    def setUp(self):
+        super(PrefetchTest, self).setUp()
+        self.provider = BlockingProvider(100)
+        self.menu = radio.LazyPagedMenu(self.provider)
+        self.menu.title = 'Prefetched'
+        self.menu.prefetch_pages = True
+
+    def tearDown(self):
+        self.provider.released.set()
+        gamethread.advance(0)
+
+    def _cached_pages(self):
+        return sorted(key[1] for key in self.menu._render_cache)
+
+    def test_adjacent_pages_are_rendered(self):
+        self.menu.send(1, 5)
+        gamethread.advance(0)
+        self.assertEqual(self._cached_pages(), [4, 5, 6])
+
+    def test_page_turn_uses_prefetched_page(self):
+        self.menu.send(1, 5)
+        gamethread.advance(0)
+        del self.provider.slices[:]
+        self.select(1, 9)
+        gamethread.advance(0)
+        self.assertTrue('option 35' in self.displayed(1))
+        # only page 7 is read, page 6 was prefetched
+        self.assertEqual(self.provider.slices, [(42, 49)])
+
+    def test_cached_pages_are_not_fetched(self):
+        self.menu.send(1, 5)
+        gamethread.advance(0)
+        reads = len(self.provider.slices)
+        self.menu.send(2, 5)
+        gamethread.advance(0)
+        self.assertEqual(len(self.provider.slices), reads)
+
+    def test_change_during_prefetch_drops_pages(self):
+        self.provider.released.clear()
+        self.menu.send(1, 5)
+        self.menu.invalidate()
+        self.provider.released.set()
+        gamethread.advance(0)
+        self.assertEqual(self._cached_pages(), [])
+
+    def test_disconnect_during_prefetch_drops_pages(self):
+        self.provider.released.clear()
+        self.menu.send(1, 5)
+        es.addons.fire('player_disconnect', {'userid': '1'})
+        self.provider.released.set()
+        raised = []
+        excepthook = sys.excepthook
+        sys.excepthook = lambda *exc_info: raised.append(exc_info)
+        try:
+            gamethread.advance(0)
+        finally:
+            sys.excepthook = excepthook
+        self.assertEqual(raised, [])
+        self.assertEqual(self._cached_pages(), [5])
+
+    def test_first_page_prefetches_next_only(self):
+        self.menu.send(1)
+        gamethread.advance(0)
+        self.assertEqual(self._cached_pages(), [1, 2])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+'''Tests of the popup queues of the users and their timeouts.'''
+import unittest
+
+import support
+import gamethread
+from spmenu import radio
+
+
+def _popup(line, **kw):
+    popup = radio.Popup()
+    popup.append(line)
+    for name, value in kw.iteritems():
+        setattr(popup, name, value)
+    return popup
+
+
+class QueueTest(support.SpmenuTestCase):
+
+    def test_popups_are_shown_in_order(self):
+        first, second = _popup('first'), _popup('second')
+        first.send(1)
+        second.send(1)
+        self.assertTrue('first' in self.displayed(1))
+        self.select(1, 1)
+        self.assertTrue('second' in self.displayed(1))
+        self.select(1, 1)
+        self.assertFalse(self.usermanager[1].queue)
+
+    def test_send_twice_queues_once(self):
+        popup = _popup('once')
+        popup.send(1)
+        popup.send(1)
+        self.assertEqual(len(self.usermanager[1].queue), 1)
+
+    def test_unsend_queued_popup(self):
+        first, second = _popup('first'), _popup('second')
+        first.send(1)
+        second.send(1)
+        second.unsend(1)
+        second.unsend(1)
+        self.assertEqual([userpopup._popup for userpopup in
+            self.usermanager[1].queue], [first])
+
+    def test_map_start_clears_queues(self):
+        _popup('first').send(1)
+        _popup('second').send(2)
+        support.es.addons.fire('es_map_start', {})
+        self.assertFalse(self.usermanager[1].queue)
+        self.assertFalse(self.usermanager[2].queue)
+
+
+class TimeoutTest(support.SpmenuTestCase):
+
+    def test_max_queue_time_drops_waiting_popup(self):
+        _popup('shown').send(1)
+        waiting = _popup('waiting', max_queue_time=3)
+        waiting.send(1)
+        gamethread.advance(2.5)
+        self.assertTrue(waiting._users[1] in self.usermanager[1].queue)
+        gamethread.advance(1.5)
+        self.assertFalse(waiting._users[1] in self.usermanager[1].queue)
+        self.assertEqual(len(self.usermanager[1].queue), 1)
+
+    def test_max_display_time_closes_shown_popup(self):
+        shown = _popup('shown', max_display_time=5)
+        shown.send(1)
+        _popup('next').send(1)
+        gamethread.advance(4.5)
+        self.assertTrue('shown' in self.displayed(1))
+        gamethread.advance(1)
+        self.assertTrue('next' in self.displayed(1))
+        self.assertEqual(len(self.usermanager[1].queue), 1)
+
+    def test_display_time_starts_when_displayed(self):
+        _popup('shown').send(1)
+        later = _popup('later', max_display_time=2)
+        later.send(1)
+        gamethread.advance(5)
+        self.select(1, 1)
+        self.assertTrue('later' in self.displayed(1))
+        gamethread.advance(1.5)
+        self.assertTrue('later' in self.displayed(1))
+        # displayed mid-tick, expires within a tick after the display time
+        gamethread.advance(1.6)
+        self.assertFalse(self.usermanager[1].queue)
+
+    def test_answered_popup_cancels_timers(self):
+        user = self.usermanager[1]
+        first = _popup('first', max_queue_time=30, max_display_time=30)
+        second = _popup('second', max_queue_time=30)
+        first.send(1)
+        second.send(1)
+        self.assertEqual(len(user._queue_timers), 2)
+        self.select(1, 1)
+        self.assertEqual(user._queue_timers.keys(), [second._users[1]])
+        self.assertTrue(user._display_timer is None or
+            user._display_timer[0] is not first._users[1])
+
+    def test_removed_popup_cancels_timer(self):
+        user = self.usermanager[1]
+        _popup('first').send(1)
+        second = _popup('second', max_queue_time=30)
+        second.send(1)
+        second.unsend(1)
+        self.assertFalse(user._queue_timers)
+        self.assertEqual(self.usermanager.timers.pending,
+            int(user._refresh_timer is not None))
+
+
+if __name__ == '__main__':
+    unittest.main()
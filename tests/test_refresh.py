@@ -0,0 +1,76 @@
+'''Tests of the timed refreshes of the displayed popups.'''
+import unittest
+
+import support
+import es
+import gamethread
+import spmenu
+from spmenu import radio
+
+
+class TimedRefreshTest(support.SpmenuTestCase):
+
+    def setUp(self):
+        super(TimedRefreshTest, self).setUp()
+        self.builds = []
+        self.popup = radio.PersonalPopup(self._build)
+        self.interval = spmenu._game_data['refresh']
+
+    def _build(self, userid, userpopup):
+        self.builds.append(userid)
+        userpopup[:] = ['built %d'%len(self.builds)]
+
+    def _refresh(self):
+        '''Advance past the first timed refresh, including its stagger.'''
+        gamethread.advance(self.interval * 1.5 + 2)
+
+    def test_refresh_sends_previous_text(self):
+        self.popup.send(1)
+        text = self.displayed(1)
+        builds = len(self.builds)
+        es.reset_capture()
+        refreshes = self.usermanager.cached_refreshes
+        self._refresh()
+        self.assertEqual(len(self.builds), builds)
+        self.assertTrue(es.menu_calls >= 1)
+        self.assertEqual(self.displayed(1), text)
+        self.assertTrue(self.usermanager.cached_refreshes > refreshes)
+
+    def test_rebuild_on_refresh(self):
+        self.popup.rebuild_on_refresh = True
+        self.popup.send(1)
+        builds = len(self.builds)
+        self._refresh()
+        self.assertTrue(len(self.builds) > builds)
+        self.assertTrue('built %d'%len(self.builds) in self.displayed(1))
+
+    def test_changed_menu_is_rendered_again(self):
+        menu = radio.PagedMenu()
+        menu.title = 'Menu'
+        option = menu.add(1, 'before')
+        menu.send(1)
+        option.text = 'after'
+        self._refresh()
+        self.assertTrue('after' in self.displayed(1))
+
+    def test_refresh_interval(self):
+        popup = radio.Popup()
+        popup.append('refreshed')
+        popup.send(1)
+        self._refresh()
+        es.reset_capture()
+        gamethread.advance(self.interval * 3 + 0.5)
+        self.assertEqual(es.menu_calls, 3)
+
+    def test_no_refresh_after_close(self):
+        popup = radio.Popup()
+        popup.append('closed')
+        popup.send(1)
+        self.select(1, 1)
+        es.reset_capture()
+        self._refresh()
+        self.assertEqual(es.menu_calls, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
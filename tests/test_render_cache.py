@@ -0,0 +1,69 @@
+'''Tests of the render caches of the radio popups and their invalidation.'''
+import unittest
+
+import support
+from spmenu import radio
+
+
+class PagedMenuCacheTest(support.SpmenuTestCase):
+
+    columns = False
+
+    def setUp(self):
+        super(PagedMenuCacheTest, self).setUp()
+        self.menu = radio.PagedMenu(columns=self.columns)
+        self.menu.title = 'Cached'
+        self.options = [self.menu.add(index, 'option %d'%index)
+            for index in xrange(10)]
+
+    def test_users_share_rendered_page(self):
+        self.menu.send(1)
+        self.menu.send(2)
+        self.assertEqual(len(self.menu._render_cache), 1)
+        self.assertEqual(self.displayed(1), self.displayed(2))
+
+    def test_option_edit_rerenders(self):
+        self.menu.send(1)
+        self.options[0].text = 'edited'
+        self.assertFalse(self.menu._render_cache)
+        self.menu.send(2)
+        self.assertTrue('edited' in self.displayed(2))
+
+    def test_add_rerenders_changed_pages_only(self):
+        self.menu.send(1)
+        self.menu.send(1, 2)
+        old_page = self.displayed(1)
+        self.menu.add(10, 'added')
+        self.assertEqual(sorted(key[1] for key in self.menu._render_cache),
+            [1])
+        self.menu.send(2, 2)
+        self.assertTrue('added' in self.displayed(2))
+        self.assertNotEqual(self.displayed(2), old_page)
+
+    def test_title_change_rerenders(self):
+        self.menu.send(1)
+        self.menu.title = 'Renamed'
+        self.menu.send(2)
+        self.assertTrue('Renamed' in self.displayed(2))
+        self.assertFalse('Cached' in self.displayed(2))
+
+    def test_option_edit_after_insert(self):
+        self.menu.insert(0, radio.MenuOption('first', 'inserted'))
+        self.menu.send(1, 2)
+        self.menu.send(2)
+        # option 6 moved to the second page
+        self.options[6].text = 'edited'
+        self.assertEqual([key[1] for key in self.menu._render_cache], [1])
+        self.menu.send(1, 2)
+        self.assertTrue('edited' in self.displayed(1))
+
+    def test_removed_option_edit_keeps_cache(self):
+        removed = self.menu.pop(0)
+        self.menu.send(1)
+        removed.text = 'gone'
+        self.assertEqual(len(self.menu._render_cache), 1)
+        self.assertFalse('gone' in self.displayed(1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+'''Tests of the language data, the menu chrome and the resource cache.'''
+import os
+import shutil
+import tempfile
+import unittest
+
+import support
+from spmenu import radio
+from spmenu import spmenu_resources
+
+
+class ChromeTest(support.SpmenuTestCase):
+
+    languages = {2: 'fi'}
+
+    def test_footers_have_navigation(self):
+        chrome = spmenu_resources.get_chrome('en')
+        self.assertTrue('->9. Next' in chrome['paged_first'])
+        self.assertFalse('8.' in chrome['paged_first'])
+        self.assertTrue('->8. Prev' in chrome['paged_middle'])
+        self.assertTrue('->9. Next' in chrome['paged_middle'])
+        self.assertTrue('->8. Prev' in chrome['paged_last'])
+        self.assertTrue(chrome['paged_single'].endswith('0. Close'))
+
+    def test_chrome_is_built_once(self):
+        self.assertTrue(spmenu_resources.get_chrome('fi') is
+            spmenu_resources.get_chrome('fi'))
+
+    def test_unknown_language_falls_back(self):
+        self.assertEqual(spmenu_resources.get_string('next', 'xx'), 'Next')
+        self.assertEqual(spmenu_resources.get_chrome('xx')['paged_first'],
+            spmenu_resources.get_chrome('en')['paged_first'])
+
+    def test_menu_uses_language_of_user(self):
+        menu = radio.PagedMenu()
+        for index in xrange(10):
+            menu.add(index, 'option %d'%index)
+        menu.send(1)
+        menu.send(2)
+        self.assertTrue('->9. Next' in self.displayed(1))
+        self.assertTrue('->9. Seuraava sivu' in self.displayed(2))
+        self.assertTrue('0. Peruuta' in self.displayed(2))
+
+
+class ResourceCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'data.ini')
+        self.cachename = os.path.join(self.directory, 'data.cache')
+        self._write('first')
+        self.parsed = []
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _write(self, text, mtime=1000000000):
+        datafile = open(self.filename, 'w')
+        datafile.write(text)
+        datafile.close()
+        os.utime(self.filename, (mtime, mtime))
+
+    def _parse(self, filename):
+        self.parsed.append(filename)
+        datafile = open(filename)
+        try:
+            return {'text': datafile.read().decode('ascii'), 'list': [1, 2]}
+        finally:
+            datafile.close()
+
+    def _load(self):
+        return spmenu_resources._load_cached(self.filename, self._parse)
+
+    def test_round_trip(self):
+        data = self._load()
+        self.assertTrue(os.path.exists(self.cachename))
+        self.assertEqual(self._load(), data)
+        self.assertEqual(len(self.parsed), 1)
+
+    def test_changed_file_is_parsed_again(self):
+        self._load()
+        self._write('second', 1000000100)
+        self.assertEqual(self._load()['text'], 'second')
+        self.assertEqual(len(self.parsed), 2)
+        self._load()
+        self.assertEqual(len(self.parsed), 2)
+
+    def test_changed_size_is_parsed_again(self):
+        self._load()
+        self._write('longer text')
+        self.assertEqual(self._load()['text'], 'longer text')
+
+    def test_corrupt_cache_is_parsed_again(self):
+        self._load()
+        cachefile = open(self.cachename, 'wb')
+        cachefile.write('not marshal data')
+        cachefile.close()
+        self.assertEqual(self._load()['text'], 'first')
+        self.assertEqual(len(self.parsed), 2)
+        self._load()
+        self.assertEqual(len(self.parsed), 2)
+
+    def test_cache_version_change(self):
+        self._load()
+        version = spmenu_resources.CACHE_VERSION
+        spmenu_resources.CACHE_VERSION = version + 1
+        try:
+            self._load()
+        finally:
+            spmenu_resources.CACHE_VERSION = version
+        self.assertEqual(len(self.parsed), 2)
+
+    def test_unwritable_cache_is_not_an_error(self):
+        # a directory in place of the cache file can not be opened
+        os.mkdir(self.cachename)
+        self.assertEqual(self._load()['text'], 'first')
+        self.assertEqual(self._load()['text'], 'first')
+        self.assertEqual(len(self.parsed), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+'''Tests of the deferred menuselect handling.'''
+import unittest
+
+import support
+import gamethread
+from spmenu import radio
+from spmenu import spmenu_stats
+
+
+class DeferredMenuselectTest(support.SpmenuTestCase):
+
+    def setUp(self):
+        super(DeferredMenuselectTest, self).setUp()
+        self.calls = []
+        self.menu = radio.PagedMenu()
+        self.menu.title = 'Slow'
+        self.menu.defer_slow_menuselect = True
+        self.menu.menuselect = self._menuselect
+        self.submenu = None
+        for index in xrange(5):
+            self.menu.add(index, 'option %d'%index)
+        # as if the recent menuselect calls had been over the budget
+        self.menu._stats.menuselect_average = 1.0
+
+    def _menuselect(self, params):
+        self.calls.append(params['choice'])
+        return self.submenu
+
+    def test_menuselect_runs_on_next_tick(self):
+        self.menu.send(1)
+        self.select(1, 2)
+        self.assertEqual(self.calls, [])
+        self.assertTrue(self.usermanager[1].queue[0]._popup is self.menu)
+        gamethread.advance(0)
+        self.assertEqual(self.calls, [1])
+        self.assertFalse(self.usermanager[1].queue)
+
+    def test_choices_while_pending_are_ignored(self):
+        self.menu.send(1)
+        self.select(1, 1)
+        self.select(1, 2)
+        self.select(1, 3)
+        gamethread.advance(0)
+        self.assertEqual(self.calls, [0])
+
+    def test_choices_ignored_when_menu_returns_itself(self):
+        self.submenu = self.menu
+        self.menu.send(1)
+        self.select(1, 1)
+        self.select(1, 2)
+        gamethread.advance(0)
+        self.assertEqual(self.calls, [0])
+        self.assertTrue(self.usermanager[1].queue[0]._popup is self.menu)
+
+    def test_returned_submenu_is_shown(self):
+        self.submenu = radio.Popup()
+        self.submenu.append('submenu')
+        self.menu.send(1)
+        self.select(1, 1)
+        gamethread.advance(0)
+        user = self.usermanager[1]
+        self.assertTrue(user.queue[0]._popup is self.submenu)
+        self.assertEqual([userpopup._popup for userpopup in user.navstack],
+            [self.menu])
+        self.assertTrue('submenu' in self.displayed(1))
+
+    def test_dropped_after_disconnect(self):
+        self.menu.send(1)
+        self.select(1, 1)
+        support.es.addons.fire('player_disconnect', {'userid': '1'})
+        gamethread.advance(0)
+        self.assertEqual(self.calls, [])
+
+    def test_dropped_after_unsend(self):
+        self.menu.send(1)
+        self.select(1, 1)
+        self.menu.unsend(1)
+        gamethread.advance(0)
+        self.assertEqual(self.calls, [])
+
+    def test_not_deferred_when_fast(self):
+        self.menu._stats.menuselect_average = 0.0
+        self.menu.send(1)
+        self.select(1, 1)
+        self.assertEqual(self.calls, [0])
+
+
+class SlowMenuselectTest(unittest.TestCase):
+
+    def setUp(self):
+        self.stats = spmenu_stats.PopupStats()
+        self.popup = radio.Popup()
+        self.budget = spmenu_stats.callback_budget
+        # hide the budget warnings
+        support.es.debug_level = -1
+
+    def tearDown(self):
+        support.es.debug_level = 0
+
+    def test_slow_build_does_not_mark_menuselect_slow(self):
+        self.stats.build_done(self.popup, self.budget * 10)
+        self.assertFalse(self.stats.menuselect_slow)
+
+    def test_fast_build_keeps_menuselect_slow(self):
+        self.stats.menuselect_done(self.popup, self.budget * 10)
+        self.stats.build_done(self.popup, 0)
+        self.assertTrue(self.stats.menuselect_slow)
+
+    def test_menuselect_time_is_smoothed(self):
+        for call in xrange(20):
+            self.stats.menuselect_done(self.popup, 0)
+        # a single slow call among fast ones
+        self.stats.menuselect_done(self.popup, self.budget * 2)
+        self.assertFalse(self.stats.menuselect_slow)
+        for call in xrange(5):
+            self.stats.menuselect_done(self.popup, self.budget * 2)
+        self.assertTrue(self.stats.menuselect_slow)
+        # one fast call after slow ones
+        self.stats.menuselect_done(self.popup, 0)
+        self.assertTrue(self.stats.menuselect_slow)
+
+
+if __name__ == '__main__':
+    unittest.main()
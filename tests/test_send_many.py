@@ -0,0 +1,65 @@
+'''Tests of sending a popup to many users at once.'''
+import unittest
+
+import support
+from spmenu import radio
+
+
+class CountingUserPagedMenu(radio.UserPagedMenu):
+    renders = 0
+
+    def generate_text(self):
+        CountingUserPagedMenu.renders += 1
+        return super(CountingUserPagedMenu, self).generate_text()
+
+
+class CountingPagedMenu(radio.PagedMenu):
+    _user_popup_class = CountingUserPagedMenu
+
+
+class SendManyTest(support.SpmenuTestCase):
+
+    userids = tuple(xrange(1, 11))
+    languages = dict((userid, 'fi') for userid in xrange(1, 6))
+    bots = (10,)
+
+    def setUp(self):
+        super(SendManyTest, self).setUp()
+        CountingUserPagedMenu.renders = 0
+        self.menu = CountingPagedMenu()
+        self.menu.title = 'Broadcast'
+        for index in xrange(20):
+            self.menu.add(index, 'option %d'%index)
+
+    def test_each_view_is_rendered_once(self):
+        self.menu.send_many(self.userids)
+        # one render per language
+        self.assertEqual(CountingUserPagedMenu.renders, 2)
+        self.assertEqual(self.displayed(1), self.displayed(5))
+        self.assertEqual(self.displayed(6), self.displayed(9))
+        self.assertNotEqual(self.displayed(1), self.displayed(6))
+
+    def test_pages_are_views(self):
+        self.menu.send_many(self.userids, 2)
+        self.assertEqual(CountingUserPagedMenu.renders, 2)
+        self.assertTrue('option 7' in self.displayed(9))
+
+    def test_bots_are_skipped(self):
+        userpopups = self.menu.send_many(self.userids)
+        self.assertEqual(len(userpopups), 9)
+        self.assertFalse(10 in support.es.last_menu)
+        self.assertEqual(self.menu._stats.sends, 9)
+
+    def test_queued_users_get_popup_later(self):
+        first = radio.Popup()
+        first.append('first')
+        first.send(1)
+        self.menu.send_many(self.userids)
+        self.assertTrue('first' in self.displayed(1))
+        self.select(1, 1)
+        self.assertEqual(self.displayed(1), self.displayed(2))
+        self.assertEqual(CountingUserPagedMenu.renders, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
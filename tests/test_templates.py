@@ -0,0 +1,86 @@
+'''Tests of the compiled templates of TemplatePopup and their cache.'''
+import string
+import unittest
+
+import support
+from spmenu import radio
+from spmenu.spmenu_radio import _CompiledTemplate
+
+
+class Score(object):
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self):
+        return str(self.value)
+
+
+class CompiledTemplateTest(unittest.TestCase):
+
+    def test_substitutes_like_string_template(self):
+        cases = [
+            ('hi $name, ${x}y 100% $$', (), {'name': 'N', 'x': 1}),
+            ('a $b', ({'b': 2},), {}),
+            ('a $b', ({'b': 2},), {'b': 3}),
+            ('plain %s', (), {}),
+            ]
+        for text, args, kw in cases:
+            self.assertEqual(_CompiledTemplate(text).substitute(*args, **kw),
+                string.Template(text).substitute(*args, **kw))
+
+    def test_errors_like_string_template(self):
+        for text, error in (('bad $ x', ValueError), ('a $b', KeyError)):
+            self.assertRaises(error, _CompiledTemplate(text).substitute)
+            self.assertRaises(error, string.Template(text).substitute)
+
+
+class TemplatePopupCacheTest(support.SpmenuTestCase):
+
+    def test_same_arguments_share_render(self):
+        popup = radio.TemplatePopup(['Hello $name', 'score ${score}'])
+        popup.send(1, name='bob', score=3)
+        popup.send(2, name='bob', score=3)
+        self.assertEqual(len(popup._render_cache), 1)
+        self.assertTrue('Hello bob' in self.displayed(1))
+        self.assertTrue('score 3' in self.displayed(1))
+        self.assertEqual(self.displayed(1), self.displayed(2))
+
+    def test_mapping_argument_shares_render(self):
+        popup = radio.TemplatePopup(['Hello $name'])
+        popup.send(1, {'name': 'bob'})
+        popup.send(2, {'name': 'bob'})
+        self.assertEqual(len(popup._render_cache), 1)
+        self.assertTrue('Hello bob' in self.displayed(2))
+
+    def test_line_edit_recompiles(self):
+        popup = radio.TemplatePopup(['Hello $name'])
+        popup.send(1, name='bob')
+        popup[0] = 'Bye $name'
+        popup.send(2, name='bob')
+        self.assertTrue('Bye bob' in self.displayed(2))
+
+    def test_mutated_object_is_not_cached(self):
+        popup = radio.TemplatePopup(['score $score'])
+        score = Score(1)
+        popup.send(1, score=score)
+        self.assertTrue('score 1' in self.displayed(1))
+        score.value = 99
+        popup.send(2, score=score)
+        self.assertTrue('score 99' in self.displayed(2))
+        self.assertFalse(popup._render_cache)
+
+    def test_object_in_mapping_is_not_cached(self):
+        popup = radio.TemplatePopup(['score $score'])
+        score = Score(1)
+        popup.send(1, {'score': score})
+        score.value = 99
+        popup.send(2, {'score': score})
+        self.assertTrue('score 99' in self.displayed(2))
+
+    def test_missing_key_raises(self):
+        popup = radio.TemplatePopup(['Hello $name'])
+        self.assertRaises(KeyError, popup.send, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
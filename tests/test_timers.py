@@ -0,0 +1,96 @@
+'''Tests of the timer wheel and the timed refreshes driven by it.'''
+import unittest
+
+import support
+import gamethread
+import spmenu
+from spmenu import radio
+from spmenu.spmenu_common import _TimerWheel
+
+
+class TimerWheelTest(support.SpmenuTestCase):
+
+    def setUp(self):
+        super(TimerWheelTest, self).setUp()
+        self.wheel = _TimerWheel()
+        self.fired = []
+
+    def _fire(self, name):
+        self.fired.append((name, gamethread.now))
+
+    def _schedule(self, delay, name, spread=0):
+        start = gamethread.now
+        self.wheel.schedule(delay, self._fire, (name,), spread)
+        return start
+
+    def test_idle_wheel_expires_on_time(self):
+        self._schedule(2.0, 'timer')
+        gamethread.advance(1.9)
+        self.assertEqual(self.fired, [])
+        gamethread.advance(0.2)
+        self.assertEqual(len(self.fired), 1)
+
+    def test_scheduled_mid_tick_never_expires_early(self):
+        self._schedule(10, 'keeps the wheel running')
+        gamethread.advance(0.9)
+        for delay in (0.5, 1.0, 2.0):
+            start = self._schedule(delay, delay)
+        gamethread.advance(5)
+        self.assertEqual(len(self.fired), 3)
+        for name, fired in self.fired:
+            self.assertTrue(fired - start >= name - 1e-6,
+                (name, fired - start))
+            self.assertTrue(fired - start <= name + self.wheel.tick + 1e-6)
+
+    def test_scheduled_from_timer_keeps_interval(self):
+        def repeat():
+            self._fire('repeat')
+            if len(self.fired) < 4:
+                self.wheel.schedule(2.0, repeat)
+        self.wheel.schedule(2.0, repeat)
+        gamethread.advance(20)
+        self.assertEqual(len(self.fired), 4)
+        times = [fired for name, fired in self.fired]
+        for previous, fired in zip(times, times[1:]):
+            self.assertAlmostEqual(fired - previous, 2.0)
+
+    def test_spread_only_delays(self):
+        self._schedule(20, 'keeps the wheel running')
+        gamethread.advance(0.5)
+        start = gamethread.now
+        for index in xrange(20):
+            self._schedule(2.0, index, spread=3)
+        gamethread.advance(10)
+        self.assertEqual(len(self.fired), 20)
+        for name, fired in self.fired:
+            self.assertTrue(2.0 - 1e-6 <= fired - start <= 2.0 + 3 + 1 + 1e-6)
+
+    def test_cancel(self):
+        timer = self.wheel.schedule(1.0, self._fire, ('cancelled',))
+        self.wheel.cancel(timer)
+        self.assertEqual(self.wheel.pending, 0)
+        gamethread.advance(3)
+        self.assertEqual(self.fired, [])
+
+
+class ShortTimeoutTest(support.SpmenuTestCase):
+
+    def test_display_time_while_wheel_runs(self):
+        # a refreshing popup keeps the wheel of the user manager running
+        refreshing = radio.Popup()
+        refreshing.append('refreshing')
+        refreshing.max_display_time = 100
+        refreshing.send(2)
+        gamethread.advance(0.9)
+        popup = radio.Popup()
+        popup.append('short')
+        popup.max_display_time = 1
+        popup.send(1)
+        gamethread.advance(0.5)
+        self.assertTrue(self.usermanager[1].queue)
+        gamethread.advance(1.5)
+        self.assertFalse(self.usermanager[1].queue)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+'''Tests of recording popup traffic and replaying the traces.'''
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import support
+import cmdlib
+import es
+import spmenu
+from spmenu import radio
+from spmenu import spmenu_trace
+
+sys.path.insert(0, os.path.join(support.ROOT_DIR, 'benchmarks'))
+import replay
+
+
+class TraceTest(support.SpmenuTestCase):
+
+    def setUp(self):
+        super(TraceTest, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'trace.bin')
+
+    def tearDown(self):
+        spmenu.stop_recording()
+        shutil.rmtree(self.directory)
+
+    def _record(self):
+        '''Record some traffic and return the number of events.'''
+        spmenu.start_recording(self.filename)
+        menu = radio.PagedMenu()
+        for index in xrange(20):
+            menu.add(index, 'option %d'%index)
+        popup = radio.Popup()
+        popup.append('popup')
+        menu.send(1, 2)
+        popup.send(1)
+        popup.unsend(1)
+        self.select(1, 9)
+        es.addons.fire('player_disconnect', {'userid': '2'})
+        es.addons.fire('es_map_start', {})
+        return spmenu.stop_recording()
+
+    def test_records_events(self):
+        self.assertEqual(self._record(), 8)
+        events = [(event, data) for seconds, event, data in
+            spmenu_trace.read_trace(self.filename)]
+        self.assertEqual(events, [
+            (spmenu_trace.EVENT_POPUP, (1, 20, 'PagedMenu')),
+            (spmenu_trace.EVENT_SEND, (1, 1, 2)),
+            (spmenu_trace.EVENT_POPUP, (2, 1, 'Popup')),
+            (spmenu_trace.EVENT_SEND, (1, 2, 0)),
+            (spmenu_trace.EVENT_UNSEND, (1, 2)),
+            (spmenu_trace.EVENT_MENUSELECT, (1, 9)),
+            (spmenu_trace.EVENT_DISCONNECT, (2,)),
+            (spmenu_trace.EVENT_MAP_START, ()),
+            ])
+
+    def test_stop_without_recording(self):
+        self.assertEqual(spmenu.stop_recording(), None)
+
+    def test_record_command(self):
+        # hide the console output
+        es.debug_level = -1
+        try:
+            cmdlib.server_commands['spmenu_record'](['start', self.filename])
+            self.assertTrue(self.usermanager.recorder is not None)
+            cmdlib.server_commands['spmenu_record'](['stop'])
+            self.assertTrue(self.usermanager.recorder is None)
+        finally:
+            es.debug_level = 0
+
+    def test_not_a_trace(self):
+        tracefile = open(self.filename, 'wb')
+        tracefile.write('something else')
+        tracefile.close()
+        self.assertRaises(ValueError, list,
+            spmenu_trace.read_trace(self.filename))
+
+    def test_replay(self):
+        self._record()
+        report = replay.replay(self.filename)
+        self.assertEqual(report['meta']['popups'], 2)
+        self.assertEqual(report['events']['send']['count'], 2)
+        self.assertEqual(report['events']['menuselect']['count'], 1)
+        self.assertTrue(report['events']['send']['menu_calls'] >= 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+'''Tests of creating the users and reading their player information.'''
+import unittest
+
+import support
+import es
+import playerlib
+from spmenu import radio
+
+
+class UserRegistryTest(support.SpmenuTestCase):
+
+    languages = {2: 'fi'}
+    bots = (2,)
+
+    def setUp(self):
+        super(UserRegistryTest, self).setUp()
+        self.lookups = []
+        self.getPlayer = playerlib.getPlayer
+        def getPlayer(userid):
+            self.lookups.append(userid)
+            return self.getPlayer(userid)
+        playerlib.getPlayer = getPlayer
+
+    def tearDown(self):
+        playerlib.getPlayer = self.getPlayer
+
+    def test_activate_reads_player(self):
+        user = self.usermanager.users[2]
+        self.assertEqual(user.language, 'fi')
+        self.assertTrue(user.bot)
+        self.assertFalse(self.usermanager.users[1].bot)
+
+    def test_send_does_not_read_player(self):
+        popup = radio.Popup()
+        popup.append('popup')
+        popup.send(1)
+        self.assertEqual(self.lookups, [])
+
+    def test_activate_again_refreshes_player(self):
+        user = self.usermanager.users[1]
+        playerlib.languages[1] = 'de'
+        es.addons.fire('player_activate', {'userid': '1'})
+        self.assertTrue(self.usermanager.users[1] is user)
+        self.assertEqual(user.language, 'de')
+
+    def test_user_not_activated(self):
+        user = self.usermanager[3]
+        self.assertEqual(self.lookups, [3])
+        self.assertEqual(user.language, 'en')
+        self.assertTrue(self.usermanager[3] is user)
+        self.assertRaises(TypeError, lambda: self.usermanager['3'])
+
+    def test_activate_missing_player(self):
+        def getPlayer(userid):
+            raise playerlib.UseridError(userid)
+        playerlib.getPlayer = getPlayer
+        debug_level = es.debug_level
+        es.debug_level = -1
+        try:
+            es.addons.fire('player_activate', {'userid': '4'})
+        finally:
+            es.debug_level = debug_level
+        self.assertFalse(4 in self.usermanager.users)
+
+    def test_users_are_slotted(self):
+        self.assertFalse(hasattr(self.usermanager.users[1], '__dict__'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+'''Tests of the ESC menu popups.'''
+import unittest
+
+import support
+import es
+import spmenu
+
+
+class EscMenuTest(support.SpmenuTestCase):
+
+    def setUp(self):
+        super(EscMenuTest, self).setUp()
+        self.menu = spmenu.vgui.PagedMenu()
+        self.menu.title = 'Title'
+        for index in xrange(3):
+            self.menu.add(index, 'item %d'%index)
+
+    def _keygroup(self, userid):
+        return es.keygroups[es.last_menu[userid][1]]
+
+    def test_keygroup_has_title_and_items(self):
+        self.menu.send(1)
+        keygroup = self._keygroup(1)
+        self.assertEqual(keygroup['menu']['title'], 'Title')
+        self.assertEqual(keygroup['1']['msg'], 'item 0')
+        self.assertEqual(keygroup['1']['command'], 'menuselect 1')
+        self.assertEqual(keygroup['0']['command'], 'menuselect 10')
+
+    def test_users_share_keygroup(self):
+        self.menu.send(1)
+        self.menu.send(2)
+        self.assertEqual(es.last_menu[1][1], es.last_menu[2][1])
+
+    def test_bytes_sent_counted_per_send(self):
+        self.menu.send(1)
+        keygroup = self._keygroup(1)
+        size = sum(len(values.get('title', '')) + len(values['msg'])
+            for values in keygroup.itervalues())
+        self.assertEqual(self.menu._stats.bytes_sent, size)
+        self.menu.send(2)
+        self.assertEqual(self.menu._stats.bytes_sent, 2*size)
+
+    def test_choice(self):
+        choices = []
+        self.menu.menuselect = lambda params: choices.append(params['choice'])
+        self.menu.send(1)
+        self.select(1, 2)
+        self.assertEqual(choices, [1])
+
+
+if __name__ == '__main__':
+    unittest.main()